@@ -0,0 +1,78 @@
+"""Requests/sec and tail latency of the async endpoints against the old
+sync-handler-in-threadpool style, at several client concurrencies.
+
+    python -m benchmarks.async_vs_sync --concurrency 50 200 1000 --db-latency-ms 5
+"""
+import argparse
+import asyncio
+import json
+from typing import Optional
+
+from benchmarks.common import benchmark_database, drive, simulate_db_latency
+
+from django.db import connection
+from fastapi import FastAPI
+from service.models import Article, CustomUser
+from service.pagination import paginate
+from service.queries import plan_queryset
+from service.schemas import ArticleSerializer
+
+
+def build_sync_app():
+    """The read endpoints as they were before the async port: plain `def`
+    handlers that FastAPI runs on its anyio threadpool."""
+    sync_app = FastAPI()
+
+    @sync_app.get("/articles/")
+    def list_articles(cursor: Optional[str] = None, limit: int = 20):
+        articles, next_cursor = paginate(plan_queryset(Article.objects.all(), ArticleSerializer), ('-published_date', '-id'), cursor, limit)
+        return {"items": [ArticleSerializer.model_validate(article) for article in articles], "next_cursor": next_cursor}
+
+    @sync_app.get("/articles/{article_id}/")
+    def get_article(article_id: int):
+        article = plan_queryset(Article.objects.all(), ArticleSerializer).get(id=article_id)
+        return ArticleSerializer.model_validate(article)
+
+    return sync_app
+
+
+def seed(articles):
+    author = CustomUser.objects.create(username='bench', email='bench@example.com')
+    Article.objects.bulk_create(
+        Article(title=f'Article {i}', content='lorem ipsum ' * 50, author=author)
+        for i in range(articles)
+    )
+    return list(Article.objects.values_list('id', flat=True)[:100])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run')
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                        help='block every query this long to mimic a remote database')
+    parser.add_argument('--close-connections', action='store_true',
+                        help='close connections after each async request (CONN_MAX_AGE=0); by default '
+                             'they persist, as they always did for the sync threadpool')
+    args = parser.parse_args()
+
+    if args.db_latency_ms:
+        simulate_db_latency(args.db_latency_ms / 1000)
+
+    from fastapi_app import app as async_app
+
+    results = []
+    with benchmark_database():
+        connection.settings_dict['CONN_MAX_AGE'] = 0 if args.close_connections else None
+        ids = seed(args.articles)
+        paths = ['/articles/'] + [f'/articles/{article_id}/' for article_id in ids]
+        for mode, app in (('sync', build_sync_app()), ('async', async_app)):
+            for concurrency in args.concurrency:
+                stats = asyncio.run(drive(app, paths, concurrency, args.requests))
+                results.append({'mode': mode, 'concurrency': concurrency, **stats})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Articles written per second through the single-item endpoint against the
+bulk JSON and NDJSON endpoints.
+
+    python -m benchmarks.bulk --articles 5000 --concurrency 1
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import benchmark_database, simulate_db_latency
+
+import httpx
+from django.db import connection
+from rest_framework.authtoken.models import Token
+from service.models import Article, Category, CustomUser
+
+
+def payloads(count, category_id):
+    return [
+        {'title': f'Imported {i}', 'content': 'lorem ipsum ' * 50, 'tags': ['import', f'batch{i % 20}'],
+         'categories': [category_id]}
+        for i in range(count)
+    ]
+
+
+async def single(client, items, concurrency):
+    queue = iter(items)
+
+    async def worker():
+        for item in queue:
+            (await client.post('/articles/', json=item)).raise_for_status()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def bulk_json(client, items, batch):
+    for start in range(0, len(items), batch):
+        (await client.post('/articles/bulk/', json=items[start:start + batch])).raise_for_status()
+
+
+async def bulk_ndjson(client, items):
+    body = ''.join(json.dumps(item) + '\n' for item in items)
+    (await client.post('/articles/bulk/ndjson/', content=body,
+                       headers={'Content-Type': 'application/x-ndjson'})).raise_for_status()
+
+
+async def run(app, token, mode, items, args):
+    transport = httpx.ASGITransport(app=app)
+    headers = {'Authorization': f'Bearer {token}'}
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', headers=headers, timeout=None) as client:
+        started = time.perf_counter()
+        if mode == 'single':
+            await single(client, items, args.concurrency)
+        elif mode == 'bulk':
+            await bulk_json(client, items, args.batch)
+        else:
+            await bulk_ndjson(client, items)
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--articles', type=int, default=5000, help='articles written per mode')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='clients for the single-item mode; SQLite only takes one writer at a time')
+    parser.add_argument('--batch', type=int, default=1000, help='items per bulk JSON request')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                        help='block every query this long to mimic a remote database')
+    args = parser.parse_args()
+
+    if args.db_latency_ms:
+        simulate_db_latency(args.db_latency_ms / 1000)
+
+    from fastapi_app import app
+
+    results = []
+    with benchmark_database():
+        connection.settings_dict['CONN_MAX_AGE'] = None
+        user = CustomUser.objects.create(username='bench', email='bench@example.com')
+        token = Token.objects.create(user=user).key
+        items = payloads(args.articles, Category.objects.create(name='Imports').id)
+        for mode in ('single', 'bulk', 'ndjson'):
+            before = Article.objects.count()
+            elapsed = asyncio.run(run(app, token, mode, items, args))
+            written = Article.objects.count() - before
+            results.append({'mode': mode, 'articles': written, 'seconds': round(elapsed, 2),
+                            'rows_per_sec': round(written / elapsed, 1)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
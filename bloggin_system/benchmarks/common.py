@@ -0,0 +1,91 @@
+import asyncio
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bloggin_system.settings")
+django.setup()
+
+import httpx
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+
+@contextmanager
+def benchmark_database():
+    """A throwaway, fully migrated database so benchmarks never touch the
+    development data. SQLite gets a temporary file rather than the test
+    runner's in-memory database so that every thread sees the same rows."""
+    if connection.vendor == 'sqlite':
+        handle, path = tempfile.mkstemp(prefix='bench-', suffix='.sqlite3')
+        os.close(handle)
+        connection.settings_dict['TEST']['NAME'] = path
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(connection.settings_dict['NAME'], verbosity=0)
+
+
+def simulate_db_latency(seconds):
+    """Make every query on every connection block for `seconds`, standing in
+    for a remote database under load."""
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        # The wrapper object outlives reconnects; only add the delay once.
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    connection_created.connect(install, weak=False)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def drive(app, requests, concurrency, total, headers=None):
+    """Send `total` requests cycling through `requests` from `concurrency`
+    clients against `app` in-process, and summarize the latencies. Each
+    request is a path to GET or a (method, path, httpx keyword arguments)
+    tuple."""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', headers=headers, timeout=None) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                request = requests[i % len(requests)]
+                method, path, kwargs = ('GET', request, {}) if isinstance(request, str) else request
+                started = time.perf_counter()
+                response = await client.request(method, path, **kwargs)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, errors)
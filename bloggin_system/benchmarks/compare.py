@@ -0,0 +1,64 @@
+"""Compare two benchmarks.suite reports and fail on regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 10
+
+A scenario regresses when its RPS drops, or its p95/p99 latency or queries
+per request grow, by more than --threshold percent. Exits 1 if any did.
+No database or Django setup is needed.
+"""
+import argparse
+import json
+import sys
+
+# metric: True when higher is better.
+METRICS = {'rps': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False, 'queries_per_request': False}
+GATED = ('rps', 'p95_ms', 'p99_ms', 'queries_per_request')
+
+
+def change(before, after):
+    if before == after:
+        return 0.0
+    if not before:
+        return float('inf')
+    return (after - before) / before * 100
+
+
+def compare(baseline, candidate, threshold):
+    """Rows of per-scenario, per-metric changes, each marked as a
+    regression or not; scenarios missing from either run are skipped."""
+    before = {result['scenario']: result for result in baseline['results']}
+    rows = []
+    for result in candidate['results']:
+        old = before.get(result['scenario'])
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            delta = change(old[metric], result[metric])
+            worse = -delta if higher_is_better else delta
+            rows.append({
+                'scenario': result['scenario'], 'metric': metric, 'before': old[metric], 'after': result[metric],
+                'change_pct': round(delta, 1), 'regression': metric in GATED and worse > threshold,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed change, in percent')
+    args = parser.parse_args()
+    with open(args.baseline) as baseline, open(args.candidate) as candidate:
+        rows = compare(json.load(baseline), json.load(candidate), args.threshold)
+    for row in rows:
+        flag = 'REGRESSION' if row['regression'] else ''
+        print(f"{row['scenario']:<32} {row['metric']:<20} {row['before']:>10} -> {row['after']:<10} "
+              f"{row['change_pct']:>+8.1f}% {flag}")
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print(f'{len(regressions)} regressions above {args.threshold}%', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Article read latency while a storm of logins hashes passwords, with the
+hashing on the shared sync threads against in its own process pool.
+
+    python -m benchmarks.login_storm --logins 40 --login-concurrency 20 --read-concurrency 20
+
+Reads are measured alone first, then for as long as the storm lasts. Logins
+turned away with a 429 because the hashing queue is full are counted
+separately from the ones that were served.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+from benchmarks.common import benchmark_database, summarize
+
+import httpx
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from service.models import Article, CustomUser
+from service.passwords import shutdown_pool
+
+PASSWORD = 'correct horse battery staple'
+
+
+def seed(users, articles):
+    # One hash shared by every account; hashing each would take minutes.
+    encoded = make_password(PASSWORD)
+    CustomUser.objects.bulk_create(
+        CustomUser(username=f'user{i}', email=f'user{i}@example.com', password=encoded) for i in range(users)
+    )
+    author = CustomUser.objects.get(username='user0')
+    Article.objects.bulk_create(
+        Article(title=f'Article {i}', content='lorem ipsum ' * 50, author=author) for i in range(articles)
+    )
+    return list(Article.objects.values_list('id', flat=True))
+
+
+async def run(app, ids, args, storm):
+    latencies = []
+    logins = Counter()
+    done = asyncio.Event()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        remaining = iter(range(args.logins))
+
+        async def login_worker():
+            for i in remaining:
+                password = PASSWORD if i % 4 else 'wrong'
+                response = await client.post('/login/', data={'username': f'user{i % args.users}', 'password': password})
+                logins[response.status_code] += 1
+
+        async def read_worker(offset):
+            i = offset
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get(f'/articles/{ids[i % len(ids)]}/')
+                latencies.append(time.perf_counter() - started)
+                i += args.read_concurrency
+                if not storm and len(latencies) >= args.reads:
+                    done.set()
+
+        async def storm_then_stop():
+            await asyncio.gather(*(login_worker() for _ in range(args.login_concurrency)))
+            done.set()
+
+        started = time.perf_counter()
+        tasks = [read_worker(offset) for offset in range(args.read_concurrency)]
+        if storm:
+            tasks.append(storm_then_stop())
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    return {**summarize(latencies, elapsed), 'logins': dict(sorted(logins.items()))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--login-concurrency', type=int, default=20)
+    parser.add_argument('--read-concurrency', type=int, default=20)
+    parser.add_argument('--reads', type=int, default=2000, help='reads in the baseline run')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--articles', type=int, default=100)
+    parser.add_argument('--processes', type=int, default=settings.PASSWORD_HASH_PROCESSES)
+    args = parser.parse_args()
+
+    # The storm comes from one client; only the hashing capacity should limit it.
+    settings.AUTH_RATE_PER_IP = settings.AUTH_RATE_PER_USERNAME = 10 ** 6
+    from fastapi_app import app
+
+    results = []
+    with benchmark_database():
+        connection.settings_dict['CONN_MAX_AGE'] = None
+        ids = seed(args.users, args.articles)
+        results.append({'mode': 'reads only', **asyncio.run(run(app, ids, args, storm=False))})
+        for mode, processes in (('threads', 0), ('processes', args.processes)):
+            settings.PASSWORD_HASH_PROCESSES = processes
+            results.append({'mode': mode, 'processes': processes, **asyncio.run(run(app, ids, args, storm=True))})
+            shutdown_pool()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
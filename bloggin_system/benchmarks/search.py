@@ -0,0 +1,82 @@
+"""Full-text search latency over a large corpus, against the icontains scan
+it replaces.
+
+    python -m benchmarks.search --documents 100000 --queries 200
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import benchmark_database, summarize
+
+from django.db.models import Q
+from service.models import SearchDocument
+from service.search import search
+
+WORDS = [
+    'cache', 'query', 'index', 'django', 'redis', 'celery', 'article', 'comment', 'latency', 'throughput',
+    'postgres', 'sqlite', 'async', 'thread', 'worker', 'deploy', 'profile', 'migration', 'schema', 'token',
+    'search', 'ranking', 'cursor', 'page', 'stream', 'export', 'batch', 'queue', 'replica', 'pool',
+] + [f'word{i}' for i in range(2000)]
+
+
+def sentence(rng, length):
+    # Zipf-ish: a few words are very common, most are rare.
+    return ' '.join(WORDS[min(int(rng.paretovariate(1.2)) - 1, len(WORDS) - 1)] for _ in range(length))
+
+
+def seed(documents, rng):
+    kinds = [SearchDocument.ARTICLE, SearchDocument.FAQ, SearchDocument.COMMENT]
+    batch = []
+    for i in range(documents):
+        batch.append(SearchDocument(
+            kind=kinds[i % 3], object_id=i, title=sentence(rng, 6), body=sentence(rng, 120),
+        ))
+        if len(batch) == 5000:
+            SearchDocument.objects.bulk_create(batch)
+            batch = []
+    SearchDocument.objects.bulk_create(batch)
+
+
+def timed(queries, run):
+    latencies = []
+    started = time.perf_counter()
+    for query in queries:
+        begin = time.perf_counter()
+        run(query)
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with benchmark_database():
+        started = time.perf_counter()
+        seed(args.documents, rng)
+        indexing = time.perf_counter() - started
+        queries = [' '.join(rng.sample(WORDS[:200], 2)) for _ in range(args.queries)]
+
+        def scan(query):
+            condition = Q()
+            for term in query.split():
+                condition &= Q(title__icontains=term) | Q(body__icontains=term)
+            list(SearchDocument.objects.filter(condition).order_by('id')[:20])
+
+        results = {
+            'documents': args.documents,
+            'index_seconds': round(indexing, 2),
+            'fulltext': timed(queries, lambda query: search(query, limit=20)),
+            'icontains_scan': timed(queries[:max(1, args.queries // 10)], scan),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Fill a database with users, articles, comments and FAQs for benchmarking.
+
+    python -m benchmarks.seed --users 100 --articles 5000 --comments 10 --faqs 200
+
+Writes into the database in settings (SQLite or Postgres, whichever
+DATABASES points at); the benchmarks themselves call seed() on a throwaway
+database instead. The same --seed gives the same data.
+"""
+import argparse
+import json
+import random
+from types import SimpleNamespace
+
+from benchmarks import common  # noqa: F401  (sets up Django)
+
+from django.contrib.auth.hashers import make_password
+from service import bulk
+from service.models import Category, CustomUser, FAQ, SearchDocument
+from service.search import bulk_index
+
+PASSWORD = 'correct horse battery staple'
+
+WORDS = (
+    'cache database python django async query index latency throughput search queue worker '
+    'deploy release schema migration replica shard token session profile metric trace'
+).split()
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def seed(users=20, articles=500, comments=5, faqs=50, categories=10, seed=0):
+    """Create the data set and return the ids the benchmarks need. Search
+    documents, tag and comment counters are filled in as the API would."""
+    rng = random.Random(seed)
+    # One hash shared by every account; hashing each would take minutes.
+    encoded = make_password(PASSWORD)
+    authors = CustomUser.objects.bulk_create(
+        CustomUser(username=f'user{i}', email=f'user{i}@example.com', password=encoded, is_staff=i == 0)
+        for i in range(users)
+    )
+    category_ids = [category.pk for category in Category.objects.bulk_create(
+        Category(name=f'Category {i}') for i in range(categories)
+    )]
+    article_ids = []
+    for start in range(0, articles, 500):
+        author = authors[start // 500 % users]
+        items = [
+            SimpleNamespace(
+                title=sentence(rng, 6), content=sentence(rng, 120),
+                tags=rng.sample(WORDS, 3), categories=rng.sample(category_ids, min(2, categories)),
+                status='published', publish_at=None,
+            )
+            for _ in range(min(500, articles - start))
+        ]
+        article_ids += [row['id'] for row in bulk.create_articles(items, start, author)]
+    for article_id in article_ids:
+        items = [SimpleNamespace(content=sentence(rng, 20), parent_id=None) for _ in range(rng.randint(0, 2 * comments))]
+        if items:
+            bulk.create_comments(items, 0, rng.choice(authors), article_id)
+    faq_rows = FAQ.objects.bulk_create(
+        (FAQ(question=sentence(rng, 8) + '?', answer=sentence(rng, 40), created_by=authors[0]) for _ in range(faqs)),
+        batch_size=500,
+    )
+    bulk_index(SearchDocument.FAQ, [(faq.pk, faq.question, faq.answer) for faq in faq_rows])
+    return {
+        'usernames': [author.username for author in authors],
+        'staff': authors[0].pk,
+        'articles': article_ids,
+        'categories': category_ids,
+        'faqs': [faq.pk for faq in faq_rows],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=5, help='average comments per article')
+    parser.add_argument('--faqs', type=int, default=50)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    ids = seed(args.users, args.articles, args.comments, args.faqs, args.categories, args.seed)
+    print(json.dumps({name: len(values) if isinstance(values, list) else values for name, values in ids.items()}))
+
+
+if __name__ == '__main__':
+    main()
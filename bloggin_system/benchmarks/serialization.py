@@ -0,0 +1,78 @@
+"""Time to fetch and serialize 1k and 10k articles to JSON bytes: Pydantic
+model_validate per row plus FastAPI's response_model/jsonable_encoder/json
+pass, against .values() dicts encoded with orjson.
+
+    python -m benchmarks.serialization --sizes 1000 10000 --repeat 5
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import benchmark_database
+
+from fastapi.encoders import jsonable_encoder
+from service.models import Article, ArticleTag, Category, CustomUser, Tag
+from service.queries import plan_queryset, shape_rows, values_queryset
+from service.responses import dump_json
+from service.schemas import ArticleSerializer, Page
+
+
+def seed(count):
+    author = CustomUser.objects.create(username='bench', email='bench@example.com')
+    tags = Tag.objects.bulk_create(Tag(name=f'tag{i}') for i in range(20))
+    category = Category.objects.create(name='Bench')
+    articles = Article.objects.bulk_create(
+        (Article(title=f'Article {i}', content='lorem ipsum ' * 50, author=author) for i in range(count)),
+        batch_size=2000,
+    )
+    ArticleTag.objects.bulk_create(
+        (ArticleTag(article=article, tag=tags[(article.id + k) % 20]) for article in articles for k in range(3)),
+        batch_size=5000,
+    )
+    Article.categories.through.objects.bulk_create(
+        (Article.categories.through(article_id=article.id, category_id=category.id) for article in articles),
+        batch_size=5000,
+    )
+
+
+def pydantic_path(queryset):
+    articles = plan_queryset(queryset, ArticleSerializer)
+    page = Page[ArticleSerializer](items=[ArticleSerializer.model_validate(article) for article in articles])
+    # What FastAPI does with a returned model and a response_model.
+    return json.dumps(jsonable_encoder(Page[ArticleSerializer].model_validate(page.model_dump()))).encode()
+
+
+def lean_path(queryset):
+    rows = values_queryset(queryset, ArticleSerializer)
+    return dump_json({'items': shape_rows(Article, rows, ArticleSerializer), 'next_cursor': None})
+
+
+def measure(path, queryset, repeat):
+    """Best of `repeat` runs, in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        path(queryset)
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    with benchmark_database():
+        seed(max(args.sizes))
+        for size in args.sizes:
+            queryset = Article.objects.order_by('-published_date', '-id')[:size]
+            for name, path in (('pydantic', pydantic_path), ('lean', lean_path)):
+                elapsed = measure(path, queryset, args.repeat)
+                results.append({'path': name, 'articles': size, 'ms': elapsed, 'ms_per_1k': round(elapsed * 1000 / size, 1)})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
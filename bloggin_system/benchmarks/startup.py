@@ -0,0 +1,119 @@
+"""Startup time and resident memory of the unified ASGI application against
+the previous layout of two server fleets, the FastAPI app and Django's own
+ASGI app, each on its own port.
+
+    python -m benchmarks.startup --workers 1 2 4
+
+Each layout is started with uvicorn at each worker count. Startup time runs
+from spawning the servers until every one has answered a request. Memory is
+the resident set of each process tree after those requests (Linux only).
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+LAYOUTS = {
+    # The API without its lifespan warm-up, as it ran before, next to Django.
+    'separate': [
+        (['fastapi_app:app', '--lifespan', 'off'], '/metrics'),
+        (['--factory', 'django.core.asgi:get_asgi_application'], '/'),
+    ],
+    'unified': [
+        (['bloggin_system.asgi:application', '--lifespan', 'on'], '/metrics'),
+    ],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+            except OSError:
+                continue
+            if parent == pid:
+                found += [int(entry)] + children(int(entry))
+    return found
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def wait_until_up(url, deadline):
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return True
+        except httpx.TransportError:
+            time.sleep(0.02)
+    return False
+
+
+def measure(layout, workers, timeout):
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'bloggin_system.settings'}
+    env.setdefault('SECRET_KEY', 'benchmark')
+    servers = []
+    started = time.monotonic()
+    for args, probe in LAYOUTS[layout]:
+        port = free_port()
+        command = [sys.executable, '-m', 'uvicorn', *args, '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+        servers.append((subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), port, probe))
+    try:
+        up = all(wait_until_up(f'http://127.0.0.1:{port}{probe}', started + timeout) for _, port, probe in servers)
+        startup = time.monotonic() - started
+        # A few requests so every worker has loaded what serving needs.
+        for _, port, probe in servers:
+            for _ in range(4 * workers):
+                httpx.get(f'http://127.0.0.1:{port}{probe}', timeout=10)
+        processes = [pid for server, _, _ in servers for pid in [server.pid] + children(server.pid)]
+        memory = [rss_mb(pid) for pid in processes]
+        return {
+            'layout': layout, 'workers': workers, 'servers': len(servers), 'up': up,
+            'startup_ms': round(startup * 1000), 'processes': len(processes),
+            'rss_total_mb': round(sum(memory), 1),
+            'rss_per_worker_mb': round(sum(memory) / (workers * len(servers)), 1),
+        }
+    finally:
+        for server, _, _ in servers:
+            server.send_signal(signal.SIGINT)
+        for server, _, _ in servers:
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for startup')
+    args = parser.parse_args()
+    results = [measure(layout, workers, args.timeout) for workers in args.workers for layout in LAYOUTS]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Every endpoint of the FastAPI app, driven in-process at a given
+concurrency, with RPS, latency percentiles and queries per request.
+
+    python -m benchmarks.suite --requests 200 --concurrency 10 --output run.json
+    python -m benchmarks.suite --only list_articles get_article search
+
+Each scenario runs against the same freshly seeded throwaway database;
+writing scenarios get their own rows to change or delete. On SQLite,
+writes run one at a time, since concurrent writers only measure its
+database lock. Compare two runs with benchmarks.compare.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+from types import SimpleNamespace
+
+from benchmarks.common import benchmark_database, drive
+from benchmarks.seed import PASSWORD, seed
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.authtoken.models import Token
+from service import bulk
+from service.metrics import registry
+from service.models import Category, CustomUser, FAQ
+from service.passwords import shutdown_pool
+
+
+def article_body(i):
+    return {'title': f'Benchmark {i}', 'content': 'lorem ipsum ' * 50, 'tags': ['bench', f'b{i % 10}']}
+
+
+def fresh_articles(ctx, count):
+    items = [SimpleNamespace(categories=[], status='published', publish_at=None, **article_body(i)) for i in range(count)]
+    return [row['id'] for row in bulk.create_articles(items, 0, ctx.user)]
+
+
+def fresh_comments(ctx, count):
+    items = [SimpleNamespace(content=f'comment {i}', parent_id=None) for i in range(count)]
+    return [row['id'] for row in bulk.create_comments(items, 0, ctx.user, ctx.ids['articles'][0])]
+
+
+def fresh_categories(ctx, count):
+    return [category.pk for category in Category.objects.bulk_create(Category(name=f'Fresh {i}') for i in range(count))]
+
+
+def fresh_faqs(ctx, count):
+    return [faq.pk for faq in FAQ.objects.bulk_create(
+        FAQ(question=f'Question {i}?', answer='answer', created_by=ctx.user) for i in range(count)
+    )]
+
+
+def chunks(ids, size):
+    return [ids[start:start + size] for start in range(0, len(ids), size)]
+
+
+def own_articles(ctx):
+    return ctx.ids['articles'][:50]
+
+
+# name: (writes?, hashes passwords?, build(ctx, n) -> requests for drive()).
+SCENARIOS = {
+    'signup': (True, True, lambda ctx, n: [
+        ('POST', '/signup/', {'json': {'username': f'new{i}', 'email': f'new{i}@example.com', 'password': PASSWORD}})
+        for i in range(n)
+    ]),
+    'login': (False, True, lambda ctx, n: [
+        ('POST', '/login/', {'data': {'username': name, 'password': PASSWORD}}) for name in ctx.ids['usernames']
+    ]),
+    'password_reset': (True, True, lambda ctx, n: [
+        ('POST', '/password_reset/', {'params': {'username': name, 'new_password': PASSWORD}}) for name in ctx.ids['usernames']
+    ]),
+    'auth_cache_stats': (False, False, lambda ctx, n: ['/auth/cache-stats/']),
+    'metrics': (False, False, lambda ctx, n: ['/metrics']),
+    'list_articles': (False, False, lambda ctx, n: ['/articles/', '/articles/?limit=50']),
+    'list_articles_by_tag': (False, False, lambda ctx, n: ['/articles/?tag=cache', '/articles/?tag=cache&tag=python&match=all']),
+    'list_articles_most_discussed': (False, False, lambda ctx, n: ['/articles/?sort=most_discussed']),
+    'get_article': (False, False, lambda ctx, n: [f'/articles/{pk}/' for pk in ctx.ids['articles'][:200]]),
+    'trending_articles': (False, False, lambda ctx, n: ['/articles/trending/']),
+    'create_article': (True, False, lambda ctx, n: [('POST', '/articles/', {'json': article_body(i)}) for i in range(n)]),
+    'update_article': (True, False, lambda ctx, n: [
+        ('PUT', f'/articles/{pk}/', {'json': article_body(pk)}) for pk in own_articles(ctx)
+    ]),
+    'delete_article': (True, False, lambda ctx, n: [('DELETE', f'/articles/{pk}/', {}) for pk in fresh_articles(ctx, n)]),
+    'bulk_create_articles': (True, False, lambda ctx, n: [
+        ('POST', '/articles/bulk/', {'json': [article_body(i) for i in range(10)]})
+    ]),
+    'bulk_create_articles_ndjson': (True, False, lambda ctx, n: [
+        ('POST', '/articles/bulk/ndjson/', {'content': ''.join(json.dumps(article_body(i)) + '\n' for i in range(10))})
+    ]),
+    'bulk_update_articles': (True, False, lambda ctx, n: [
+        ('PUT', '/articles/bulk/', {'json': [{'id': pk, **article_body(pk)} for pk in own_articles(ctx)[:10]]})
+    ]),
+    'bulk_delete_articles': (True, False, lambda ctx, n: [
+        ('POST', '/articles/bulk/delete/', {'json': {'ids': ids}}) for ids in chunks(fresh_articles(ctx, 10 * n), 10)
+    ]),
+    'list_drafts': (False, False, lambda ctx, n: ['/articles/drafts/']),
+    'article_revisions': (False, False, lambda ctx, n: [
+        path for pk in own_articles(ctx) for path in (f'/articles/{pk}/revisions/', f'/articles/{pk}/revisions/1/')
+    ]),
+    'author_feed': (False, False, lambda ctx, n: [
+        f'/authors/{ctx.ids["staff"]}/articles/', f'/authors/{ctx.ids["staff"]}/articles/?limit=50',
+    ]),
+    'category_feed': (False, False, lambda ctx, n: [f'/categories/{pk}/articles/' for pk in ctx.ids['categories']]),
+    'create_category': (True, False, lambda ctx, n: [('POST', '/categories/', {'json': {'name': f'New {i}'}}) for i in range(n)]),
+    'bulk_create_categories': (True, False, lambda ctx, n: [
+        ('POST', '/categories/bulk/', {'json': [{'name': f'Bulk {i}'} for i in range(10)]})
+    ]),
+    'bulk_update_categories': (True, False, lambda ctx, n: [
+        ('PUT', '/categories/bulk/', {'json': [{'id': pk, 'name': f'Renamed {pk}'} for pk in ctx.ids['categories']]})
+    ]),
+    'bulk_delete_categories': (True, False, lambda ctx, n: [
+        ('POST', '/categories/bulk/delete/', {'json': {'ids': ids}}) for ids in chunks(fresh_categories(ctx, 10 * n), 10)
+    ]),
+    'list_categories': (False, False, lambda ctx, n: ['/categories/']),
+    'create_comment': (True, False, lambda ctx, n: [
+        ('POST', f'/articles/{pk}/comments/', {'json': {'content': 'benchmark comment'}}) for pk in ctx.ids['articles'][:50]
+    ]),
+    'bulk_create_comments': (True, False, lambda ctx, n: [
+        ('POST', f'/articles/{ctx.ids["articles"][0]}/comments/bulk/', {'json': [{'content': f'c{i}'} for i in range(10)]})
+    ]),
+    'bulk_delete_comments': (True, False, lambda ctx, n: [
+        ('POST', '/comments/bulk/delete/', {'json': {'ids': ids}}) for ids in chunks(fresh_comments(ctx, 10 * n), 10)
+    ]),
+    'list_comments': (False, False, lambda ctx, n: [f'/articles/{pk}/comments/' for pk in ctx.ids['articles'][:200]]),
+    'tag_cloud': (False, False, lambda ctx, n: ['/tags/']),
+    'create_faq': (True, False, lambda ctx, n: [
+        ('POST', '/faqs/', {'json': {'question': f'Question {i}?', 'answer': 'answer'}}) for i in range(n)
+    ]),
+    'list_faqs': (False, False, lambda ctx, n: ['/faqs/']),
+    'get_faq': (False, False, lambda ctx, n: [f'/faqs/{pk}/' for pk in ctx.ids['faqs']]),
+    'update_faq': (True, False, lambda ctx, n: [
+        ('PUT', f'/faqs/{pk}/', {'json': {'question': f'Updated {pk}?', 'answer': 'answer'}}) for pk in ctx.ids['faqs']
+    ]),
+    'delete_faq': (True, False, lambda ctx, n: [('DELETE', f'/faqs/{pk}/', {}) for pk in fresh_faqs(ctx, n)]),
+    'export_articles': (False, False, lambda ctx, n: ['/export/articles/', '/export/articles/?format=csv']),
+    'syndication': (False, False, lambda ctx, n: ['/feed.xml', '/atom.xml', '/sitemap.xml', '/sitemap-0.xml']),
+    'search': (False, False, lambda ctx, n: ['/search/?q=cache', '/search/?q=python+query', '/search/?q=replica&kind=faq']),
+}
+
+
+def queries_per_request():
+    count = sum(sum(histogram.counts) for histogram in registry.queries.values())
+    total = sum(histogram.sum for histogram in registry.queries.values())
+    return round(total / count, 2) if count else 0.0
+
+
+def run_scenario(app, ctx, name, args):
+    writes, hashes, build = SCENARIOS[name]
+    total = min(args.requests, args.auth_requests) if hashes else args.requests
+    concurrency = 1 if writes and connection.vendor == 'sqlite' else args.concurrency
+    requests = build(ctx, total)
+    registry.clear()
+    stats = asyncio.run(drive(app, requests, concurrency, total, headers=ctx.headers))
+    return {'scenario': name, 'concurrency': concurrency, **stats, 'queries_per_request': queries_per_request()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--auth-requests', type=int, default=10,
+                        help='requests for the scenarios that hash passwords, which take ~0.5s of CPU each')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS, help='run just these scenarios')
+    parser.add_argument('--skip', nargs='+', choices=SCENARIOS, default=[])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=5)
+    parser.add_argument('--faqs', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    args = parser.parse_args()
+
+    # The suite is one client; the credential endpoints' rate limits would
+    # otherwise turn most of their requests into 429s.
+    settings.AUTH_RATE_PER_IP = settings.AUTH_RATE_PER_USERNAME = 10 ** 6
+    from fastapi_app import app
+
+    results = []
+    with benchmark_database():
+        connection.settings_dict['CONN_MAX_AGE'] = None
+        ids = seed(args.users, args.articles, args.comments, args.faqs, seed=args.seed)
+        user = CustomUser.objects.get(pk=ids['staff'])
+        token = Token.objects.create(user=user)
+        ctx = SimpleNamespace(ids=ids, user=user, headers={'Authorization': f'Bearer {token.key}'})
+        for name in args.only or SCENARIOS:
+            if name not in args.skip:
+                results.append(run_scenario(app, ctx, name, args))
+                print(f'{name}: {results[-1]["rps"]} rps', file=sys.stderr)
+        shutdown_pool()
+    report = {
+        'environment': {'python': platform.python_version(), 'database': connection.vendor},
+        'settings': {name: value for name, value in vars(args).items() if name not in ('only', 'skip', 'output')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
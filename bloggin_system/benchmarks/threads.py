@@ -0,0 +1,98 @@
+"""Threaded comment pages on one article with a very large comment tree:
+queries and latency per page from the first top-level page to the last,
+and down the replies of the busiest thread.
+
+    python -m benchmarks.threads --comments 50000 --top-level 5000
+
+The query count must be the same for every page wherever it falls in the
+tree; only latency may grow, with the index depth.
+"""
+import argparse
+import json
+import random
+import time
+from types import SimpleNamespace
+
+from benchmarks.common import benchmark_database, summarize
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import fastapi_app as api
+from service import bulk
+from service.models import Article, Comment, CustomUser
+
+
+def seed(comments, top_level, rng):
+    """A tree of `comments` comments: `top_level` threads, then each further
+    comment a reply to a random earlier one, so a few threads grow large
+    and deep as on a real discussion."""
+    user = CustomUser.objects.create(username='bench', email='bench@example.com')
+    article = Article.objects.create(title='Busy', content='body', author=user)
+    created = []
+    level = [SimpleNamespace(content=f'comment {i}', parent_id=None) for i in range(top_level)]
+    while level:
+        for start in range(0, len(level), 500):
+            created += [row['id'] for row in bulk.create_comments(level[start:start + 500], 0, user, article.id)]
+        remaining = comments - len(created)
+        level = [
+            SimpleNamespace(content=f'reply {len(created) + i}', parent_id=rng.choice(created))
+            for i in range(min(remaining, len(created)))
+        ]
+    return article
+
+
+def walk(first_page, next_page):
+    """Follow cursors from the first page to the last, recording the
+    queries and time each page took."""
+    queries, latencies = [], []
+    cursor = None
+    while True:
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            page = json.loads((next_page(cursor) if cursor else first_page()).body)
+            latencies.append(time.perf_counter() - started)
+        queries.append(len(ctx.captured_queries))
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    return {'pages': len(queries), 'queries_per_page': sorted(set(queries)), **summarize(latencies, sum(latencies))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--comments', type=int, default=50000)
+    parser.add_argument('--top-level', type=int, default=5000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with benchmark_database():
+        started = time.perf_counter()
+        article = seed(args.comments, args.top_level, random.Random(args.seed))
+        seeding = time.perf_counter() - started
+        busiest = Comment.objects.filter(article=article, depth=0).order_by('-reply_count').first()
+        list_comments = async_to_sync(api.list_comments)
+        list_replies = async_to_sync(api.list_replies)
+        options = {'limit': args.limit, 'depth': args.depth}
+        results = {
+            'comments': Comment.objects.filter(article=article).count(),
+            'max_depth': max(Comment.objects.filter(article=article).values_list('depth', flat=True)),
+            'busiest_thread_replies': busiest.reply_count,
+            'seed_seconds': round(seeding, 2),
+            'top_level_pages': walk(
+                lambda: list_comments(article.id, cursor=None, **options),
+                lambda cursor: list_comments(article.id, cursor=cursor, **options),
+            ),
+            'busiest_thread_replies_pages': walk(
+                lambda: list_replies(busiest.id, cursor=None, **options),
+                lambda cursor: list_replies(busiest.id, cursor=cursor, **options),
+            ),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Article read throughput when every view is written straight to the
+database, against views buffered in process and written in batches.
+
+    python -m benchmarks.views --requests 5000 --concurrency 50
+
+Without Redis configured the buffered batches go straight to the database,
+which is what is measured here; with Redis they go to a hash instead and
+reach the database once per flush.
+"""
+import argparse
+import asyncio
+import json
+
+from benchmarks.common import benchmark_database, drive
+
+from django.conf import settings
+from django.db import connection
+from service.models import Article, CustomUser
+from service.viewcounts import push_views, view_buffer
+
+
+def seed(articles):
+    author = CustomUser.objects.create(username='bench', email='bench@example.com')
+    Article.objects.bulk_create(
+        Article(title=f'Article {i}', content='lorem ipsum ' * 50, author=author)
+        for i in range(articles)
+    )
+    return list(Article.objects.values_list('id', flat=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--articles', type=int, default=100)
+    args = parser.parse_args()
+
+    from fastapi_app import app
+
+    results = []
+    with benchmark_database():
+        connection.settings_dict['CONN_MAX_AGE'] = None
+        ids = seed(args.articles)
+        paths = [f'/articles/{article_id}/' for article_id in ids]
+        for mode, batch in (('unbuffered', 1), ('buffered', settings.VIEW_BUFFER_MAX_PENDING)):
+            settings.VIEW_BUFFER_MAX_PENDING = batch
+            Article.objects.update(view_count=0)
+            stats = asyncio.run(drive(app, paths, args.concurrency, args.requests))
+            push_views(view_buffer.drain())
+            results.append({'mode': mode, 'batch': batch, **stats,
+                            'views_written': sum(Article.objects.values_list('view_count', flat=True))})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
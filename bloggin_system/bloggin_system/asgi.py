@@ -1,14 +1,20 @@
 import os
+
+from django.conf import settings
 from django.core.asgi import get_asgi_application
-from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.staticfiles import StaticFiles
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bloggin_system.settings')
 django_app = get_asgi_application()
 
-fastapi_app = FastAPI()
+# One application per worker: the FastAPI routes first, then Django (the
+# admin and site pages) for every path they don't claim. Both share the
+# process's ORM lanes, database connections and the API's lifespan.
+from fastapi_app import app  # noqa: E402  (needs Django set up)
+from service.media import MediaFiles  # noqa: E402
 
-fastapi_app.add_middleware(
+app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
@@ -16,6 +22,14 @@ fastapi_app.add_middleware(
     allow_headers=["*"],
 )
 
-fastapi_app.mount("/django", django_app)
+# Admin assets from collectstatic; Django itself only serves them under runserver.
+if os.path.isdir(settings.STATIC_ROOT):
+    app.mount(settings.STATIC_URL, StaticFiles(directory=settings.STATIC_ROOT), name="static")
+
+# Uploads, under content-hash names and so cached as immutable.
+os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+app.mount(settings.MEDIA_URL, MediaFiles(directory=settings.MEDIA_ROOT), name="media")
+
+app.mount("/", django_app)
 
-application = fastapi_app
\ No newline at end of file
+application = app
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django_celery_results',
     'rest_framework',
+    'rest_framework.authtoken',
     'service',
 ]
 
@@ -70,6 +71,157 @@ CACHES = {
 # Cache Timeouts
 CACHE_TTL = 60 * 15  # Cache timeout in seconds (e.g., 15 minutes)
 
+# API response cache: how long a miss may hold the rebuild lock, and how
+# often the requests waiting on it check for the result.
+RESPONSE_CACHE_LOCK_TIMEOUT = 5
+RESPONSE_CACHE_POLL_INTERVAL = 0.05
+
+# API pagination (keyset/cursor based)
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+# Responses of at least COMPRESSION_MIN_SIZE bytes are sent brotli (when
+# the brotli package is installed) or gzip compressed to clients that
+# accept it.
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Article bodies of at least COMPRESSED_TEXT_MIN_BYTES are stored zstd
+# compressed when the zstandard package is installed (0 stores every body
+# as plain text).
+COMPRESSED_TEXT_MIN_BYTES = int(os.environ.get('COMPRESSED_TEXT_MIN_BYTES', 4096))
+COMPRESSED_TEXT_LEVEL = int(os.environ.get('COMPRESSED_TEXT_LEVEL', 3))
+
+# Comment threads: each listed comment comes with up to
+# COMMENT_REPLIES_PER_COMMENT replies, nested COMMENT_REPLY_DEPTH levels
+# deep unless the client asks otherwise. Replies nest at most
+# COMMENT_MAX_DEPTH levels (paths hold 25).
+COMMENT_REPLY_DEPTH = 2
+COMMENT_REPLIES_PER_COMMENT = 3
+COMMENT_MAX_DEPTH = 20
+
+# Bearer token -> user cache. The in-process tier cannot be invalidated
+# from other workers, so its TTL bounds how long a revoked token may still
+# be accepted there; the shared (Redis) tier is invalidated directly.
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_LOCAL_TTL = 30
+AUTH_TOKEN_CACHE_TTL = 60 * 5
+
+# Worker processes `manage.py runasgi` starts, each serving the API and the
+# Django site from one ASGI application.
+ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', os.cpu_count() or 1))
+
+# Persistent threads the async FastAPI handlers run their ORM calls on.
+ASYNC_ORM_THREADS = int(os.environ.get('ASYNC_ORM_THREADS', 32))
+
+# Threads for the sync code left on the async FastAPI path (password
+# hashing and the like); 0 runs it in the request's own ORM thread.
+SYNC_EXECUTOR_WORKERS = int(os.environ.get('SYNC_EXECUTOR_WORKERS', 8))
+
+# Password hashing and checking run in their own pool of
+# PASSWORD_HASH_PROCESSES processes (0 puts them on the sync executor).
+# Beyond PASSWORD_HASH_MAX_PENDING waiting hashes, signup/login/reset
+# answer 429 instead of queueing more.
+PASSWORD_HASH_PROCESSES = int(os.environ.get('PASSWORD_HASH_PROCESSES', os.cpu_count() or 1))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+
+# Token buckets for the credential endpoints: each client IP gets
+# AUTH_RATE_PER_IP attempts and each username AUTH_RATE_PER_USERNAME
+# attempts per AUTH_RATE_WINDOW seconds, refilled continuously. Buckets live
+# in Redis; without it each process keeps its own, up to
+# RATE_LIMIT_LOCAL_BUCKETS of them.
+AUTH_RATE_PER_IP = int(os.environ.get('AUTH_RATE_PER_IP', 30))
+AUTH_RATE_PER_USERNAME = int(os.environ.get('AUTH_RATE_PER_USERNAME', 10))
+AUTH_RATE_WINDOW = int(os.environ.get('AUTH_RATE_WINDOW', 60))
+RATE_LIMIT_LOCAL_BUCKETS = 10000
+
+# Per-route request metrics are served at /metrics in the Prometheus text
+# format; when METRICS_TOKEN is set, scrapers must send it as a bearer token.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Sampling profiler. Staff can profile a request by adding ?profile=1, and
+# PROFILE_SAMPLE_RATE of all requests are profiled at random; the stacks of
+# requested profiles, and of sampled requests slower than
+# PROFILE_SLOW_SECONDS, are written to PROFILE_DIR in the collapsed format
+# flamegraph.pl and speedscope read. Stacks are sampled every
+# PROFILE_INTERVAL seconds.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_SLOW_SECONDS = float(os.environ.get('PROFILE_SLOW_SECONDS', 1))
+PROFILE_INTERVAL = 0.005
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'Logs', 'profiles'))
+
+# Bulk write endpoints: rows per transaction, and the largest JSON array
+# accepted in one request (NDJSON uploads are streamed and not capped, but
+# each of their lines is).
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 500))
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 10000))
+BULK_MAX_LINE_BYTES = int(os.environ.get('BULK_MAX_LINE_BYTES', 1024 * 1024))
+
+# Rows fetched per round trip (and written per piece) by the streaming
+# article export.
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Article views are counted in process and handed to Redis (or, without
+# Redis, the database) every VIEW_BUFFER_MAX_PENDING views or
+# VIEW_BUFFER_FLUSH_SECONDS, whichever comes first. Trending scores halve
+# every TRENDING_HALF_LIFE seconds.
+VIEW_BUFFER_MAX_PENDING = int(os.environ.get('VIEW_BUFFER_MAX_PENDING', 500))
+VIEW_BUFFER_FLUSH_SECONDS = float(os.environ.get('VIEW_BUFFER_FLUSH_SECONDS', 5))
+TRENDING_HALF_LIFE = int(os.environ.get('TRENDING_HALF_LIFE', 6 * 60 * 60))
+TRENDING_MAX_SIZE = 1000
+
+# Per-author and per-category feeds that are read are cached in Redis as
+# sorted sets of their newest FEED_CACHE_SIZE article ids, kept up to date
+# as articles change and dropped after FEED_CACHE_TTL seconds unread.
+FEED_CACHE_SIZE = int(os.environ.get('FEED_CACHE_SIZE', 1000))
+FEED_CACHE_TTL = int(os.environ.get('FEED_CACHE_TTL', 24 * 60 * 60))
+
+# RSS (/feed.xml), Atom (/atom.xml) and sitemap (/sitemap.xml) documents
+# link to SITE_URL. The feeds carry the newest SYNDICATION_FEED_SIZE
+# articles; sitemap shards hold SITEMAP_SHARD_SIZE article ids each (the
+# protocol allows up to 50,000 URLs per file). Clients may reuse a copy for
+# SYNDICATION_MAX_AGE seconds before revalidating it.
+SITE_URL = os.environ.get('SITE_URL', 'http://localhost:8000').rstrip('/')
+SYNDICATION_TITLE = os.environ.get('SYNDICATION_TITLE', 'Blogging System')
+SYNDICATION_DESCRIPTION = os.environ.get('SYNDICATION_DESCRIPTION', 'The latest articles')
+SYNDICATION_FEED_SIZE = int(os.environ.get('SYNDICATION_FEED_SIZE', 50))
+SITEMAP_SHARD_SIZE = int(os.environ.get('SITEMAP_SHARD_SIZE', 10000))
+SYNDICATION_MAX_AGE = int(os.environ.get('SYNDICATION_MAX_AGE', 300))
+
+# Scheduled articles are published by a Celery task every
+# PUBLISH_POLL_SECONDS, PUBLISH_BATCH_SIZE to a transaction. Article
+# revisions store their content whole every REVISION_KEYFRAME_INTERVAL
+# revisions and as deltas in between, so rebuilding one reads at most that
+# many rows.
+PUBLISH_POLL_SECONDS = int(os.environ.get('PUBLISH_POLL_SECONDS', 60))
+PUBLISH_BATCH_SIZE = int(os.environ.get('PUBLISH_BATCH_SIZE', 200))
+REVISION_KEYFRAME_INTERVAL = int(os.environ.get('REVISION_KEYFRAME_INTERVAL', 20))
+
+# Post-save work that can lag the request (search indexing, fan-out) goes
+# through the outbox table and is drained by a Celery task every
+# OUTBOX_POLL_SECONDS, OUTBOX_BATCH_SIZE events at a time. Failed events are
+# retried after OUTBOX_RETRY_BASE_SECONDS, doubling each time, and set aside
+# as dead after OUTBOX_MAX_ATTEMPTS. Events claimed by a worker that has not
+# finished within OUTBOX_CLAIM_TIMEOUT seconds are picked up again.
+OUTBOX_POLL_SECONDS = int(os.environ.get('OUTBOX_POLL_SECONDS', 2))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 200))
+OUTBOX_MAX_BATCHES = 50
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', 10))
+OUTBOX_CLAIM_TIMEOUT = int(os.environ.get('OUTBOX_CLAIM_TIMEOUT', 300))
+OUTBOX_RETENTION = 24 * 60 * 60
+
+# Notifications (service.notifications) are delivered by the outbox worker.
+# A new article is copied into each follower's inbox, NOTIFY_BATCH_SIZE
+# followers to a transaction, when its author has at most
+# NOTIFY_FANOUT_MAX_FOLLOWERS followers; beyond that it is stored once and
+# read from the followers' inboxes. Unread counts are cached in Redis for
+# NOTIFY_UNREAD_TTL seconds.
+NOTIFY_FANOUT_MAX_FOLLOWERS = int(os.environ.get('NOTIFY_FANOUT_MAX_FOLLOWERS', 10000))
+NOTIFY_BATCH_SIZE = int(os.environ.get('NOTIFY_BATCH_SIZE', 1000))
+NOTIFY_UNREAD_TTL = int(os.environ.get('NOTIFY_UNREAD_TTL', 7 * 24 * 60 * 60))
+
 # Use Redis for session storage
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
@@ -81,6 +233,28 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# Run tasks in process instead of through the broker (tests, local runs).
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER') == '1'
+CELERY_BEAT_SCHEDULE = {
+    # Repairs drift in the denormalized Article.comment_count/last_commented_at.
+    'reconcile-comment-counts': {
+        'task': 'service.tasks.reconcile_comment_counts',
+        'schedule': int(os.environ.get('COMMENT_COUNT_RECONCILE_SECONDS', 60 * 60)),
+    },
+    # Moves buffered article views from Redis into Article.view_count.
+    'flush-view-counts': {
+        'task': 'service.tasks.flush_view_counts',
+        'schedule': int(os.environ.get('VIEW_FLUSH_SECONDS', 60)),
+    },
+    'drain-outbox': {
+        'task': 'service.tasks.drain_outbox',
+        'schedule': OUTBOX_POLL_SECONDS,
+    },
+    'publish-scheduled-articles': {
+        'task': 'service.tasks.publish_scheduled_articles',
+        'schedule': PUBLISH_POLL_SECONDS,
+    },
+}
 
 # User Authentication
 AUTH_USER_MODEL = 'service.CustomUser'
@@ -127,6 +301,19 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'Media') 
 
+# Image uploads (service.media) of up to MEDIA_MAX_UPLOAD_BYTES are stored
+# under the SHA-256 of their content. The outbox worker then writes WebP
+# copies MEDIA_IMAGE_WIDTHS wide (those narrower than the original) and a
+# MEDIA_THUMBNAIL_SIZE square thumbnail, refusing images over
+# MEDIA_MAX_PIXELS. Content-addressed names never change bytes, so media
+# is served with an immutable Cache-Control for MEDIA_CACHE_MAX_AGE.
+MEDIA_MAX_UPLOAD_BYTES = int(os.environ.get('MEDIA_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+MEDIA_MAX_PIXELS = int(os.environ.get('MEDIA_MAX_PIXELS', 50_000_000))
+MEDIA_IMAGE_WIDTHS = (480, 960, 1920)
+MEDIA_THUMBNAIL_SIZE = 200
+MEDIA_WEBP_QUALITY = int(os.environ.get('MEDIA_WEBP_QUALITY', 80))
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 WSGI_APPLICATION = 'bloggin_system.wsgi.application'
@@ -135,12 +322,62 @@ WSGI_APPLICATION = 'bloggin_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
-}
+# Postgres when POSTGRES_DB is set, otherwise the SQLite file (SQLITE_PATH,
+# db.sqlite3 by default). Read
+# replicas are POSTGRES_REPLICA_HOSTS (same database and credentials), or
+# SQLITE_REPLICAS (file paths) to try replica routing locally; both are
+# comma separated.
+#
+# Connections persist for DB_CONN_MAX_AGE seconds on the thread that opened
+# them and are health-checked before reuse. With DB_POOL_MAX_SIZE set,
+# Postgres connections come from a psycopg 3 pool (psycopg[pool], Django
+# 5.1+) of that size per process instead (Django then requires
+# CONN_MAX_AGE = 0).
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+
+
+def _database(**options):
+    database = {'CONN_MAX_AGE': DB_CONN_MAX_AGE, 'CONN_HEALTH_CHECKS': True, **options}
+    if DB_POOL_MAX_SIZE and options['ENGINE'] == 'django.db.backends.postgresql':
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS'] = {'pool': {'min_size': 1, 'max_size': DB_POOL_MAX_SIZE, 'timeout': 10}}
+    return database
+
+
+def _postgres(host):
+    return _database(
+        ENGINE='django.db.backends.postgresql',
+        NAME=os.environ['POSTGRES_DB'],
+        USER=os.environ.get('POSTGRES_USER', ''),
+        PASSWORD=os.environ.get('POSTGRES_PASSWORD', ''),
+        HOST=host,
+        PORT=os.environ.get('POSTGRES_PORT', ''),
+    )
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+if os.environ.get('POSTGRES_DB'):
+    DATABASES = {'default': _postgres(os.environ.get('POSTGRES_HOST', 'localhost'))}
+    _replicas = [_postgres(host) for host in _split(os.environ.get('POSTGRES_REPLICA_HOSTS', ''))]
+else:
+    DATABASES = {'default': _database(ENGINE='django.db.backends.sqlite3', NAME=os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'))}
+    _replicas = [_database(ENGINE='django.db.backends.sqlite3', NAME=path) for path in _split(os.environ.get('SQLITE_REPLICAS', ''))]
+
+# Tests run the replicas as mirrors of the test database.
+for _index, _replica in enumerate(_replicas):
+    DATABASES[f'replica{_index}'] = {**_replica, 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [f'replica{index}' for index in range(len(_replicas))]
+DATABASE_ROUTERS = ['service.routers.ReplicaRouter']
+
+# Safe (GET/HEAD/OPTIONS) requests read from a replica, unless the client wrote
+# something less than READ_YOUR_WRITES_SECONDS ago (tracked with a cookie),
+# so that it always sees its own writes despite replication lag.
+READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+READ_YOUR_WRITES_COOKIE = 'read_primary'
 
 
 # Password validation
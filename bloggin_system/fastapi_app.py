@@ -1,24 +1,76 @@
+import hmac
+import json
 import os
+import re
 import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bloggin_system.settings")
 django.setup()
 
-from fastapi import FastAPI, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
-from typing import List
-from django.contrib.auth import authenticate
-from django.contrib.auth.models import User
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.security import OAuth2PasswordRequestForm
+from pydantic import BaseModel, model_validator
+from datetime import datetime
+from typing import List, Literal, Optional, Union
+from typing_extensions import Annotated
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ObjectDoesNotExist
-from service.schemas import ArticleSerializer, UserSerializer, FAQSerializer, CategorySerializer ,CommentSerializer
-from service.models import Article, FAQ, Category, Comment
+from django.db import transaction
+from service.schemas import ArticleSerializer, ArticleSummary, UserSerializer, FAQSerializer, CategorySerializer ,CommentSerializer, CommentThread, InboxItem, MediaSerializer, Page, RevisionContent, RevisionSerializer, SearchHit, TagSerializer, UnreadCount, BulkResult
+from service.models import Article, ArticleRevision, FAQ, Category, Comment, MediaFile, Tag
+from service.auth import cache_stats, get_current_user
+from service import bulk, notifications
+from service.cache import cached_response
+from service.export import MEDIA_TYPES, aexport_articles
+from service.feeds import AUTHOR, CATEGORY, feed_page
+from service.lifespan import lifespan
+from service.media import UPLOAD_FIELD, UploadRejected, receive_upload
+from service.metrics import registry
+from service.middleware import CompressionMiddleware, DjangoRequestMiddleware, MetricsMiddleware, ReadRoutingMiddleware
+from service.pagination import InvalidCursor
+from service.passwords import HasherBusy, authenticate, hash_password
+from service.profiling import read_profile
+from service.publishing import publish
+from service.queries import avalues_get, avalues_list, avalues_page, plan_queryset, sparse_schema
+from service.ratelimit import throttle
+from service.responses import FastJSONResponse, RequestStreamingResponse
+from service.revisions import arevision, record_revisions
+from service.search import search
+from service import syndication
+from service.tags import filter_by_tags, set_article_tags
+from service.threads import thread_page
+from service.viewcounts import record_view, trending_ids
 from rest_framework.authtoken.models import Token
 from django.conf import settings
 
-app = FastAPI()
+User = get_user_model()
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+
+# Added first so that they run inside DjangoRequestMiddleware, and
+# compression inside MetricsMiddleware, which then counts the bytes sent.
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ReadRoutingMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(DjangoRequestMiddleware)
+
+PageLimit = Query(settings.API_PAGE_SIZE, ge=1, le=settings.API_MAX_PAGE_SIZE)
+ReplyDepth = Annotated[int, Query(ge=0, le=5)]
+RepliesPerComment = Annotated[int, Query(ge=1, le=settings.API_MAX_PAGE_SIZE)]
+
+@app.exception_handler(InvalidCursor)
+def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(status_code=400, content={"detail": "Invalid cursor"})
+
+@app.exception_handler(UploadRejected)
+def upload_rejected_handler(request: Request, exc: UploadRejected):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+
+@app.exception_handler(HasherBusy)
+def hasher_busy_handler(request: Request, exc: HasherBusy):
+    return JSONResponse(status_code=429, content={"detail": "Too many requests, try again shortly"}, headers={"Retry-After": "1"})
 
 class UserCreate(BaseModel):
     username: str
@@ -28,8 +80,20 @@ class UserCreate(BaseModel):
 class ArticleCreate(BaseModel):
     title: str
     content: str
-    tags: str
-    
+    tags: Union[List[str], str] = []
+    categories: List[int] = []
+    status: Literal['draft', 'scheduled', 'published'] = 'published'
+    publish_at: Optional[datetime] = None
+
+    @model_validator(mode='after')
+    def check_schedule(self):
+        if self.status == 'scheduled' and self.publish_at is None:
+            raise ValueError("Scheduled articles need a publish_at")
+        return self
+
+class ArticleUpdate(ArticleCreate):
+    id: int
+
 class FAQCreate(BaseModel):
     question: str
     answer: str
@@ -37,161 +101,475 @@ class FAQCreate(BaseModel):
 class CategoryCreate(BaseModel):
     name: str
 
+class CategoryUpdate(CategoryCreate):
+    id: int
+
 class CommentCreate(BaseModel):
     content: str
+    parent_id: Optional[int] = None
+
+class BulkDelete(BaseModel):
+    ids: List[int]
+
+def bulk_items(items):
+    if len(items) > settings.BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.BULK_MAX_ITEMS} items per request, use the NDJSON endpoint for more")
+    return items
+
+def article_fields(fields):
+    """The schema listings serialize articles with: ArticleSummary, or just
+    the ArticleSerializer fields named in `fields` (comma separated), so
+    that the other columns, such as the content, are never read."""
+    if not fields:
+        return ArticleSummary
+    try:
+        return sparse_schema(ArticleSerializer, [name.strip() for name in fields.split(',') if name.strip()])
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+async def check_categories(ids):
+    if await Category.objects.filter(id__in=ids).acount() != len(set(ids)):
+        raise HTTPException(status_code=400, detail="Unknown category")
 
 #   Authentication api
 
 @app.post("/signup/")
-def create_user(user: UserCreate):
-    if User.objects.filter(username=user.username).exists():
+async def create_user(request: Request, user: UserCreate):
+    await throttle(request, 'signup')
+    if await User.objects.filter(username=user.username).aexists():
         raise HTTPException(status_code=400, detail="Username already exists")
-    new_user = User.objects.create_user(username=user.username, email=user.email, password=user.password)
+    await User.objects.acreate(
+        username=User.normalize_username(user.username),
+        email=User.objects.normalize_email(user.email),
+        password=await hash_password(user.password),
+    )
     return {"message": "User created successfully"}
 
 @app.post("/login/")
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate(username=form_data.username, password=form_data.password)
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    await throttle(request, 'login', form_data.username)
+    user = await authenticate(form_data.username, form_data.password)
     if user:
-        token, _ = Token.objects.get_or_create(user=user)
+        token, _ = await Token.objects.aget_or_create(user=user)
         return {"access_token": token.key, "token_type": "bearer"}
     raise HTTPException(status_code=400, detail="Invalid credentials")
 
 @app.post("/password_reset/")
-def reset_password(username: str, new_password: str):
+async def reset_password(request: Request, username: str, new_password: str):
+    await throttle(request, 'password_reset', username)
     try:
-        user = User.objects.get(username=username)
-        user.set_password(new_password)
-        user.save()
+        user = await User.objects.aget(username=username)
+        user.password = await hash_password(new_password)
+        await user.asave()
+        # Signed-in sessions end with the old password; each token's
+        # post_delete drops it from the token caches.
+        await Token.objects.filter(user=user).adelete()
         return {"message": "Password updated successfully"}
     except ObjectDoesNotExist:
         raise HTTPException(status_code=404, detail="User not found")
 
+@app.get("/auth/cache-stats/")
+async def auth_cache_stats(user: User = Depends(get_current_user)):
+    if not user.is_staff:
+        raise HTTPException(status_code=403, detail="Staff only")
+    return cache_stats()
+
+#   Monitoring api
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    expected = f"Bearer {settings.METRICS_TOKEN}"
+    if settings.METRICS_TOKEN and not hmac.compare_digest(request.headers.get("authorization", ""), expected):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profiles/{profile_id}", include_in_schema=False)
+async def get_profile(profile_id: str, user: User = Depends(get_current_user)):
+    if not user.is_staff:
+        raise HTTPException(status_code=403, detail="Staff only")
+    if not re.fullmatch(r"[0-9a-f]{32}", profile_id):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    try:
+        return PlainTextResponse(await sync_to_async(read_profile)(profile_id))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
 #   Articles api
 
-@app.get("/articles/", response_model=List[ArticleSerializer])
-def list_articles():
-    articles = Article.objects.all()
-    return [ArticleSerializer.from_orm(article) for article in articles]
+# Each ordering is served by a matching index on Article.
+ARTICLE_ORDERINGS = {
+    "newest": ('-published_date', '-id'),
+    "most_discussed": ('-comment_count', '-id'),
+}
+
+def save_article(article, tags, categories, previous=None, publishing=False):
+    with transaction.atomic():
+        article.save()
+        set_article_tags(article, tags)
+        article.categories.set(categories)
+        record_revisions([(article, previous)])
+        if publishing:
+            publish([article.pk])
+
+@app.get("/articles/", response_model=Page[ArticleSummary])
+async def list_articles(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = PageLimit,
+    tag: Annotated[List[str], Query()] = [],
+    match: Annotated[str, Query(pattern="^(any|all)$")] = "any",
+    sort: Annotated[str, Query(pattern="^(newest|most_discussed)$")] = "newest",
+    fields: Optional[str] = None,
+):
+    schema = article_fields(fields)
+
+    async def build():
+        articles = filter_by_tags(Article.objects.published(), tag, match)
+        return await avalues_page(articles, schema, ARTICLE_ORDERINGS[sort], cursor, limit)
+    params = (cursor, limit, sorted(tag), match, sort, sorted(schema.model_fields))
+    return await cached_response(request, 'articles', params, build)
 
 @app.post("/articles/", response_model=ArticleSerializer)
-def create_article(article: ArticleCreate, token: str = Depends(oauth2_scheme)):
-    try:
-        user = Token.objects.get(key=token).user
-        new_article = Article.objects.create(title=article.title, content=article.content, tags=article.tags, author=user)
-        return ArticleSerializer.from_orm(new_article)
-    except Token.DoesNotExist:
-        raise HTTPException(status_code=401, detail="Invalid token")
+async def create_article(article: ArticleCreate, user: User = Depends(get_current_user)):
+    await check_categories(article.categories)
+    new_article = Article(
+        title=article.title, content=article.content, author=user, status=article.status,
+        publish_at=article.publish_at if article.status == Article.SCHEDULED else None,
+    )
+    await sync_to_async(save_article)(new_article, article.tags, article.categories)
+    new_article = await plan_queryset(Article.objects.all(), ArticleSerializer).aget(id=new_article.id)
+    return ArticleSerializer.model_validate(new_article)
+
+@app.post("/articles/bulk/", response_model=List[BulkResult])
+async def bulk_create_articles(articles: List[ArticleCreate], user: User = Depends(get_current_user)):
+    return await bulk.apply_in_chunks(bulk.create_articles, bulk_items(articles), user)
+
+@app.post("/articles/bulk/ndjson/", response_class=RequestStreamingResponse)
+async def bulk_create_articles_ndjson(request: Request, user: User = Depends(get_current_user)):
+    results = bulk.apply_ndjson(bulk.create_articles, bulk.ndjson_lines(request), ArticleCreate, user)
+    return RequestStreamingResponse(
+        (json.dumps(result) + '\n' async for result in results), media_type="application/x-ndjson",
+    )
+
+@app.put("/articles/bulk/", response_model=List[BulkResult])
+async def bulk_update_articles(articles: List[ArticleUpdate], user: User = Depends(get_current_user)):
+    return await bulk.apply_in_chunks(bulk.update_articles, bulk_items(articles), user)
+
+@app.post("/articles/bulk/delete/", response_model=List[BulkResult])
+async def bulk_delete_articles(batch: BulkDelete, user: User = Depends(get_current_user)):
+    return await bulk.apply_in_chunks(bulk.delete_articles, bulk_items(batch.ids), user)
+
+@app.get("/articles/drafts/", response_model=Page[ArticleSummary])
+async def list_drafts(
+    cursor: Optional[str] = None, limit: int = PageLimit, fields: Optional[str] = None, user: User = Depends(get_current_user),
+):
+    drafts = Article.objects.filter(author=user).exclude(status=Article.PUBLISHED)
+    return FastJSONResponse(await avalues_page(drafts, article_fields(fields), ('-id',), cursor, limit))
+
+@app.get("/articles/trending/", response_model=List[ArticleSummary])
+async def trending_articles(limit: int = PageLimit, fields: Optional[str] = None):
+    ids = await trending_ids(limit)
+    published = Article.objects.published().filter(id__in=ids)
+    articles = {article['id']: article for article in await avalues_list(published, article_fields(fields))}
+    # Ids of deleted articles can linger in the trending set until they decay.
+    return FastJSONResponse([articles[pk] for pk in ids if pk in articles])
 
 @app.get("/articles/{article_id}/", response_model=ArticleSerializer)
-def get_article(article_id: int):
-    try:
-        article = Article.objects.get(id=article_id)
-        return ArticleSerializer.from_orm(article)
-    except Article.DoesNotExist:
-        raise HTTPException(status_code=404, detail="Article not found")
+async def get_article(request: Request, article_id: int):
+    async def build():
+        try:
+            return await avalues_get(Article.objects.published(), ArticleSerializer, id=article_id)
+        except Article.DoesNotExist:
+            raise HTTPException(status_code=404, detail="Article not found")
+    response = await cached_response(request, f'article:{article_id}', (), build)
+    await record_view(article_id)
+    return response
 
 @app.put("/articles/{article_id}/", response_model=ArticleSerializer)
-def update_article(article_id: int, article: ArticleCreate, token: str = Depends(oauth2_scheme)):
+async def update_article(article_id: int, article: ArticleCreate, user: User = Depends(get_current_user)):
     try:
-        user = Token.objects.get(key=token).user
-        existing_article = Article.objects.get(id=article_id, author=user)
+        existing_article = await plan_queryset(Article.objects.all(), ArticleSerializer).aget(id=article_id, author=user)
+        await check_categories(article.categories)
+        # Leaving the status out keeps it as it is.
+        status = article.status if 'status' in article.model_fields_set else None
+        if status not in (None, Article.PUBLISHED) and existing_article.status == Article.PUBLISHED:
+            raise HTTPException(status_code=400, detail="Published articles cannot be unpublished")
+        previous = existing_article.content
         existing_article.title = article.title
         existing_article.content = article.content
-        existing_article.tags = article.tags
-        existing_article.save()
-        return ArticleSerializer(existing_article).data
-    except Token.DoesNotExist:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        publishing = status == Article.PUBLISHED and existing_article.status != Article.PUBLISHED
+        if status is not None and not publishing:
+            existing_article.status = status
+            existing_article.publish_at = article.publish_at if status == Article.SCHEDULED else None
+        await sync_to_async(save_article)(existing_article, article.tags, article.categories, previous, publishing)
+        existing_article = await plan_queryset(Article.objects.all(), ArticleSerializer).aget(id=article_id)
+        return ArticleSerializer.model_validate(existing_article)
     except Article.DoesNotExist:
         raise HTTPException(status_code=404, detail="Article not found")
 
 @app.delete("/articles/{article_id}/")
-def delete_article(article_id: int, token: str = Depends(oauth2_scheme)):
+async def delete_article(article_id: int, user: User = Depends(get_current_user)):
     try:
-        user = Token.objects.get(key=token).user
-        article = Article.objects.get(id=article_id, author=user)
-        article.delete()
+        article = await Article.objects.aget(id=article_id, author=user)
+        await article.adelete()
         return {"message": "Article deleted successfully"}
-    except Token.DoesNotExist:
-        raise HTTPException(status_code=401, detail="Invalid token")
     except Article.DoesNotExist:
         raise HTTPException(status_code=404, detail="Article not found")
 
+@app.get("/articles/{article_id}/revisions/", response_model=Page[RevisionSerializer])
+async def list_revisions(article_id: int, cursor: Optional[str] = None, limit: int = PageLimit, user: User = Depends(get_current_user)):
+    if not await Article.objects.filter(id=article_id, author=user).aexists():
+        raise HTTPException(status_code=404, detail="Article not found")
+    revisions = ArticleRevision.objects.filter(article_id=article_id)
+    return FastJSONResponse(await avalues_page(revisions, RevisionSerializer, ('-number',), cursor, limit))
+
+@app.get("/articles/{article_id}/revisions/{number}/", response_model=RevisionContent)
+async def get_revision(article_id: int, number: int, user: User = Depends(get_current_user)):
+    if not await Article.objects.filter(id=article_id, author=user).aexists():
+        raise HTTPException(status_code=404, detail="Article not found")
+    revision = await arevision(article_id, number)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return RevisionContent.model_validate(revision)
+
+@app.get("/authors/{author_id}/articles/", response_model=Page[ArticleSummary])
+async def author_articles(author_id: int, cursor: Optional[str] = None, limit: int = PageLimit, fields: Optional[str] = None):
+    page = await feed_page(AUTHOR, author_id, cursor, limit, article_fields(fields))
+    # Only an empty feed may be a missing author.
+    if not page["items"] and not await User.objects.filter(id=author_id).aexists():
+        raise HTTPException(status_code=404, detail="Author not found")
+    return FastJSONResponse(page)
+
 @app.post("/categories/", response_model=CategorySerializer)
-def create_category(category: CategoryCreate):
-    new_category = Category.objects.create(name=category.name)
-    return CategorySerializer.from_orm(new_category)
+async def create_category(category: CategoryCreate):
+    new_category = await Category.objects.acreate(name=category.name)
+    return CategorySerializer.model_validate(new_category)
 
-@app.get("/categories/", response_model=List[CategorySerializer])
-def list_categories():
-    categories = Category.objects.all()
-    return [CategorySerializer.from_orm(category) for category in categories]
+@app.post("/categories/bulk/", response_model=List[BulkResult])
+async def bulk_create_categories(categories: List[CategoryCreate], user: User = Depends(get_current_user)):
+    return await bulk.apply_in_chunks(bulk.create_categories, bulk_items(categories))
+
+@app.put("/categories/bulk/", response_model=List[BulkResult])
+async def bulk_update_categories(categories: List[CategoryUpdate], user: User = Depends(get_current_user)):
+    if not user.is_staff:
+        raise HTTPException(status_code=403, detail="Staff only")
+    return await bulk.apply_in_chunks(bulk.update_categories, bulk_items(categories))
+
+@app.post("/categories/bulk/delete/", response_model=List[BulkResult])
+async def bulk_delete_categories(batch: BulkDelete, user: User = Depends(get_current_user)):
+    if not user.is_staff:
+        raise HTTPException(status_code=403, detail="Staff only")
+    return await bulk.apply_in_chunks(bulk.delete_categories, bulk_items(batch.ids))
+
+@app.get("/categories/", response_model=Page[CategorySerializer])
+async def list_categories(cursor: Optional[str] = None, limit: int = PageLimit):
+    return FastJSONResponse(await avalues_page(Category.objects.all(), CategorySerializer, ('id',), cursor, limit))
+
+@app.get("/categories/{category_id}/articles/", response_model=Page[ArticleSummary])
+async def category_articles(category_id: int, cursor: Optional[str] = None, limit: int = PageLimit, fields: Optional[str] = None):
+    page = await feed_page(CATEGORY, category_id, cursor, limit, article_fields(fields))
+    if not page["items"] and not await Category.objects.filter(id=category_id).aexists():
+        raise HTTPException(status_code=404, detail="Category not found")
+    return FastJSONResponse(page)
 
 @app.post("/articles/{article_id}/comments/", response_model=CommentSerializer)
-def create_comment(article_id: int, comment: CommentCreate, token: str = Depends(oauth2_scheme)):
+async def create_comment(article_id: int, comment: CommentCreate, user: User = Depends(get_current_user)):
     try:
-        user = Token.objects.get(key=token).user
-        article = Article.objects.get(id=article_id)
-        new_comment = Comment.objects.create(article=article, user=user, content=comment.content)
-        return CommentSerializer.from_orm(new_comment)
-    except Token.DoesNotExist:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        article = await Article.objects.published().aget(id=article_id)
     except Article.DoesNotExist:
         raise HTTPException(status_code=404, detail="Article not found")
+    parent = None
+    if comment.parent_id is not None:
+        try:
+            parent = await Comment.objects.only('path', 'depth').aget(id=comment.parent_id, article_id=article_id)
+        except Comment.DoesNotExist:
+            raise HTTPException(status_code=404, detail="Parent comment not found")
+        if parent.depth >= settings.COMMENT_MAX_DEPTH:
+            raise HTTPException(status_code=400, detail=f"Replies nest at most {settings.COMMENT_MAX_DEPTH} levels deep")
+    new_comment = await Comment.objects.acreate(article=article, user=user, content=comment.content, parent=parent)
+    return CommentSerializer.model_validate(new_comment)
+
+@app.post("/articles/{article_id}/comments/bulk/", response_model=List[BulkResult])
+async def bulk_create_comments(article_id: int, comments: List[CommentCreate], user: User = Depends(get_current_user)):
+    if not await Article.objects.published().filter(id=article_id).aexists():
+        raise HTTPException(status_code=404, detail="Article not found")
+    return await bulk.apply_in_chunks(bulk.create_comments, bulk_items(comments), user, article_id)
+
+@app.post("/comments/bulk/delete/", response_model=List[BulkResult])
+async def bulk_delete_comments(batch: BulkDelete, user: User = Depends(get_current_user)):
+    return await bulk.apply_in_chunks(bulk.delete_comments, bulk_items(batch.ids), user)
+
+@app.get("/articles/{article_id}/comments/", response_model=Page[CommentThread])
+async def list_comments(
+    article_id: int,
+    cursor: Optional[str] = None,
+    limit: int = PageLimit,
+    depth: ReplyDepth = settings.COMMENT_REPLY_DEPTH,
+    replies: RepliesPerComment = settings.COMMENT_REPLIES_PER_COMMENT,
+):
+    if not await Article.objects.published().filter(id=article_id).aexists():
+        raise HTTPException(status_code=404, detail="Article not found")
+    return FastJSONResponse(await thread_page(article_id, None, cursor, limit, depth, replies))
 
-@app.get("/articles/{article_id}/comments/", response_model=List[CommentSerializer])
-def list_comments(article_id: int):
-    article = Article.objects.get(id=article_id)
-    comments = article.comments.all()
-    return [CommentSerializer.from_orm(comment) for comment in comments]
+@app.get("/comments/{comment_id}/replies/", response_model=Page[CommentThread])
+async def list_replies(
+    comment_id: int,
+    cursor: Optional[str] = None,
+    limit: int = PageLimit,
+    depth: ReplyDepth = settings.COMMENT_REPLY_DEPTH,
+    replies: RepliesPerComment = settings.COMMENT_REPLIES_PER_COMMENT,
+):
+    try:
+        parent = await Comment.objects.only('article_id', 'depth').aget(id=comment_id)
+    except Comment.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    return FastJSONResponse(await thread_page(parent.article_id, parent, cursor, limit, depth, replies))
+
+@app.get("/tags/", response_model=List[TagSerializer])
+async def tag_cloud(limit: int = PageLimit):
+    tags = Tag.objects.filter(article_count__gt=0).order_by('-article_count', 'name')[:limit]
+    return [TagSerializer.model_validate(tag) async for tag in tags]
 
 #   Faqs api
 
 @app.post("/faqs/", response_model=FAQSerializer)
-def create_faq(faq: FAQCreate, token: str = Depends(oauth2_scheme)):
-    try:
-        user = Token.objects.get(key=token).user
-        new_faq = FAQ.objects.create(question=faq.question, answer=faq.answer, created_by=user)
-        return FAQSerializer.from_orm(new_faq)
-    except Token.DoesNotExist:
-        raise HTTPException(status_code=401, detail="Invalid token")
+async def create_faq(faq: FAQCreate, user: User = Depends(get_current_user)):
+    new_faq = await FAQ.objects.acreate(question=faq.question, answer=faq.answer, created_by=user)
+    return FAQSerializer.model_validate(new_faq)
 
-@app.get("/faqs/", response_model=List[FAQSerializer])
-def list_faqs():
-    faqs = FAQ.objects.all()
-    return [FAQSerializer.from_orm(faq) for faq in faqs]
+@app.get("/faqs/", response_model=Page[FAQSerializer])
+async def list_faqs(request: Request, cursor: Optional[str] = None, limit: int = PageLimit):
+    async def build():
+        return await avalues_page(FAQ.objects.all(), FAQSerializer, ('-created_at', '-id'), cursor, limit)
+    return await cached_response(request, 'faqs', (cursor, limit), build)
 
 @app.get("/faqs/{faq_id}/", response_model=FAQSerializer)
-def get_faq(faq_id: int):
-    try:
-        faq = FAQ.objects.get(id=faq_id)
-        return FAQSerializer.from_orm(faq)
-    except FAQ.DoesNotExist:
-        raise HTTPException(status_code=404, detail="FAQ not found")
+async def get_faq(request: Request, faq_id: int):
+    async def build():
+        try:
+            return await avalues_get(FAQ.objects.all(), FAQSerializer, id=faq_id)
+        except FAQ.DoesNotExist:
+            raise HTTPException(status_code=404, detail="FAQ not found")
+    return await cached_response(request, f'faq:{faq_id}', (), build)
 
 @app.put("/faqs/{faq_id}/", response_model=FAQSerializer)
-def update_faq(faq_id: int, faq: FAQCreate, token: str = Depends(oauth2_scheme)):
+async def update_faq(faq_id: int, faq: FAQCreate, user: User = Depends(get_current_user)):
     try:
-        user = Token.objects.get(key=token).user
-        existing_faq = FAQ.objects.get(id=faq_id, created_by=user)
+        existing_faq = await plan_queryset(FAQ.objects.all(), FAQSerializer).aget(id=faq_id, created_by=user)
         existing_faq.question = faq.question
         existing_faq.answer = faq.answer
-        existing_faq.save()
-        return FAQSerializer.from_orm(existing_faq)
-    except Token.DoesNotExist:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        await existing_faq.asave()
+        return FAQSerializer.model_validate(existing_faq)
     except FAQ.DoesNotExist:
         raise HTTPException(status_code=404, detail="FAQ not found")
 
 @app.delete("/faqs/{faq_id}/")
-def delete_faq(faq_id: int, token: str = Depends(oauth2_scheme)):
+async def delete_faq(faq_id: int, user: User = Depends(get_current_user)):
     try:
-        user = Token.objects.get(key=token).user
-        faq = FAQ.objects.get(id=faq_id, created_by=user)
-        faq.delete()
+        faq = await FAQ.objects.aget(id=faq_id, created_by=user)
+        await faq.adelete()
         return {"message": "FAQ deleted successfully"}
-    except Token.DoesNotExist:
-        raise HTTPException(status_code=401, detail="Invalid token")
     except FAQ.DoesNotExist:
-        raise HTTPException(status_code=404, detail="FAQ not found")
\ No newline at end of file
+        raise HTTPException(status_code=404, detail="FAQ not found")
+
+#   Follows and notifications api
+
+@app.post("/authors/{author_id}/follow/")
+async def follow_author(author_id: int, user: User = Depends(get_current_user)):
+    if author_id == user.id:
+        raise HTTPException(status_code=400, detail="You cannot follow yourself")
+    if not await User.objects.filter(id=author_id).aexists():
+        raise HTTPException(status_code=404, detail="Author not found")
+    if not await sync_to_async(notifications.follow)(user.id, author_id):
+        return {"message": "Already following"}
+    return {"message": "Following"}
+
+@app.delete("/authors/{author_id}/follow/")
+async def unfollow_author(author_id: int, user: User = Depends(get_current_user)):
+    if not await sync_to_async(notifications.unfollow)(user.id, author_id):
+        raise HTTPException(status_code=404, detail="Not following this author")
+    return {"message": "Unfollowed"}
+
+@app.get("/following/", response_model=Page[UserSerializer])
+async def list_following(cursor: Optional[str] = None, limit: int = PageLimit, user: User = Depends(get_current_user)):
+    following = User.objects.filter(followers__follower=user)
+    return FastJSONResponse(await avalues_page(following, UserSerializer, ('id',), cursor, limit))
+
+@app.get("/notifications/", response_model=Page[InboxItem])
+async def list_notifications(cursor: Optional[str] = None, limit: int = PageLimit, user: User = Depends(get_current_user)):
+    return FastJSONResponse(await notifications.inbox_page(user.id, cursor, limit))
+
+@app.get("/notifications/unread/", response_model=UnreadCount)
+async def unread_notifications(user: User = Depends(get_current_user)):
+    return {"unread": await sync_to_async(notifications.unread_count)(user.id)}
+
+@app.post("/notifications/read/", response_model=UnreadCount)
+async def read_notifications(user: User = Depends(get_current_user)):
+    await sync_to_async(notifications.mark_read)(user.id)
+    return {"unread": await sync_to_async(notifications.unread_count)(user.id)}
+
+#   Media api
+
+@app.post("/uploads/", response_model=MediaSerializer, openapi_extra={"requestBody": {"required": True, "content": {
+    "multipart/form-data": {"schema": {
+        "type": "object", "properties": {UPLOAD_FIELD: {"type": "string", "format": "binary"}}, "required": [UPLOAD_FIELD],
+    }},
+}}})
+async def upload_media(request: Request, user: User = Depends(get_current_user)):
+    # Read straight from the stream rather than as an UploadFile, which
+    # would hold the whole body before the handler runs.
+    return MediaSerializer.model_validate(await receive_upload(request, user))
+
+@app.get("/uploads/{media_id}/", response_model=MediaSerializer)
+async def get_media(media_id: int):
+    try:
+        return MediaSerializer.model_validate(await MediaFile.objects.aget(id=media_id))
+    except MediaFile.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+#   Export api
+
+@app.get("/export/articles/")
+async def export_articles(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    after_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    user: User = Depends(get_current_user),
+):
+    if not user.is_staff:
+        raise HTTPException(status_code=403, detail="Staff only")
+    return StreamingResponse(
+        aexport_articles(format, after_id, since),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="articles.{format}"'},
+    )
+
+#   Search api
+
+@app.get("/search/", response_model=Page[SearchHit])
+async def search_documents(
+    q: str = Query(..., min_length=1, max_length=200),
+    kind: Optional[str] = Query(None, pattern="^(article|faq|comment)$"),
+    cursor: Optional[str] = None,
+    limit: int = PageLimit,
+):
+    hits, next_cursor = await sync_to_async(search)(q, kind, cursor, limit)
+    return {"items": hits, "next_cursor": next_cursor}
+
+#   Syndication api
+
+@app.get("/feed.xml", include_in_schema=False)
+async def rss_feed(request: Request):
+    return await syndication.serve(request, syndication.RSS)
+
+@app.get("/atom.xml", include_in_schema=False)
+async def atom_feed(request: Request):
+    return await syndication.serve(request, syndication.ATOM)
+
+@app.get("/sitemap.xml", include_in_schema=False)
+async def sitemap_index(request: Request):
+    return await syndication.serve(request, syndication.SITEMAP)
+
+@app.get("/sitemap-{shard}.xml", include_in_schema=False)
+async def sitemap_shard(request: Request, shard: int):
+    return await syndication.serve_shard(request, shard)
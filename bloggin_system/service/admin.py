@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Article, CustomUser, FAQ
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from . import outbox
+from .models import Article, CustomUser, FAQ, MediaFile, OutboxEvent, SearchDocument, Tag
+from .search import matching_ids
 
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = ('username', 'email', 'is_active', 'is_staff')
@@ -7,15 +11,58 @@ class CustomUserAdmin(admin.ModelAdmin):
     list_filter = ('is_active', 'is_staff')
 
 class ArticleAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'published_date', 'tags')
-    search_fields = ('title', 'content', 'author__username')
-    list_filter = ('author', 'published_date', 'tags')
+    list_display = ('title', 'author', 'status', 'published_date', 'tag_list')
+    # The content column is binary (and often compressed), so it is only
+    # searched through the full-text index below.
+    search_fields = ('title', 'author__username')
+    list_filter = ('status', 'author', 'published_date', 'tags')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('author').prefetch_related('tags')
+
+    @admin.display(description='tags')
+    def tag_list(self, obj):
+        return ', '.join(tag.name for tag in obj.tags.all())
+
+    def get_search_results(self, request, queryset, search_term):
+        # Title and content go through the full-text index instead of
+        # icontains scans; author names are still matched directly.
+        index = matching_ids(search_term, SearchDocument.ARTICLE) if search_term else None
+        if index is None:
+            return super().get_search_results(request, queryset, search_term)
+        sql, params = index
+        matches = Q(pk__in=RawSQL(sql, params)) | Q(author__username__icontains=search_term)
+        return queryset.filter(matches), False
+
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'article_count')
+    search_fields = ('name',)
+    readonly_fields = ('article_count',)
 
 class FAQAdmin(admin.ModelAdmin):
     list_display = ('question', 'created_by', 'created_at')
     search_fields = ('question',)
     list_filter = ('created_by',)
 
+class MediaFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'content_type', 'size', 'width', 'height', 'status', 'uploaded_by', 'created_at')
+    list_filter = ('status', 'content_type')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'path', 'content_type', 'size', 'width', 'height', 'variants')
+
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('topic', 'status', 'attempts', 'available_at', 'last_error')
+    list_filter = ('status', 'topic')
+    search_fields = ('idempotency_key',)
+    actions = ('retry_events',)
+
+    @admin.action(description='Retry selected dead-lettered events')
+    def retry_events(self, request, queryset):
+        self.message_user(request, f'{outbox.retry(queryset)} events requeued.')
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Article, ArticleAdmin)
-admin.site.register(FAQ, FAQAdmin)
\ No newline at end of file
+admin.site.register(FAQ, FAQAdmin)
+admin.site.register(Tag, TagAdmin)
+admin.site.register(MediaFile, MediaFileAdmin)
+admin.site.register(OutboxEvent, OutboxEventAdmin)
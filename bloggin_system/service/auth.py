@@ -0,0 +1,113 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+from rest_framework.authtoken.models import Token
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
+
+class TokenCache:
+    """A bounded, thread-safe LRU mapping with a per-entry TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+local_tokens = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_LOCAL_TTL)
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        stats = {name: _stats[name] for name in ('local_hits', 'shared_hits', 'misses')}
+    stats['local_size'] = len(local_tokens)
+    return stats
+
+
+def _digest(token):
+    # Raw tokens are credentials; keep them out of cache keys.
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _shared_key(digest):
+    return f'auth:token:{digest}'
+
+
+def invalidate_token(key):
+    digest = _digest(key)
+    local_tokens.discard(digest)
+    cache.delete(_shared_key(digest))
+
+
+def invalidate_user(user):
+    for key in Token.objects.filter(user=user).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Resolve a bearer token to its user through the in-process LRU, then
+    the shared cache, and only then the database (one joined query)."""
+    digest = _digest(token)
+    user = local_tokens.get(digest)
+    if user is not None:
+        _count('local_hits')
+        return user
+    user = await cache.aget(_shared_key(digest))
+    if user is not None:
+        _count('shared_hits')
+        local_tokens.set(digest, user)
+        return user
+    _count('misses')
+    try:
+        user = (await Token.objects.select_related('user').aget(key=token)).user
+    except Token.DoesNotExist:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    await cache.aset(_shared_key(digest), user, settings.AUTH_TOKEN_CACHE_TTL)
+    local_tokens.set(digest, user)
+    return user
@@ -0,0 +1,426 @@
+import contextvars
+import logging
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Count, F, Q
+from pydantic import ValidationError
+
+from .cache import invalidate
+from .counters import comments_added, comments_removed, replies_changed
+from .feeds import AUTHOR, category_feeds, category_links, remove_articles, update_feeds
+from .models import Article, ArticleTag, Category, Comment, SearchDocument, Tag, comment_path, make_excerpt
+from .notifications import notify_commented, notify_published
+from .publishing import publish
+from .revisions import record_revisions
+from .search import article_body, bulk_index
+from .syndication import schedule_render
+from .tags import get_or_create_tags, parse_tags
+
+logger = logging.getLogger(__name__)
+
+ArticleCategory = Article.categories.through
+
+_bulk = contextvars.ContextVar('bulk_operation', default=False)
+_chunk = contextvars.ContextVar('bulk_chunk', default=None)
+
+
+def in_bulk():
+    """True while a bulk operation applies counters, search documents and
+    cache invalidation itself; per-row signal receivers stand down."""
+    return _bulk.get()
+
+
+@contextmanager
+def bulk_operation():
+    token = _bulk.set(True)
+    try:
+        with transaction.atomic():
+            yield
+    finally:
+        _bulk.reset(token)
+
+
+def result(index, id=None, status=200, error=None):
+    return {'index': index, 'id': id, 'status': status, 'error': error}
+
+
+def chunk_results(size):
+    """The per-item results list of a chunk function, filled in as items
+    are rejected and then as the rest are written. Should the chunk fail at
+    the database, _apply_chunk keeps the rejections it already holds."""
+    results = [None] * size
+    chunk = _chunk.get()
+    if chunk is not None:
+        chunk.append(results)
+    return results
+
+
+async def apply_in_chunks(func, items, *args):
+    """Run `func(items_chunk, offset, *args)` over BULK_BATCH_SIZE chunks,
+    each in its own transaction, and collect the per-item results. A chunk
+    that fails at the database is reported item by item and does not undo
+    the chunks already committed."""
+    results = []
+    size = settings.BULK_BATCH_SIZE
+    for offset in range(0, len(items), size):
+        results.extend(await sync_to_async(_apply_chunk)(func, items[offset:offset + size], offset, *args))
+    return results
+
+
+def _apply_chunk(func, chunk, offset, *args):
+    registered = []
+    token = _chunk.set(registered)
+    try:
+        return func(chunk, offset, *args)
+    except DatabaseError as exc:
+        logger.exception('Bulk chunk at offset %s failed', offset)
+        rejected = registered[0] if registered else [None] * len(chunk)
+        return [rejected[i] or result(offset + i, status=500, error=str(exc)) for i in range(len(chunk))]
+    finally:
+        _chunk.reset(token)
+
+
+def _adjust_tag_counts(deltas):
+    # One UPDATE per distinct delta rather than one per tag.
+    tags_by_delta = {}
+    for tag_id, delta in deltas.items():
+        if delta:
+            tags_by_delta.setdefault(delta, []).append(tag_id)
+    for delta, tag_ids in tags_by_delta.items():
+        Tag.objects.filter(pk__in=tag_ids).update(article_count=F('article_count') + delta)
+
+
+def _unknown_categories(items):
+    wanted = {category for item in items for category in item.categories}
+    known = set(Category.objects.filter(pk__in=wanted).values_list('pk', flat=True))
+    return wanted - known
+
+
+def _link_tags(names_by_article):
+    """Add ArticleTag rows for {article_id: [names]} and count them."""
+    tag_ids = {tag.name: tag.pk for tag in get_or_create_tags(sorted(set().union(*names_by_article.values())))}
+    links = [
+        ArticleTag(article_id=article_id, tag_id=tag_ids[name])
+        for article_id, names in names_by_article.items() for name in names
+    ]
+    ArticleTag.objects.bulk_create(links, batch_size=1000)
+    _adjust_tag_counts(Counter(link.tag_id for link in links))
+
+
+def _link_categories(categories_by_article):
+    ArticleCategory.objects.bulk_create([
+        ArticleCategory(article_id=article_id, category_id=category_id)
+        for article_id, category_ids in categories_by_article.items() for category_id in set(category_ids)
+    ], batch_size=1000)
+
+
+def _reindex_articles(articles):
+    names = {}
+    for article_id, name in ArticleTag.objects.filter(article__in=articles).values_list('article_id', 'tag__name'):
+        names.setdefault(article_id, []).append(name)
+    bulk_index(SearchDocument.ARTICLE, [
+        (article.pk, article.title, article_body(article.content, names.get(article.pk, ())))
+        for article in articles
+    ])
+
+
+def create_articles(items, offset, author):
+    results = chunk_results(len(items))
+    unknown = _unknown_categories(items)
+    rows = []
+    for i, item in enumerate(items):
+        missing = unknown.intersection(item.categories)
+        if missing:
+            results[i] = result(offset + i, status=400, error=f'Unknown categories: {sorted(missing)}')
+        else:
+            rows.append((i, item, Article(
+                title=item.title, content=item.content, excerpt=make_excerpt(item.content), author=author, status=item.status,
+                publish_at=item.publish_at if item.status == Article.SCHEDULED else None,
+            )))
+    articles = [article for _, _, article in rows]
+    with bulk_operation():
+        Article.objects.bulk_create(articles, batch_size=500)
+        _link_tags({article.pk: parse_tags(item.tags) for _, item, article in rows})
+        categories = {article.pk: item.categories for _, item, article in rows}
+        _link_categories(categories)
+        record_revisions([(article, None) for article in articles])
+        # Drafts and scheduled articles stay out of search, feeds and
+        # syndication until they are published.
+        public = [article for article in articles if article.status == Article.PUBLISHED]
+        _reindex_articles(public)
+        if public:
+            published = {article.pk: categories[article.pk] for article in public}
+            update_feeds('add', {**category_feeds(published), (AUTHOR, author.pk): list(published)})
+            schedule_render(list(published), listed=True)
+            notify_published(list(published))
+    if public:
+        invalidate('articles')
+    for i, _, article in rows:
+        results[i] = result(offset + i, article.pk, 201)
+    return results
+
+
+def update_articles(items, offset, author):
+    results = chunk_results(len(items))
+    unknown = _unknown_categories(items)
+    existing = Article.objects.filter(author=author).in_bulk([item.id for item in items])
+    rows = {}
+    previous = {}
+    publishing = []
+    for i, item in enumerate(items):
+        missing = unknown.intersection(item.categories)
+        # Leaving the status out keeps it as it is.
+        status = item.status if 'status' in item.model_fields_set else None
+        if item.id not in existing:
+            results[i] = result(offset + i, item.id, 404, 'Article not found')
+        elif item.id in rows:
+            results[i] = result(offset + i, item.id, 400, 'Duplicate id in batch')
+        elif missing:
+            results[i] = result(offset + i, item.id, 400, f'Unknown categories: {sorted(missing)}')
+        elif status not in (None, Article.PUBLISHED) and existing[item.id].status == Article.PUBLISHED:
+            results[i] = result(offset + i, item.id, 400, 'Published articles cannot be unpublished')
+        else:
+            article = existing[item.id]
+            previous[item.id] = article.content
+            article.title = item.title
+            article.content = item.content
+            article.excerpt = make_excerpt(item.content)
+            if status == Article.PUBLISHED and article.status != Article.PUBLISHED:
+                publishing.append(item.id)
+            elif status is not None:
+                article.status = status
+                article.publish_at = item.publish_at if status == Article.SCHEDULED else None
+            rows[item.id] = (i, item, article)
+    articles = [article for _, _, article in rows.values()]
+    public = [article for article in articles if article.status == Article.PUBLISHED]
+    with bulk_operation():
+        Article.objects.bulk_update(articles, ['title', 'content', 'excerpt', 'status', 'publish_at'], batch_size=500)
+        record_revisions([(article, previous[article.pk]) for article in articles])
+        # Only the links that actually change are touched.
+        wanted = {article_id: set(parse_tags(item.tags)) for article_id, (_, item, _) in rows.items()}
+        current = {}
+        stale = []
+        removed = Counter()
+        for link_id, article_id, tag_id, name in ArticleTag.objects.filter(article_id__in=rows).values_list(
+            'id', 'article_id', 'tag_id', 'tag__name'
+        ):
+            current.setdefault(article_id, set()).add(name)
+            if name not in wanted[article_id]:
+                stale.append(link_id)
+                removed[tag_id] -= 1
+        ArticleTag.objects.filter(pk__in=stale).delete()
+        _adjust_tag_counts(removed)
+        _link_tags({article_id: sorted(names - current.get(article_id, set())) for article_id, names in wanted.items()})
+        update_feeds('remove', category_links(rows))
+        ArticleCategory.objects.filter(article_id__in=rows).delete()
+        categories = {article_id: item.categories for article_id, (_, item, _) in rows.items()}
+        _link_categories(categories)
+        update_feeds('add', category_feeds({article.pk: categories[article.pk] for article in public}))
+        _reindex_articles(public)
+        if public:
+            schedule_render([article.pk for article in public])
+        publish(publishing)
+    if articles:
+        invalidate('articles', *(f'article:{article.pk}' for article in articles))
+    for article_id, (i, _, _) in rows.items():
+        results[i] = result(offset + i, article_id, 200)
+    return results
+
+
+def delete_articles(ids, offset, author):
+    found = set(Article.objects.filter(author=author, pk__in=ids).values_list('pk', flat=True))
+    results = chunk_results(len(ids))
+    for i, pk in enumerate(ids):
+        if pk not in found:
+            results[i] = result(offset + i, pk, 404, 'Article not found')
+    with bulk_operation():
+        remove_articles([(pk, author.pk) for pk in found])
+        _adjust_tag_counts({
+            row['tag_id']: -row['links']
+            for row in ArticleTag.objects.filter(article_id__in=found).values('tag_id').annotate(links=Count('id'))
+        })
+        SearchDocument.objects.filter(
+            Q(kind=SearchDocument.ARTICLE, object_id__in=found)
+            | Q(kind=SearchDocument.COMMENT, object_id__in=Comment.objects.filter(article_id__in=found).values('pk'))
+        ).delete()
+        Article.objects.filter(pk__in=found).delete()
+        if found:
+            schedule_render(found, listed=True)
+    if found:
+        invalidate('articles', *(f'article:{pk}' for pk in found))
+    for i, pk in enumerate(ids):
+        if pk in found:
+            results[i] = result(offset + i, pk, 200)
+    return results
+
+
+def create_comments(items, offset, user, article_id):
+    results = chunk_results(len(items))
+    parents = Comment.objects.filter(
+        article_id=article_id, pk__in={item.parent_id for item in items if item.parent_id is not None},
+    ).only('path', 'depth').in_bulk()
+    rows = []
+    for i, item in enumerate(items):
+        parent = parents.get(item.parent_id)
+        if item.parent_id is not None and parent is None:
+            results[i] = result(offset + i, status=404, error='Parent comment not found')
+        elif parent is not None and parent.depth >= settings.COMMENT_MAX_DEPTH:
+            results[i] = result(offset + i, status=400, error=f'Replies nest at most {settings.COMMENT_MAX_DEPTH} levels deep')
+        else:
+            comment = Comment(
+                article_id=article_id, user=user, content=item.content,
+                parent=parent, depth=parent.depth + 1 if parent else 0,
+            )
+            rows.append((i, comment))
+    comments = [comment for _, comment in rows]
+    with bulk_operation():
+        Comment.objects.bulk_create(comments, batch_size=500)
+        for comment in comments:
+            comment.path = comment_path(comment.parent.path if comment.parent else '', comment.pk)
+        Comment.objects.bulk_update(comments, ['path'], batch_size=500)
+        bulk_index(SearchDocument.COMMENT, [(comment.pk, '', comment.content) for comment in comments])
+        if comments:
+            comments_added(article_id, len(comments), max(comment.created_at for comment in comments))
+        replies_changed(Counter(comment.parent_id for comment in comments if comment.parent_id is not None))
+        notify_commented([comment.pk for comment in comments])
+    invalidate(f'article:{article_id}', 'articles')
+    for i, comment in rows:
+        results[i] = result(offset + i, comment.pk, 201)
+    return results
+
+
+def delete_comments(ids, offset, user):
+    found = Comment.objects.filter(user=user, pk__in=ids).only('article_id', 'parent_id', 'path').in_bulk()
+    # Replies go with the comment they answer, whoever wrote them.
+    subtrees = Q(pk__in=[])
+    for comment in found.values():
+        subtrees |= Q(article_id=comment.article_id, path__startswith=comment.path)
+    doomed = dict(Comment.objects.filter(subtrees).values_list('pk', 'article_id'))
+    results = chunk_results(len(ids))
+    for i, pk in enumerate(ids):
+        if pk not in found:
+            results[i] = result(offset + i, pk, 404, 'Comment not found')
+    with bulk_operation():
+        SearchDocument.objects.filter(kind=SearchDocument.COMMENT, object_id__in=doomed).delete()
+        Comment.objects.filter(pk__in=doomed).delete()
+        for article_id, count in Counter(doomed.values()).items():
+            comments_removed(article_id, count)
+        answered = Counter(
+            comment.parent_id for comment in found.values()
+            if comment.parent_id is not None and comment.parent_id not in doomed
+        )
+        replies_changed({parent_id: -count for parent_id, count in answered.items()})
+    invalidate('articles', *(f'article:{article_id}' for article_id in set(doomed.values())))
+    for i, pk in enumerate(ids):
+        if pk in found:
+            results[i] = result(offset + i, pk, 200)
+    return results
+
+
+def create_categories(items, offset):
+    categories = Category.objects.bulk_create([Category(name=item.name) for item in items], batch_size=500)
+    return [result(offset + i, category.pk, 201) for i, category in enumerate(categories)]
+
+
+def update_categories(items, offset):
+    existing = Category.objects.in_bulk([item.id for item in items])
+    results = chunk_results(len(items))
+    for i, item in enumerate(items):
+        if item.id in existing:
+            existing[item.id].name = item.name
+        else:
+            results[i] = result(offset + i, item.id, 404, 'Category not found')
+    Category.objects.bulk_update(list(existing.values()), ['name'], batch_size=500)
+    for i, item in enumerate(items):
+        if item.id in existing:
+            results[i] = result(offset + i, item.id, 200)
+    return results
+
+
+def delete_categories(ids, offset):
+    found = set(Category.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    results = chunk_results(len(ids))
+    for i, pk in enumerate(ids):
+        if pk not in found:
+            results[i] = result(offset + i, pk, 404, 'Category not found')
+    Category.objects.filter(pk__in=found).delete()
+    for i, pk in enumerate(ids):
+        if pk in found:
+            results[i] = result(offset + i, pk, 200)
+    return results
+
+
+async def apply_ndjson(func, lines, schema, *args):
+    """apply_in_chunks over an async stream of NDJSON lines, validated one
+    by one against `schema`, so an upload of any size is written in
+    BULK_BATCH_SIZE transactions as it arrives. Yields the results in line
+    order, a batch at a time as it is written. Lines that do not validate
+    are reported with status 422 and lines cut off by ndjson_lines with
+    413, and skipped."""
+    results = []
+    batch, positions = [], []
+    index = 0
+    async for line in lines:
+        if line is None:
+            error = f'Lines are limited to {settings.BULK_MAX_LINE_BYTES} bytes'
+            results.append(result(index, status=413, error=error))
+        elif not line.strip():
+            continue
+        else:
+            try:
+                batch.append(schema.model_validate_json(line))
+                positions.append(index)
+            except ValidationError as exc:
+                results.append(result(index, status=422, error=_validation_message(exc)))
+        index += 1
+        if len(batch) + len(results) >= settings.BULK_BATCH_SIZE:
+            if batch:
+                results.extend(await _apply_positioned(func, batch, positions, args))
+            for item in sorted(results, key=lambda item: item['index']):
+                yield item
+            results, batch, positions = [], [], []
+    if batch:
+        results.extend(await _apply_positioned(func, batch, positions, args))
+    for item in sorted(results, key=lambda item: item['index']):
+        yield item
+
+
+async def _apply_positioned(func, batch, positions, args):
+    results = await sync_to_async(_apply_chunk)(func, batch, 0, *args)
+    for item in results:
+        item['index'] = positions[item['index']]
+    return results
+
+
+def _validation_message(exc):
+    return '; '.join(
+        '%s: %s' % ('.'.join(str(part) for part in error['loc']) or 'line', error['msg'])
+        for error in exc.errors()
+    )
+
+
+async def ndjson_lines(request):
+    """The lines of a request body, read as it streams in. A line longer
+    than BULK_MAX_LINE_BYTES is dropped as it arrives and yielded as None,
+    so no more than that is ever held."""
+    pieces, size, too_long = [], 0, False
+    async for chunk in request.stream():
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            piece = chunk[start:] if end < 0 else chunk[start:end]
+            size += len(piece)
+            if size > settings.BULK_MAX_LINE_BYTES:
+                pieces, too_long = [], True
+            elif piece:
+                pieces.append(piece)
+            if end < 0:
+                break
+            yield None if too_long else b''.join(pieces)
+            pieces, size, too_long = [], 0, False
+            start = end + 1
+    yield None if too_long else b''.join(pieces)
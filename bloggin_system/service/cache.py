@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from fastapi import Response
+
+from .metrics import record_cache
+from .responses import dump_json
+from .routers import reads_from
+
+
+def _version_key(namespace):
+    return f'resp:version:{namespace}'
+
+
+def _fresh_version():
+    # Versions start from the clock so a counter that was evicted comes
+    # back larger than any version an old entry may still be stored under.
+    return time.time_ns() // 1000
+
+
+async def get_version(namespace):
+    version = await cache.aget(_version_key(namespace))
+    if version is None:
+        await cache.aadd(_version_key(namespace), _fresh_version(), None)
+        version = await cache.aget(_version_key(namespace), _fresh_version())
+    return version
+
+
+def invalidate(*namespaces):
+    """Bump the version of each namespace, orphaning every response cached
+    under the old one, once the current transaction commits: bumped any
+    earlier, a request could cache the data the write is about to replace
+    under the new version. Called from model signals, hence sync."""
+    transaction.on_commit(lambda: _bump_versions(namespaces), robust=True)
+
+
+def _bump_versions(namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError:
+            cache.set(_version_key(namespace), _fresh_version(), None)
+
+
+def _entry(body):
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+    return etag, body
+
+
+async def _fill(key, build):
+    """Build the entry for `key` with at most one builder per key at a time;
+    concurrent misses wait for that builder instead of all hitting the DB.
+    Builds read from the primary: an entry built from a lagging replica
+    would outlive the write it missed, under the version that write
+    bumped, and serve it even to the writer."""
+    lock = f'{key}:lock'
+    timeout = settings.RESPONSE_CACHE_LOCK_TIMEOUT
+    if await cache.aadd(lock, 1, timeout):
+        try:
+            with reads_from(False):
+                entry = _entry(dump_json(await build()))
+            await cache.aset(key, entry, settings.CACHE_TTL)
+            return entry
+        finally:
+            await cache.adelete(lock)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(settings.RESPONSE_CACHE_POLL_INTERVAL)
+        found = await cache.aget_many([key, lock])
+        if key in found:
+            return found[key]
+        if lock not in found:
+            # The builder finished without storing anything (its build
+            # raised): nothing more is coming.
+            break
+    # Or the builder died or is too slow; don't stall this request any longer.
+    with reads_from(False):
+        return _entry(dump_json(await build()))
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    # Weak comparison: W/"x" matches "x".
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any((tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+async def cached_response(request, namespace, params, build):
+    """Serve the JSON for `build()` (an async callable returning a pydantic
+    model or plain JSON-shaped data) from the cache, keyed by the namespace's current version and
+    `params`, answering 304 when the client already holds that ETag."""
+    version = await get_version(namespace)
+    digest = hashlib.blake2b(repr(params).encode(), digest_size=12).hexdigest()
+    key = f'resp:{namespace}:{version}:{digest}'
+    entry = await cache.aget(key)
+    record_cache(entry is not None)
+    if entry is None:
+        entry = await _fill(key, build)
+    etag, body = entry
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag})
+    return Response(content=body, media_type='application/json', headers={'ETag': etag})
@@ -0,0 +1,66 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Article, Comment
+
+
+def _latest_comment():
+    return Subquery(
+        Comment.objects.filter(article=OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+    )
+
+
+def _comment_total():
+    return Coalesce(Subquery(
+        Comment.objects.filter(article=OuterRef('pk')).order_by().values('article')
+        .annotate(total=Count('id')).values('total'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def comments_added(article_id, count, newest):
+    """Count `count` new comments on an article in a single UPDATE, so
+    concurrent writers never lose an increment."""
+    Article.objects.filter(pk=article_id).update(
+        comment_count=F('comment_count') + count,
+        last_commented_at=Greatest(Coalesce('last_commented_at', Value(newest)), Value(newest)),
+    )
+
+
+def comments_removed(article_id, count):
+    # Runs after the rows are gone, so the subquery sees what is left.
+    Article.objects.filter(pk=article_id).update(
+        comment_count=Greatest(F('comment_count') - count, Value(0)),
+        last_commented_at=_latest_comment(),
+    )
+
+
+def replies_changed(deltas):
+    """Add {comment_id: delta} to Comment.reply_count, one UPDATE per
+    distinct delta."""
+    comments_by_delta = {}
+    for comment_id, delta in deltas.items():
+        if delta:
+            comments_by_delta.setdefault(delta, []).append(comment_id)
+    for delta, comment_ids in comments_by_delta.items():
+        Comment.objects.filter(pk__in=comment_ids).update(reply_count=Greatest(F('reply_count') + delta, Value(0)))
+
+
+def reconcile_comment_counts(chunk_size=2000):
+    """Recount every article's comments and fix the rows that drifted, e.g.
+    through raw SQL or a crash between a write and its signal. Returns the
+    number of articles repaired."""
+    articles = Article.objects.annotate(actual_count=_comment_total(), actual_latest=_latest_comment())
+    drifted = []
+    repaired = 0
+    for pk, count, latest, actual_count, actual_latest in articles.values_list(
+        'pk', 'comment_count', 'last_commented_at', 'actual_count', 'actual_latest',
+    ).order_by('pk').iterator(chunk_size=chunk_size):
+        if (count, latest) != (actual_count, actual_latest):
+            drifted.append(Article(pk=pk, comment_count=actual_count, last_commented_at=actual_latest))
+        if len(drifted) == chunk_size:
+            Article.objects.bulk_update(drifted, ['comment_count', 'last_commented_at'])
+            repaired += len(drifted)
+            drifted = []
+    Article.objects.bulk_update(drifted, ['comment_count', 'last_commented_at'])
+    return repaired + len(drifted)
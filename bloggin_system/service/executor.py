@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The dedicated pool for sync code on the async request path, sized by
+    SYNC_EXECUTOR_WORKERS. Zero disables it, and such code then runs in the
+    request's thread-sensitive context like the async ORM itself."""
+    global _executor
+    if not settings.SYNC_EXECUTOR_WORKERS:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SYNC_EXECUTOR_WORKERS,
+                thread_name_prefix='service-sync',
+            )
+    return _executor
+
+
+def _in_worker(func, *args, **kwargs):
+    # Executor threads live outside Django's request cycle, so nobody else
+    # closes the connections they open.
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    executor = get_executor()
+    if executor is None:
+        return await sync_to_async(func)(*args, **kwargs)
+    return await sync_to_async(_in_worker, thread_sensitive=False, executor=executor)(func, *args, **kwargs)
@@ -0,0 +1,119 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .executor import run_sync
+from .models import Article, Category, Tag
+
+FORMATS = ('ndjson', 'csv')
+COLUMNS = ['id', 'title', 'content', 'author', 'published_date', 'tags', 'categories']
+MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def export_queryset(after_id=None, since=None):
+    """Every published article in id order, optionally resuming after
+    `after_id` and limited to those published at or after `since`. Only
+    the exported columns are loaded; tags and categories are prefetched
+    per chunk."""
+    articles = (
+        Article.objects.published().select_related('author')
+        .only('id', 'title', 'content', 'published_date', 'author__username')
+        .prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.only('name')),
+            Prefetch('categories', queryset=Category.objects.only('name')),
+        )
+        .order_by('id')
+    )
+    if after_id is not None:
+        articles = articles.filter(id__gt=after_id)
+    if since is not None:
+        articles = articles.filter(published_date__gte=since)
+    return articles
+
+
+def export_row(article):
+    return {
+        'id': article.id,
+        'title': article.title,
+        'content': article.content,
+        'author': article.author.username,
+        'published_date': article.published_date.isoformat(),
+        'tags': [tag.name for tag in article.tags.all()],
+        'categories': [category.name for category in article.categories.all()],
+    }
+
+
+class _Encoder:
+    """Turns rows into text, buffering up to `chunk_size` rows per piece so
+    a stream is written in a few large sends rather than one per row."""
+
+    def __init__(self, format, chunk_size):
+        self.format = format
+        self.chunk_size = chunk_size
+        self.buffer = io.StringIO()
+        self.rows = 0
+        if format == 'csv':
+            self.writer = csv.writer(self.buffer)
+            self.writer.writerow(COLUMNS)
+
+    def add(self, article):
+        row = export_row(article)
+        if self.format == 'csv':
+            row['tags'] = ';'.join(row['tags'])
+            row['categories'] = ';'.join(row['categories'])
+            self.writer.writerow([row[column] for column in COLUMNS])
+        else:
+            self.buffer.write(json.dumps(row, ensure_ascii=False))
+            self.buffer.write('\n')
+        self.rows += 1
+        if self.rows % self.chunk_size == 0:
+            return self.flush()
+        return None
+
+    def flush(self):
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+
+def export_articles(format='ndjson', after_id=None, since=None, chunk_size=None):
+    """Text pieces of the export. Rows come from a server-side cursor
+    (where the backend has them) `chunk_size` at a time, so memory use
+    does not grow with the table."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    encoder = _Encoder(format, chunk_size)
+    for article in export_queryset(after_id, since).iterator(chunk_size=chunk_size):
+        piece = encoder.add(article)
+        if piece:
+            yield piece
+    tail = encoder.flush()
+    if tail:
+        yield tail
+
+
+def _chunk(after_id, since, chunk_size):
+    return list(export_queryset(after_id, since)[:chunk_size])
+
+
+async def aexport_articles(format='ndjson', after_id=None, since=None, chunk_size=None):
+    """export_articles for the async request path. Each chunk is a keyset
+    query with its prefetches, run through run_sync: aiterator() does not
+    prefetch before Django 5.0."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    encoder = _Encoder(format, chunk_size)
+    while True:
+        articles = await run_sync(_chunk, after_id, since, chunk_size)
+        for article in articles:
+            piece = encoder.add(article)
+            if piece:
+                yield piece
+        if len(articles) < chunk_size:
+            break
+        after_id = articles[-1].id
+    tail = encoder.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,255 @@
+"""Per-author and per-category article feeds, newest first.
+
+A feed is ordered by (published_date, id), so a draft takes its place
+when it is published rather than where its id would put it. A position
+is carried as (score, id), the score being published_date in
+microseconds since the epoch: the keyset cursor and, in the sorted set,
+the score of a member named by the zero-padded id, so that members with
+equal scores sort by id. Feeds that are read get cached in Redis as a
+sorted set of their newest FEED_CACHE_SIZE articles, which saves and
+deletes, publishing and category changes then keep up to date in place
+rather than invalidate. Without Redis every page is a keyset query."""
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .executor import run_sync
+from .models import Article
+from .pagination import InvalidCursor, clamp_limit, decode_values, encode_cursor
+from .queries import ashape_rows, values_queryset
+from .redis_client import get_redis
+from .schemas import ArticleSummary
+
+ArticleCategory = Article.categories.through
+
+AUTHOR = 'author'
+CATEGORY = 'category'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Each cached feed holds a `bound` member scored with the score at and
+# below which its articles are not cached (0 when the whole feed is), so
+# articles published in the same microsecond are cached all or none;
+# every other member is an article.
+#
+# For one feed: bump its version, so a fill that read the database before
+# this change does not store what it read, then apply the change if the
+# feed is cached. Adding past FEED_CACHE_SIZE drops the oldest articles
+# and raises the bound. ARGV: add, remove or forget; size; ttl; then a
+# score (ignored by remove) and a member per article.
+UPDATE_FEED = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if ARGV[1] == 'forget' then
+    redis.call('DEL', KEYS[1])
+    return
+end
+local bound = redis.call('ZSCORE', KEYS[1], 'bound')
+if not bound then
+    return
+end
+for i = 4, #ARGV, 2 do
+    if ARGV[1] == 'remove' then
+        redis.call('ZREM', KEYS[1], ARGV[i + 1])
+    elseif tonumber(ARGV[i]) > tonumber(bound) then
+        redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+local excess = redis.call('ZCARD', KEYS[1]) - 1 - tonumber(ARGV[2])
+if excess > 0 then
+    local last = redis.call('ZRANGE', KEYS[1], excess, excess, 'WITHSCORES')[2]
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', last)
+    redis.call('ZADD', KEYS[1], last, 'bound')
+end
+"""
+
+# Store a feed read from the database, unless it was cached or changed
+# meanwhile. ARGV: the version seen before reading; ttl; bound; then a
+# score and a member per article.
+FILL_FEED = """
+if redis.call('EXISTS', KEYS[1]) == 1 or (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], 'bound')
+for i = 4, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def feed_key(kind, owner_id):
+    return f'feed:{kind}:{owner_id}'
+
+
+def _version_key(kind, owner_id):
+    return f'feed:{kind}:{owner_id}:version'
+
+
+def score(published_date):
+    """The feed score of an article published at `published_date`."""
+    return (published_date - _EPOCH) // timedelta(microseconds=1)
+
+
+def _member(pk):
+    return '%020d' % pk
+
+
+def _positions_queryset(kind, owner_id, before=None):
+    # Author feeds are served by article_author_idx; category feeds walk
+    # article_published_idx, checking each article's categories.
+    queryset = Article.objects.published()
+    if kind == AUTHOR:
+        queryset = queryset.filter(author_id=owner_id)
+    else:
+        queryset = queryset.filter(categories=owner_id)
+    if before is not None:
+        published_date = _EPOCH + timedelta(microseconds=before[0])
+        queryset = queryset.filter(
+            Q(published_date__lt=published_date) | Q(published_date=published_date, id__lt=before[1])
+        )
+    return queryset.order_by('-published_date', '-id').values_list('published_date', 'id')
+
+
+def _fill(redis, kind, owner_id):
+    """Read the newest FEED_CACHE_SIZE positions of a feed and cache them."""
+    version = redis.get(_version_key(kind, owner_id)) or b''
+    size = settings.FEED_CACHE_SIZE
+    positions = [(score(published_date), pk) for published_date, pk in _positions_queryset(kind, owner_id)[:size + 1]]
+    bound = 0
+    if len(positions) > size:
+        bound = positions[size][0]
+        positions = [position for position in positions if position[0] > bound]
+    members = [value for position_score, pk in positions for value in (position_score, _member(pk))]
+    redis.eval(
+        FILL_FEED, 2, feed_key(kind, owner_id), _version_key(kind, owner_id),
+        version, settings.FEED_CACHE_TTL, bound, *members,
+    )
+    return positions, bound
+
+
+def _positions(members):
+    return [(int(member_score), int(member)) for member, member_score in members if member.isdigit()]
+
+
+def cached_positions(kind, owner_id, before, limit):
+    """Up to `limit` + 1 positions of the feed past `before` from its
+    sorted set, filling it on a miss; None when the page reaches past what
+    is cached."""
+    redis = get_redis()
+    key = feed_key(kind, owner_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.zscore(key, 'bound')
+    if before is None:
+        pipe.zrevrangebyscore(key, '+inf', '-inf', start=0, num=limit + 2, withscores=True)
+    else:
+        # Those published with the cursor's article and then those before
+        # it; there are few of the former.
+        pipe.zrevrangebyscore(key, before[0], before[0], withscores=True)
+        pipe.zrevrangebyscore(key, f'({before[0]}', '-inf', start=0, num=limit + 2, withscores=True)
+    pipe.expire(key, settings.FEED_CACHE_TTL)
+    bound, *results, _ = pipe.execute()
+    if bound is None:
+        positions, bound = _fill(redis, kind, owner_id)
+    else:
+        positions = [position for result in results for position in _positions(result)]
+    if before is not None:
+        positions = [position for position in positions if position < tuple(before)]
+    positions = positions[:limit + 1]
+    if len(positions) > limit or not bound:
+        return positions
+    return None
+
+
+async def _hydrate(ids, schema):
+    """The articles behind `ids`, in that order, as `schema`, read with one
+    query for the rows (plus one per to-many field)."""
+    queryset = values_queryset(Article.objects.filter(id__in=ids), schema)
+    rows = {row['id']: row async for row in queryset}
+    return await ashape_rows(Article, [rows[pk] for pk in ids if pk in rows], schema)
+
+
+async def feed_page(kind, owner_id, cursor=None, limit=None, schema=ArticleSummary):
+    """A page of a feed as {"items": [...], "next_cursor": ...}."""
+    limit = clamp_limit(limit)
+    before = None
+    if cursor:
+        before = decode_values(cursor, 2)
+        if not all(isinstance(value, int) for value in before):
+            raise InvalidCursor(cursor)
+    positions = None
+    if get_redis() is not None:
+        positions = await run_sync(cached_positions, kind, owner_id, before, limit)
+    if positions is None:
+        positions = [
+            (score(published_date), pk)
+            async for published_date, pk in _positions_queryset(kind, owner_id, before)[:limit + 1]
+        ]
+    next_cursor = encode_cursor(list(positions[limit - 1])) if len(positions) > limit else None
+    ids = [pk for _, pk in positions[:limit]]
+    return {"items": await _hydrate(ids, schema), "next_cursor": next_cursor}
+
+
+def _apply(action, changes):
+    scores = {}
+    if action == 'add':
+        # Read now, after the commit: publishing sets published_date.
+        ids = {pk for article_ids in changes.values() for pk in article_ids}
+        scores = {pk: score(published_date) for pk, published_date in Article.objects.filter(
+            pk__in=ids, status=Article.PUBLISHED,
+        ).values_list('pk', 'published_date')}
+    redis = get_redis()
+    pipe = redis.pipeline(transaction=False)
+    for (kind, owner_id), ids in changes.items():
+        members = [
+            value for pk in ids if action != 'add' or pk in scores for value in (scores.get(pk, 0), _member(pk))
+        ]
+        pipe.eval(
+            UPDATE_FEED, 2, feed_key(kind, owner_id), _version_key(kind, owner_id),
+            action, settings.FEED_CACHE_SIZE, settings.FEED_CACHE_TTL, *members,
+        )
+    pipe.execute()
+
+
+def update_feeds(action, changes):
+    """Apply `action` (add, remove or forget) for {(kind, owner id): [article
+    ids]} to the cached feeds once the current transaction commits, so
+    readers never see ids that may yet roll back. A failure to reach Redis
+    is logged rather than failing a write that already committed."""
+    if changes and get_redis() is not None:
+        # Not a partial: a robust callback that fails is logged by __qualname__.
+        transaction.on_commit(lambda: _apply(action, changes), robust=True)
+
+
+def category_feeds(categories_by_article):
+    """{(CATEGORY, category id): [article ids]} from {article id: [category ids]}."""
+    changes = {}
+    for article_id, category_ids in categories_by_article.items():
+        for category_id in set(category_ids):
+            changes.setdefault((CATEGORY, category_id), []).append(article_id)
+    return changes
+
+
+def category_links(article_ids):
+    """The same for the articles' categories as stored; empty, without a
+    query, when there is no Redis to update."""
+    if get_redis() is None:
+        return {}
+    changes = {}
+    for article_id, category_id in ArticleCategory.objects.filter(article_id__in=article_ids).values_list(
+        'article_id', 'category_id'
+    ):
+        changes.setdefault((CATEGORY, category_id), []).append(article_id)
+    return changes
+
+
+def remove_articles(articles):
+    """Take (id, author id) pairs out of their feeds; call before the
+    delete, which cascades to the category links."""
+    changes = category_links([pk for pk, _ in articles])
+    for pk, author_id in articles:
+        changes.setdefault((AUTHOR, author_id), []).append(pk)
+    update_feeds('remove', changes)
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import models
+
+try:
+    import zstandard
+except ImportError:  # optional: without it every body is stored as plain UTF-8
+    zstandard = None
+
+# Every zstd frame starts with these bytes, which no UTF-8 text can.
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class CompressedTextField(models.TextField):
+    """Text kept in a binary column: UTF-8, or a zstd frame for values of
+    at least COMPRESSED_TEXT_MIN_BYTES when zstandard is installed and the
+    frame comes out smaller. Reads tell the two apart by the zstd magic
+    number, so rows written either way (or before the column held
+    compressed values at all) read back the same. Being binary, the column
+    cannot be searched with LIKE lookups."""
+
+    def get_internal_type(self):
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if value.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise RuntimeError(f'{self.model.__name__}.{self.name} holds zstd data; install zstandard to read it')
+            value = zstandard.ZstdDecompressor().decompress(value)
+        return value.decode()
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is None:
+            return None
+        data = value.encode()
+        minimum = settings.COMPRESSED_TEXT_MIN_BYTES
+        if zstandard is not None and minimum and len(data) >= minimum:
+            compressed = zstandard.ZstdCompressor(level=settings.COMPRESSED_TEXT_LEVEL).compress(data)
+            if len(compressed) < len(data):
+                data = compressed
+        return connection.Database.Binary(data)
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from django.core.cache import cache
+from django.db import connections
+from django.urls import reverse
+
+from .executor import run_sync
+from .middleware import on_each_lane
+from .passwords import shutdown_pool
+from .viewcounts import push_views, view_buffer
+
+logger = logging.getLogger(__name__)
+
+
+# Run on each lane; connections are per thread.
+def _connect():
+    for alias in connections:
+        connections[alias].ensure_connection()
+
+
+def _disconnect():
+    connections.close_all()
+
+
+def _persistent_connections():
+    return connections['default'].settings_dict['CONN_MAX_AGE'] != 0
+
+
+async def warm_up(app):
+    """Do before the first request what it would otherwise pay for: build
+    the URL resolvers and the OpenAPI schema, connect to the cache, and open
+    connections to the primary and replicas on every ORM lane when
+    connections persist."""
+    reverse('admin:index')
+    app.openapi()
+    try:
+        await cache.aget('warm-up')
+    except Exception:
+        logger.warning('Cache unavailable at startup', exc_info=True)
+    if _persistent_connections():
+        await on_each_lane(_connect)
+
+
+async def shut_down():
+    """Hand on the views still buffered in this process and release the
+    worker's pools and connections."""
+    try:
+        await run_sync(push_views, view_buffer.drain())
+    except Exception:
+        logger.exception('Could not save buffered article views')
+    # asyncio.to_thread() is Python 3.9+.
+    await asyncio.get_running_loop().run_in_executor(None, shutdown_pool)
+    await on_each_lane(_disconnect)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    started = time.perf_counter()
+    await warm_up(app)
+    logger.info('Worker ready in %.0f ms', (time.perf_counter() - started) * 1000)
+    try:
+        yield
+    finally:
+        await shut_down()
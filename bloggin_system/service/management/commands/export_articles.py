@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from service.export import FORMATS, export_articles
+
+
+class Command(BaseCommand):
+    help = 'Stream every article as NDJSON or CSV without loading the table into memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--output', help='file to write; defaults to stdout')
+        parser.add_argument('--after-id', type=int, help='resume after this article id')
+        parser.add_argument('--since', help='only articles published at or after this ISO timestamp')
+        parser.add_argument('--chunk-size', type=int, help='rows per database fetch (default EXPORT_CHUNK_SIZE)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since timestamp: {options['since']}")
+        pieces = export_articles(options['format'], options['after_id'], since, options['chunk_size'])
+        # Appending lets an interrupted export be resumed with --after-id.
+        output = open(options['output'], 'a', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for piece in pieces:
+                output.write(piece)
+                output.flush()
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,25 @@
+import uvicorn
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Serve the API and the Django site from one ASGI application with uvicorn workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--workers', type=int, default=settings.ASGI_WORKERS,
+                            help='worker processes (default ASGI_WORKERS)')
+        parser.add_argument('--reload', action='store_true', help='restart on code changes; implies one worker')
+
+    def handle(self, *args, **options):
+        uvicorn.run(
+            'bloggin_system.asgi:application',
+            host=options['host'],
+            port=options['port'],
+            workers=None if options['reload'] else options['workers'],
+            reload=options['reload'],
+            lifespan='on',
+            app_dir=str(settings.BASE_DIR),
+        )
@@ -0,0 +1,277 @@
+"""Image uploads.
+
+An upload is parsed as it streams in and written to a temporary file under
+MEDIA_ROOT a chunk at a time, hashing as it goes, so no more than a chunk
+of it is ever held in memory. The file is then moved to a path named by
+the SHA-256 of its content: uploading the same image again finds the file
+and the MediaFile row already there and stores nothing new. Resizing is
+left to the media.process outbox handler, run by the drain_outbox task on
+the Celery workers, which writes WebP copies MEDIA_IMAGE_WIDTHS wide and a
+square thumbnail next to the original, each named by its own content hash.
+
+As no path ever holds different bytes, everything under MEDIA_URL is
+served with a year-long immutable Cache-Control (MediaFiles), the way
+WhiteNoise serves the hashed names of the manifest static files storage."""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from PIL import Image, ImageOps
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.staticfiles import StaticFiles
+
+from .executor import run_sync
+from .models import MediaFile
+from .outbox import enqueue, handler
+
+logger = logging.getLogger(__name__)
+
+# Leading bytes of the image formats we accept, and what they are stored as.
+SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', 'png'),
+    (b'GIF87a', 'image/gif', 'gif'),
+    (b'GIF89a', 'image/gif', 'gif'),
+]
+WEBP = ('image/webp', 'webp')
+UPLOAD_FIELD = 'file'
+_TEMP_DIR = '.uploads'
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff(head):
+    """(content type, extension) of an image by its first bytes, or None."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return WEBP
+    for signature, content_type, extension in SIGNATURES:
+        if head.startswith(signature):
+            return content_type, extension
+    return None
+
+
+def _sharded(name):
+    return f'{name[:2]}/{name}'
+
+
+def _write_once(path, data):
+    # The name is the content's hash: a file already there holds these bytes.
+    full_path = os.path.join(settings.MEDIA_ROOT, path)
+    if os.path.exists(full_path):
+        return
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(full_path), delete=False) as file:
+        file.write(data)
+    os.replace(file.name, full_path)
+
+
+class _Upload:
+    """The file part of a multipart body, written to a temporary file as
+    the parser hands it over."""
+
+    def __init__(self):
+        directory = os.path.join(settings.MEDIA_ROOT, _TEMP_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+        self.hash = hashlib.sha256()
+        self.head = b''
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > settings.MEDIA_MAX_UPLOAD_BYTES:
+            raise UploadRejected(413, f'Uploads are limited to {settings.MEDIA_MAX_UPLOAD_BYTES} bytes')
+        if len(self.head) < 16:
+            self.head += data[:16]
+        self.hash.update(data)
+        self.file.write(data)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+
+class _FormReader:
+    """Feeds a multipart body to the parser and keeps the first part named
+    UPLOAD_FIELD that has a filename; every other part is skipped."""
+
+    def __init__(self, boundary):
+        self.upload = None
+        self.done = False
+        self.header_field = b''
+        self.header_value = b''
+        self.disposition = b''
+        self.writing = False
+        self.parser = MultipartParser(boundary, {
+            'on_part_begin': self.on_part_begin,
+            'on_header_field': self.on_header_field,
+            'on_header_value': self.on_header_value,
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+        })
+
+    def feed(self, chunk):
+        self.parser.write(chunk)
+
+    def on_part_begin(self):
+        self.disposition = b''
+
+    def on_header_field(self, data, start, end):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        if self.header_field.lower() == b'content-disposition':
+            self.disposition = self.header_value
+        self.header_field = self.header_value = b''
+
+    def on_headers_finished(self):
+        _, params = parse_options_header(self.disposition)
+        self.writing = (
+            not self.done and params.get(b'name') == UPLOAD_FIELD.encode() and b'filename' in params
+        )
+        if self.writing:
+            self.upload = _Upload()
+
+    def on_part_data(self, data, start, end):
+        if self.writing:
+            self.upload.write(data[start:end])
+
+    def on_part_end(self):
+        if self.writing:
+            self.done = True
+            self.writing = False
+
+
+async def receive_upload(request, user):
+    """Store the image in the multipart form field UPLOAD_FIELD of
+    `request` and return its MediaFile, queueing the resized copies when
+    the image is new. Raises UploadRejected for anything else."""
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or not params.get(b'boundary'):
+        raise UploadRejected(400, 'Expected a multipart/form-data body')
+    if int(request.headers.get('content-length') or 0) > settings.MEDIA_MAX_UPLOAD_BYTES + 64 * 1024:
+        raise UploadRejected(413, f'Uploads are limited to {settings.MEDIA_MAX_UPLOAD_BYTES} bytes')
+    reader = _FormReader(params[b'boundary'])
+    try:
+        async for chunk in request.stream():
+            # File writes are blocking; the parser calls them as it goes.
+            await run_sync(reader.feed, chunk)
+        if not reader.done:
+            raise UploadRejected(400, f'Expected an image file in the "{UPLOAD_FIELD}" field')
+        return await run_sync(store_upload, reader.upload, user)
+    finally:
+        if reader.upload is not None:
+            await run_sync(reader.upload.discard)
+
+
+def store_upload(upload, user):
+    """Move a received upload to its content-addressed path and record it,
+    or find it already recorded."""
+    upload.file.close()
+    kind = sniff(upload.head)
+    if kind is None:
+        raise UploadRejected(415, 'Only JPEG, PNG, GIF and WebP images can be uploaded')
+    content_type, extension = kind
+    sha256 = upload.hash.hexdigest()
+    existing = MediaFile.objects.filter(sha256=sha256).first()
+    if existing is not None:
+        return existing
+    path = f'{_sharded(sha256)}.{extension}'
+    full_path = os.path.join(settings.MEDIA_ROOT, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    os.replace(upload.file.name, full_path)
+    try:
+        with transaction.atomic():
+            media = MediaFile.objects.create(
+                sha256=sha256, path=path, content_type=content_type, size=upload.size, uploaded_by=user,
+            )
+            enqueue('media.process', {'id': media.pk}, key=f'media:{media.pk}')
+    except IntegrityError:
+        # A concurrent upload of the same image won the race.
+        return MediaFile.objects.get(sha256=sha256)
+    return media
+
+
+def _rendition(image, label):
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', quality=settings.MEDIA_WEBP_QUALITY)
+    data = buffer.getvalue()
+    content_type, extension = WEBP
+    path = f'{_sharded(hashlib.sha256(data).hexdigest())}.{extension}'
+    _write_once(path, data)
+    return label, {
+        'path': path, 'width': image.width, 'height': image.height, 'size': len(data), 'content_type': content_type,
+    }
+
+
+def render_variants(path):
+    """The WebP copies of the image at `path`: one per MEDIA_IMAGE_WIDTHS
+    width narrower than it, and a MEDIA_THUMBNAIL_SIZE square thumbnail.
+    Returns ((width, height), {name: variant})."""
+    with Image.open(os.path.join(settings.MEDIA_ROOT, path)) as image:
+        # Only the header has been read so far.
+        if image.width * image.height > settings.MEDIA_MAX_PIXELS:
+            raise Image.DecompressionBombError(f'{image.width}x{image.height} is over MEDIA_MAX_PIXELS')
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    variants = []
+    # Widest first, each resized from the one before: cheaper than going
+    # back to the full image every time, and as sharp.
+    source = image
+    for width in sorted((w for w in settings.MEDIA_IMAGE_WIDTHS if w < image.width), reverse=True):
+        source = source.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+        variants.append(_rendition(source, f'{width}w'))
+    size = settings.MEDIA_THUMBNAIL_SIZE
+    variants.append(_rendition(ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS), 'thumbnail'))
+    return image.size, dict(variants)
+
+
+@handler('media.process')
+def process_media(payload):
+    media = MediaFile.objects.filter(pk=payload['id'], status=MediaFile.PENDING).first()
+    if media is None:
+        return
+    try:
+        (width, height), variants = render_variants(media.path)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+        # Pillow reports undecodable images as OSErrors without an errno;
+        # those with one (a full disk, say) are worth retrying.
+        if isinstance(exc, OSError) and exc.errno is not None:
+            raise
+        logger.warning('Media %s could not be processed: %s', media.pk, exc)
+        MediaFile.objects.filter(pk=media.pk).update(status=MediaFile.FAILED)
+        return
+    MediaFile.objects.filter(pk=media.pk).update(
+        status=MediaFile.READY, width=width, height=height, variants=variants,
+    )
+
+
+class MediaFiles(StaticFiles):
+    """MEDIA_ROOT, served with an immutable Cache-Control: every file's
+    name is the hash of its content. Uploads still being received (under
+    a dot directory) are not served."""
+
+    def lookup_path(self, path):
+        if any(part.startswith('.') for part in path.split(os.sep)):
+            return '', None
+        return super().lookup_path(path)
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers['Cache-Control'] = f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable'
+        return response
@@ -0,0 +1,141 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    """What one request spent; shared by reference with every thread the
+    request's sync code runs on, since those copy the request's context."""
+
+    __slots__ = ('queries', 'db_seconds', 'cache_hits', 'cache_misses', 'response_bytes')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.response_bytes = 0
+
+
+current = ContextVar('request_stats', default=None)
+
+
+def _track_query(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_seconds += time.perf_counter() - started
+        stats.queries += 1
+
+
+def _install(connection, **kwargs):
+    # The wrapper object outlives reconnects; only add the tracker once.
+    if _track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_track_query)
+
+
+connection_created.connect(lambda sender, connection, **kwargs: _install(connection), weak=False)
+for _connection in connections.all(initialized_only=True):
+    _install(_connection)
+
+
+def record_cache(hit):
+    stats = current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """Per-route totals for this process. Each worker process keeps its own;
+    Prometheus scrapes and sums them like any multi-process target."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.db_seconds = defaultdict(float)
+        self.cache = defaultdict(int)
+        self.response_bytes = defaultdict(int)
+
+    def observe(self, method, route, status, seconds, stats):
+        key = (method, route)
+        with self.lock:
+            self.requests[(method, route, status)] += 1
+            self.latency[key].observe(seconds)
+            self.queries[key].observe(stats.queries)
+            self.db_seconds[key] += stats.db_seconds
+            self.cache[(method, route, 'hit')] += stats.cache_hits
+            self.cache[(method, route, 'miss')] += stats.cache_misses
+            self.response_bytes[key] += stats.response_bytes
+
+    def render(self):
+        """The Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            _counter(lines, 'http_requests_total', 'Requests handled.', ('method', 'route', 'status'), self.requests)
+            _histogram(lines, 'http_request_duration_seconds', 'Time to handle a request.', self.latency)
+            _histogram(lines, 'http_request_db_queries', 'Database queries per request.', self.queries)
+            _counter(lines, 'http_request_db_seconds_total', 'Time spent in database queries.', ('method', 'route'), self.db_seconds)
+            _counter(lines, 'http_response_cache_total', 'Response cache lookups.', ('method', 'route', 'result'), self.cache)
+            _counter(lines, 'http_response_bytes_total', 'Response body bytes sent.', ('method', 'route'), self.response_bytes)
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(names, values):
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _counter(lines, name, help, label_names, values):
+    lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+    for key, value in sorted(values.items()):
+        lines.append(f'{name}{{{_labels(label_names, key)}}} {_number(value)}')
+
+
+def _histogram(lines, name, help, histograms):
+    lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+    for key, histogram in sorted(histograms.items()):
+        labels = _labels(('method', 'route'), key)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {_number(histogram.sum)}')
+        lines.append(f'{name}_count{{{labels}}} {cumulative}')
+
+
+registry = Registry()
@@ -0,0 +1,325 @@
+import asyncio
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import close_old_connections
+from fastapi import HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional: responses are then gzip compressed only
+    brotli = None
+
+from .auth import get_current_user
+from .executor import run_sync
+from .metrics import RequestStats, current, registry
+from .profiling import Sampler, write_profile
+from .routers import reads_from
+
+logger = logging.getLogger(__name__)
+
+
+class _Lane:
+    """One long-lived ORM thread. Every thread-sensitive call of a request
+    runs on the lane it was assigned, so the request sees one connection
+    (and one transaction) throughout, and the lane's thread and connection
+    outlive the request instead of being rebuilt for each one."""
+
+    def __init__(self, index):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'service-orm-{index}')
+        self.active = 0
+
+
+class _LanePool:
+    def __init__(self, size):
+        self.lanes = [_Lane(i) for i in range(size)]
+        self.lock = threading.Lock()
+        self.order = itertools.count()
+        for lane in self.lanes:
+            SyncToAsync.context_to_thread_executor[lane] = lane.executor
+
+    def acquire(self):
+        with self.lock:
+            # Least busy lane; ties rotate so idle lanes share the load.
+            offset = next(self.order)
+            count = len(self.lanes)
+            lane = min(
+                (self.lanes[(offset + i) % count] for i in range(count)),
+                key=lambda lane: lane.active,
+            )
+            lane.active += 1
+        return lane
+
+    def release(self, lane):
+        with self.lock:
+            lane.active -= 1
+
+
+_lane_pool = None
+_lane_pool_lock = threading.Lock()
+
+
+def lane_pool():
+    """The process's ORM lanes, created on first use."""
+    global _lane_pool
+    with _lane_pool_lock:
+        if _lane_pool is None:
+            _lane_pool = _LanePool(settings.ASYNC_ORM_THREADS)
+    return _lane_pool
+
+
+async def on_each_lane(func):
+    """Run `func` once on every lane's thread, e.g. to open or close the
+    connection that thread owns."""
+    await asyncio.gather(*(asyncio.wrap_future(lane.executor.submit(func)) for lane in lane_pool().lanes))
+
+
+class DjangoRequestMiddleware:
+    """Run each FastAPI request's async ORM calls the way Django's own ASGI
+    handler would, but on a bounded set of persistent ORM threads
+    (ASYNC_ORM_THREADS) instead of a fresh thread per request, and close
+    stale connections at both ends of the request like request_started and
+    request_finished do."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        pool = lane_pool()
+        lane = pool.acquire()
+        token = SyncToAsync.thread_sensitive_context.set(lane)
+        # A lane runs its work in order, so the cleanup is queued rather than
+        # awaited: it still happens before the request's first query.
+        lane.executor.submit(close_old_connections)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.executor.submit(close_old_connections)
+            SyncToAsync.thread_sensitive_context.reset(token)
+            pool.release(lane)
+
+
+async def _wants_profile(scope):
+    """Staff ask for a profile with ?profile=1; PROFILE_SAMPLE_RATE of all
+    requests are profiled regardless. Returns (profile?, requested?)."""
+    if parse_qs(scope['query_string'].decode()).get('profile') == ['1']:
+        authorization = dict(scope['headers']).get(b'authorization', b'').decode()
+        scheme, _, token = authorization.partition(' ')
+        if scheme.lower() == 'bearer' and token:
+            try:
+                if (await get_current_user(token)).is_staff:
+                    return True, True
+            except HTTPException:
+                pass
+    return random.random() < settings.PROFILE_SAMPLE_RATE, False
+
+
+async def _request_threads():
+    # The event loop's thread, plus the ORM thread DjangoRequestMiddleware
+    # gave this request, if any.
+    threads = [threading.get_ident()]
+    context = SyncToAsync.thread_sensitive_context.get(None)
+    executor = SyncToAsync.context_to_thread_executor.get(context) if context is not None else None
+    if executor is not None:
+        threads.append(await asyncio.wrap_future(executor.submit(threading.get_ident)))
+    return threads
+
+
+class MetricsMiddleware:
+    """Record each request's latency, database queries and time, response
+    cache hits and response size under its route template, for /metrics;
+    and run the sampling profiler on the requests that ask for it. Sits
+    inside DjangoRequestMiddleware so that it can see the request's ORM
+    thread."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current.set(stats)
+        profile, requested = await _wants_profile(scope)
+        sampler = profile_id = None
+        if profile:
+            profile_id = uuid.uuid4().hex
+            sampler = Sampler(await _request_threads())
+            sampler.start()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if requested:
+                    message = {**message, 'headers': [*message.get('headers', []), (b'x-profile-id', profile_id.encode())]}
+            elif message['type'] == 'http.response.body':
+                stats.response_bytes += len(message.get('body', b''))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current.reset(token)
+            route = getattr(scope.get('route'), 'path', '<unmatched>')
+            registry.observe(scope['method'], route, status, elapsed, stats)
+            if sampler is not None:
+                stacks = sampler.stop()
+                if requested or elapsed >= settings.PROFILE_SLOW_SECONDS:
+                    path = await run_sync(write_profile, profile_id, stacks)
+                    logger.info('Profiled %s %s (%.0f ms): %s', scope['method'], scope['path'], elapsed * 1000, path)
+
+
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+def _cookies(scope):
+    header = dict(scope['headers']).get(b'cookie', b'').decode('latin-1')
+    return dict(part.strip().partition('=')[::2] for part in header.split(';') if '=' in part)
+
+
+class ReadRoutingMiddleware:
+    """Let safe requests read from the replicas, except from clients that
+    wrote something in the last READ_YOUR_WRITES_SECONDS; successful writes
+    set a short-lived cookie that keeps the client's reads on the primary
+    while replicas catch up."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        cookie = settings.READ_YOUR_WRITES_COOKIE
+        safe = scope['method'] in SAFE_METHODS
+        replica_ok = safe and cookie not in _cookies(scope)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' and not safe and message['status'] < 400:
+                value = f'{cookie}=1; Max-Age={settings.READ_YOUR_WRITES_SECONDS}; Path=/; HttpOnly; SameSite=Lax'
+                message = {**message, 'headers': [*message.get('headers', []), (b'set-cookie', value.encode())]}
+            await send(message)
+
+        with reads_from(replica_ok):
+            await self.app(scope, receive, send_wrapper)
+
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/xml', 'application/javascript')
+
+
+def _accepted_encoding(accept_encoding):
+    """The best encoding we can produce that the client accepts: br (when
+    installed) or gzip, by the client's q-values, br on a tie; or None."""
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding.lower()] = weight
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    ranked = [(weights.get(coding, weights.get('*', 0.0)), -i, coding) for i, coding in enumerate(available)]
+    weight, _, coding = max(ranked)
+    return coding if weight > 0 else None
+
+
+class _Brotli:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+
+    def compress(self, data, more=False):
+        # A streamed chunk is flushed so the client can decode it on arrival.
+        if more:
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.process(data) + self.compressor.finish()
+
+
+class _Gzip:
+    def __init__(self):
+        self.compressor = zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, more=False):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH)
+
+
+def _compressor(encoding):
+    return _Brotli() if encoding == 'br' else _Gzip()
+
+
+class CompressionMiddleware:
+    """Compress textual responses of at least COMPRESSION_MIN_SIZE bytes,
+    and every streamed one, with brotli or gzip as the client's
+    Accept-Encoding allows. Small responses are sent as they are: below
+    about a kilobyte compression saves less than it costs. ETags of
+    compressed responses are made weak, as the bytes differ from the
+    uncompressed representation's, which still revalidates them."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        encoding = _accepted_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        start = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body':
+                return await send(message)
+            body = message.get('body', b'')
+            more = message.get('more_body', False)
+            if start is not None:
+                headers = MutableHeaders(raw=list(start['headers']))
+                textual = headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES)
+                if textual and 'content-encoding' not in headers and (more or len(body) >= settings.COMPRESSION_MIN_SIZE):
+                    compressor = _compressor(encoding)
+                    body = compressor.compress(body, more)
+                    if more:
+                        # Streamed: the length is not known up front.
+                        if 'content-length' in headers:
+                            del headers['content-length']
+                    else:
+                        headers['content-length'] = str(len(body))
+                    headers['content-encoding'] = encoding
+                    headers.add_vary_header('Accept-Encoding')
+                    etag = headers.get('etag')
+                    if etag and not etag.startswith('W/'):
+                        headers['etag'] = f'W/{etag}'
+                    start = {**start, 'headers': headers.raw}
+                    message = {**message, 'body': body}
+                await send(start)
+                start = None
+                return await send(message)
+            if compressor is not None:
+                message = {**message, 'body': compressor.compress(body, more)}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
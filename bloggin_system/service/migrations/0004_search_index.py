@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:17
+
+from django.db import migrations, models
+
+SQLITE_CREATE = [
+    """CREATE VIRTUAL TABLE service_searchdocument_fts USING fts5(
+        title, body, content='service_searchdocument', content_rowid='id',
+        tokenize='porter unicode61')""",
+    """CREATE TRIGGER service_searchdocument_ai AFTER INSERT ON service_searchdocument BEGIN
+        INSERT INTO service_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER service_searchdocument_ad AFTER DELETE ON service_searchdocument BEGIN
+        INSERT INTO service_searchdocument_fts(service_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER service_searchdocument_au AFTER UPDATE ON service_searchdocument BEGIN
+        INSERT INTO service_searchdocument_fts(service_searchdocument_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO service_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS service_searchdocument_au",
+    "DROP TRIGGER IF EXISTS service_searchdocument_ad",
+    "DROP TRIGGER IF EXISTS service_searchdocument_ai",
+    "DROP TABLE IF EXISTS service_searchdocument_fts",
+]
+
+POSTGRES_CREATE = [
+    """ALTER TABLE service_searchdocument ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(body, '')), 'B')
+        ) STORED""",
+    "CREATE INDEX service_searchdocument_vector_idx ON service_searchdocument USING GIN (search_vector)",
+]
+
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS service_searchdocument_vector_idx",
+    "ALTER TABLE service_searchdocument DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(schema_editor, statements):
+    statements = statements.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_fulltext_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE})
+
+
+def drop_fulltext_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP})
+
+
+def index_existing_rows(apps, schema_editor):
+    SearchDocument = apps.get_model('service', 'SearchDocument')
+    sources = [
+        ('article', apps.get_model('service', 'Article'), lambda a: (a.title, f'{a.content}\n{a.tags}')),
+        ('faq', apps.get_model('service', 'FAQ'), lambda f: (f.question, f.answer)),
+        ('comment', apps.get_model('service', 'Comment'), lambda c: ('', c.content)),
+    ]
+    for kind, model, text in sources:
+        batch = []
+        for obj in model.objects.iterator(chunk_size=1000):
+            title, body = text(obj)
+            batch.append(SearchDocument(kind=kind, object_id=obj.pk, title=title[:255], body=body))
+            if len(batch) == 1000:
+                SearchDocument.objects.bulk_create(batch)
+                batch = []
+        SearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('article', 'Article'), ('faq', 'FAQ'), ('comment', 'Comment')], max_length=16)),
+                ('object_id', models.BigIntegerField()),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('body', models.TextField(blank=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='searchdocument_object_unique')],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(index_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_tags(raw):
+    """Comma (or semicolon) separated if there are any, else whitespace."""
+    parts = re.split(r'[,;]', raw) if re.search(r'[,;]', raw) else raw.split()
+    names = []
+    for part in parts:
+        name = part.strip().lstrip('#').strip().lower()[:50]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def tags_to_rows(apps, schema_editor):
+    Article = apps.get_model('service', 'Article')
+    Tag = apps.get_model('service', 'Tag')
+    ArticleTag = apps.get_model('service', 'ArticleTag')
+    tag_ids = {}
+    links = []
+    for article_id, raw in Article.objects.exclude(tags_text='').values_list('id', 'tags_text').iterator():
+        for name in split_tags(raw):
+            if name not in tag_ids:
+                tag_ids[name] = Tag.objects.create(name=name).id
+            links.append(ArticleTag(article_id=article_id, tag_id=tag_ids[name]))
+    ArticleTag.objects.bulk_create(links, batch_size=1000)
+    for tag_id in tag_ids.values():
+        Tag.objects.filter(id=tag_id).update(article_count=ArticleTag.objects.filter(tag_id=tag_id).count())
+
+
+def rows_to_tags(apps, schema_editor):
+    Article = apps.get_model('service', 'Article')
+    ArticleTag = apps.get_model('service', 'ArticleTag')
+    names = {}
+    for article_id, name in ArticleTag.objects.values_list('article_id', 'tag__name').order_by('id'):
+        names.setdefault(article_id, []).append(name)
+    for article_id, tags in names.items():
+        Article.objects.filter(id=article_id).update(tags_text=', '.join(tags)[:255])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('article_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-article_count', 'name'], name='tag_count_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArticleTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='service.article')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='service.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'article'], name='articletag_tag_idx')],
+                'constraints': [models.UniqueConstraint(fields=('article', 'tag'), name='articletag_unique')],
+            },
+        ),
+        migrations.RenameField(
+            model_name='article',
+            old_name='tags',
+            new_name='tags_text',
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='articles', through='service.ArticleTag', to='service.tag'),
+        ),
+        migrations.RunPython(tags_to_rows, rows_to_tags),
+        migrations.RemoveField(
+            model_name='article',
+            name='tags_text',
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:31
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Article = apps.get_model('service', 'Article')
+    Comment = apps.get_model('service', 'Comment')
+    comments = Comment.objects.filter(article=OuterRef('pk'))
+    Article.objects.update(
+        comment_count=Coalesce(Subquery(
+            comments.order_by().values('article').annotate(total=Count('id')).values('total'),
+            output_field=IntegerField(),
+        ), 0),
+        last_commented_at=Subquery(comments.order_by('-created_at').values('created_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0005_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='last_commented_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['-comment_count', '-id'], name='article_discussed_idx'),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0008_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['author', '-id'], name='article_author_idx'),
+        ),
+        # Category feeds page the auto-created categories table by category,
+        # newest article first; its own unique index leads with the article.
+        migrations.RunSQL(
+            'CREATE INDEX article_categories_category_idx ON service_article_categories (category_id, article_id)',
+            'DROP INDEX article_categories_category_idx',
+        ),
+    ]
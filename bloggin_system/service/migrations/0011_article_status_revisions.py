@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:07
+
+import hashlib
+import zlib
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def record_first_revisions(apps, schema_editor):
+    # Existing articles start their history with a keyframe of their
+    # current content; see service.revisions.
+    Article = apps.get_model('service', 'Article')
+    ArticleRevision = apps.get_model('service', 'ArticleRevision')
+    batch = []
+    for pk, title, content in Article.objects.order_by('pk').values_list('pk', 'title', 'content').iterator(chunk_size=500):
+        batch.append(ArticleRevision(
+            article_id=pk, number=1, keyframe=1, title=title, data=zlib.compress(content.encode(), 9),
+            digest=hashlib.blake2b(content.encode(), digest_size=16).hexdigest(), size=len(content),
+        ))
+        if len(batch) == 500:
+            ArticleRevision.objects.bulk_create(batch)
+            batch = []
+    ArticleRevision.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0010_comment_threads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('keyframe', models.PositiveIntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('data', models.BinaryField()),
+                ('digest', models.CharField(max_length=32)),
+                ('size', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='status',
+            field=models.CharField(choices=[('draft', 'Draft'), ('scheduled', 'Scheduled'), ('published', 'Published')], default='published', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='article',
+            name='published_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('status', 'scheduled')), fields=['publish_at'], name='article_scheduled_idx'),
+        ),
+        migrations.AddField(
+            model_name='articlerevision',
+            name='article',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='service.article'),
+        ),
+        migrations.AddConstraint(
+            model_name='articlerevision',
+            constraint=models.UniqueConstraint(fields=('article', 'number'), name='articlerevision_number_unique'),
+        ),
+        migrations.RunPython(record_first_revisions, migrations.RunPython.noop),
+    ]
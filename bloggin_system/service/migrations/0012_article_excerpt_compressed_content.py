@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:12
+
+import service.fields
+from django.db import migrations, models
+
+EXCERPT_LENGTH = 280
+
+
+def make_excerpt(content):
+    # As service.models.make_excerpt when this migration was written.
+    head = content[:EXCERPT_LENGTH * 4]
+    text = ' '.join(head.split())
+    if len(text) <= EXCERPT_LENGTH and len(head) == len(content):
+        return text
+    cut = text[:EXCERPT_LENGTH + 1]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut[:EXCERPT_LENGTH].rstrip() + '…'
+
+
+def content_to_binary(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        # A plain ::bytea cast would read backslashes in the text as escapes.
+        schema_editor.execute(
+            "ALTER TABLE service_article ALTER COLUMN content TYPE bytea USING convert_to(content, 'UTF8')"
+        )
+        return
+    Article = apps.get_model('service', 'Article')
+    new_field = service.fields.CompressedTextField()
+    new_field.set_attributes_from_name('content')
+    schema_editor.alter_field(Article, Article._meta.get_field('content'), new_field)
+
+
+def fill_excerpts(apps, schema_editor):
+    # Writing the content back also compresses the bodies long enough.
+    Article = apps.get_model('service', 'Article')
+    batch = []
+    for article in Article.objects.only('id', 'content').order_by('pk').iterator(chunk_size=500):
+        article.excerpt = make_excerpt(article.content)
+        batch.append(article)
+        if len(batch) == 500:
+            Article.objects.bulk_update(batch, ['excerpt', 'content'])
+            batch = []
+    Article.objects.bulk_update(batch, ['excerpt', 'content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0011_article_status_revisions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(content_to_binary)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='article',
+                    name='content',
+                    field=service.fields.CompressedTextField(),
+                ),
+            ],
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0015_feed_publication_order'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('recipient__isnull', True)), fields=('article',), name='notification_broadcast_unique'),
+        ),
+    ]
@@ -1,5 +1,10 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import Q
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+
+from .fields import CompressedTextField
 
 class CustomUser(AbstractUser):
     groups = models.ManyToManyField(
@@ -16,37 +21,334 @@ class CustomUser(AbstractUser):
         help_text='Specific permissions for this user.',
         verbose_name='user permissions'
     )
+    # Kept up by follow and unfollow; decides how new articles reach
+    # followers (see service.notifications).
+    follower_count = models.PositiveIntegerField(default=0)
+    # Notifications up to this id have been read.
+    notifications_read_id = models.BigIntegerField(default=0)
+
+class AtomicSaveModel(models.Model):
+    """Saves run in a transaction together with their post_save receivers,
+    so the outbox events those receivers record commit or roll back with
+    the row itself. (Deletes and their signals are always atomic.)"""
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            super().save(*args, **kwargs)
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
 
     def __str__(self):
         return self.name
-class Article(models.Model):
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    # Maintained from ArticleTag signals so tag clouds never aggregate.
+    article_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-article_count', 'name'], name='tag_count_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+# Listings show an excerpt of each article instead of its content.
+EXCERPT_LENGTH = 280
+
+def make_excerpt(content):
+    """The start of `content` with its whitespace collapsed, cut at a word
+    boundary to at most EXCERPT_LENGTH characters and an ellipsis."""
+    head = content[:EXCERPT_LENGTH * 4]
+    text = ' '.join(head.split())
+    if len(text) <= EXCERPT_LENGTH and len(head) == len(content):
+        return text
+    cut = text[:EXCERPT_LENGTH + 1]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut[:EXCERPT_LENGTH].rstrip() + '…'
+
+class ArticleQuerySet(models.QuerySet):
+    def published(self):
+        """The articles anyone may read; drafts and scheduled articles are
+        only shown to their author."""
+        return self.filter(status=Article.PUBLISHED)
+
+class Article(AtomicSaveModel):
+    DRAFT = 'draft'
+    SCHEDULED = 'scheduled'
+    PUBLISHED = 'published'
+    STATUS_CHOICES = [(DRAFT, 'Draft'), (SCHEDULED, 'Scheduled'), (PUBLISHED, 'Published')]
+
     title = models.CharField(max_length=255)
-    content = models.TextField()
+    # Long bodies are stored compressed (COMPRESSED_TEXT_MIN_BYTES).
+    content = CompressedTextField()
+    excerpt = models.CharField(max_length=300, blank=True, editable=False)
     author = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
-    published_date = models.DateTimeField(auto_now_add=True)
-    tags = models.CharField(max_length=255, blank=True)
+    # A published article stays published; drafts and scheduled articles
+    # get their published_date when they go out (see service.publishing).
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PUBLISHED)
+    publish_at = models.DateTimeField(null=True, blank=True)
+    published_date = models.DateTimeField(default=timezone.now, editable=False)
+    tags = models.ManyToManyField(Tag, through='ArticleTag', related_name='articles', blank=True)
     categories = models.ManyToManyField(Category, blank=True)
+    # Maintained from Comment signals (and repaired by a periodic task) so
+    # listings never count comments.
+    comment_count = models.PositiveIntegerField(default=0)
+    last_commented_at = models.DateTimeField(null=True, blank=True)
+    # Buffered in process and Redis, added here in batches by a Celery task.
+    view_count = models.PositiveBigIntegerField(default=0)
+
+    objects = ArticleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-published_date', '-id'], name='article_published_idx'),
+            models.Index(fields=['-comment_count', '-id'], name='article_discussed_idx'),
+            # Author feeds.
+            models.Index(fields=['author', '-published_date', '-id'], name='article_author_idx'),
+            # Only the few articles waiting to go out, in the order they do.
+            models.Index(fields=['publish_at'], name='article_scheduled_idx', condition=Q(status='scheduled')),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.excerpt = make_excerpt(self.content)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
-class Comment(models.Model):
+class ArticleTag(models.Model):
+    article = models.ForeignKey(Article, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['article', 'tag'], name='articletag_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'article'], name='articletag_tag_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag_id} on {self.article_id}'
+
+class ArticleRevision(models.Model):
+    """One saved version of an article. Most store their content as a
+    compressed delta against the revision before; every few, and whenever
+    the delta would not be smaller, a keyframe stores it whole, so that
+    rebuilding any revision reads a bounded run of rows (see
+    service.revisions)."""
+    article = models.ForeignKey(Article, related_name='revisions', on_delete=models.CASCADE)
+    number = models.PositiveIntegerField()
+    # The number of the keyframe this revision is rebuilt from (its own
+    # for a keyframe).
+    keyframe = models.PositiveIntegerField()
+    title = models.CharField(max_length=255)
+    data = models.BinaryField()
+    # Of the full content, to tell whether the article still matches the
+    # latest revision when the next one is recorded.
+    digest = models.CharField(max_length=32)
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['article', 'number'], name='articlerevision_number_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.article_id} revision {self.number}'
+
+# Comment paths are fixed-width ids, so they sort in thread order: each
+# comment right after its parent, replies in the order they were posted.
+# 255 characters hold 25 levels.
+COMMENT_PATH_WIDTH = 10
+
+def comment_path(parent_path, pk):
+    return f'{parent_path}{pk:0{COMMENT_PATH_WIDTH}d}'
+
+class Comment(AtomicSaveModel):
     article = models.ForeignKey(Article, related_name='comments', on_delete=models.CASCADE)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Replies form a tree. `path` is the ids from the top-level comment down
+    # to this one, so a thread or any subtree is one range of the
+    # (article, path) index.
+    parent = models.ForeignKey('self', related_name='children', null=True, blank=True, on_delete=models.CASCADE)
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Maintained from Comment signals, like Article.comment_count.
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['article', 'created_at', 'id'], name='comment_article_created_idx'),
+            models.Index(fields=['article', 'path'], name='comment_path_idx'),
+            models.Index(fields=['article', 'parent', 'path'], name='comment_children_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            if self._state.adding and self.parent_id is not None:
+                self.depth = self.parent.depth + 1
+            super().save(*args, **kwargs)
+            if not self.path:
+                # The path ends with the comment's own id, known only now.
+                self.path = comment_path(self.parent.path if self.parent_id else '', self.pk)
+                Comment.objects.filter(pk=self.pk).update(path=self.path)
 
     def __str__(self):
         return f'Comment by {self.user.username} on {self.article.title}'
         
-class FAQ(models.Model):
+class FAQ(AtomicSaveModel):
     question = models.CharField(max_length=255)
     answer = models.TextField()
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='faq_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.question
+class SearchDocument(models.Model):
+    """Denormalized text of an Article, FAQ or Comment. The full-text index
+    over it is backend specific (FTS5 on SQLite, tsvector/GIN on PostgreSQL)
+    and is created in migration 0004 rather than declared here."""
+    ARTICLE = 'article'
+    FAQ = 'faq'
+    COMMENT = 'comment'
+    KIND_CHOICES = [(ARTICLE, 'Article'), (FAQ, 'FAQ'), (COMMENT, 'Comment')]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    title = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='searchdocument_object_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+class OutboxEvent(models.Model):
+    """Side-effect work recorded in the transaction of the change that
+    causes it and carried out afterwards by the drain_outbox task."""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (PROCESSING, 'Processing'), (DONE, 'Done'), (DEAD, 'Dead letter')]
+
+    topic = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    # A pending event absorbs later ones with the same key.
+    idempotency_key = models.CharField(max_length=200)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['idempotency_key'], condition=Q(status='pending'), name='outbox_pending_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'available_at', 'id'], name='outbox_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.topic} {self.idempotency_key} ({self.status})'
+
+class MediaFile(models.Model):
+    """An uploaded image, stored once however often it is uploaded: files
+    are named by the SHA-256 of their content (see service.media), so the
+    same bytes always land on the same row and path."""
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (READY, 'Ready'), (FAILED, 'Failed')]
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    # Relative to MEDIA_ROOT and MEDIA_URL.
+    path = models.CharField(max_length=100)
+    content_type = models.CharField(max_length=32)
+    size = models.PositiveBigIntegerField()
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    # Resized WebP copies, {name: {path, width, height, size, content_type}},
+    # written by the media.process outbox handler.
+    variants = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    uploaded_by = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL, related_name='uploads')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def url(self):
+        return settings.MEDIA_URL + self.path
+
+    def __str__(self):
+        return self.path
+
+class Follow(models.Model):
+    follower = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='following')
+    author = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='followers')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'author'], name='follow_unique'),
+        ]
+        indexes = [
+            # Fan-out walks an author's followers in id order.
+            models.Index(fields=['author', 'id'], name='follow_author_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.follower_id} follows {self.author_id}'
+
+class Notification(models.Model):
+    """An entry in a user's inbox. A notification without a recipient is a
+    broadcast: an article by an author with too many followers to give
+    each a copy, which their inboxes read instead (service.notifications)."""
+    ARTICLE = 'article'
+    COMMENT = 'comment'
+    REPLY = 'reply'
+    KIND_CHOICES = [(ARTICLE, 'New article'), (COMMENT, 'Comment on your article'), (REPLY, 'Reply to your comment')]
+
+    recipient = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    actor = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='+')
+    comment = models.ForeignKey(Comment, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # Deliveries that run twice insert nothing the second time.
+            models.UniqueConstraint(fields=['recipient', 'article'], condition=Q(kind='article'), name='notification_article_unique'),
+            models.UniqueConstraint(fields=['recipient', 'comment'], condition=Q(comment__isnull=False), name='notification_comment_unique'),
+            # The two above never match a NULL recipient; one broadcast per article.
+            models.UniqueConstraint(fields=['article'], condition=Q(recipient__isnull=True), name='notification_broadcast_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['recipient', '-id'], name='notification_inbox_idx'),
+            models.Index(fields=['-id'], name='notification_broadcast_idx', condition=Q(recipient__isnull=True)),
+        ]
+
     def __str__(self):
-        return self.question
\ No newline at end of file
+        return f'{self.kind} for {self.recipient_id or "followers"}'
@@ -0,0 +1,233 @@
+"""Follows and the notification inbox.
+
+Nothing is delivered on the request path: publishing an article or
+posting a comment records an outbox event, and the drain_outbox task does
+the rest on the Celery workers. A comment notifies the author of the
+comment it replies to, or of the article. An article reaches its author's
+followers one of two ways:
+
+- fan-out on write: with at most NOTIFY_FANOUT_MAX_FOLLOWERS followers,
+  a copy goes into each follower's inbox, NOTIFY_BATCH_SIZE followers to
+  a bulk insert and a transaction, each batch queueing the next;
+- fan-out on read: past that it is stored once, as a broadcast with no
+  recipient, and each follower's inbox reads the broadcasts of the
+  authors they follow. Broadcasts come only from the few authors that
+  large, so that read stays small.
+
+An inbox is paged by notification id, newest first, merging its own rows
+and those broadcasts. Everything above the user's notifications_read_id
+is unread. The count of their own unread rows is cached in Redis, bumped
+as deliveries commit and dropped when they mark the inbox read; the
+broadcasts are counted as the inbox is read."""
+from collections import Counter
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, Max, OuterRef
+
+from .models import Article, Comment, CustomUser, Follow, Notification
+from .outbox import enqueue, enqueue_many, handler
+from .pagination import build_page, page_queryset
+from .queries import ashape_rows, values_queryset
+from .redis_client import get_redis
+from .schemas import NotificationSerializer
+
+# Bump a cached unread count in place, after bumping its version so a fill
+# that counted before this delivery does not store what it counted.
+# ARGV: the increment; ttl.
+BUMP_UNREAD = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+"""
+
+# Store a count read from the database, unless it was cached or changed
+# meanwhile. ARGV: the version seen before counting; ttl; count.
+FILL_UNREAD = """
+if redis.call('EXISTS', KEYS[1]) == 1 or (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[2])
+return 1
+"""
+
+
+def unread_key(user_id):
+    return f'notify:unread:{user_id}'
+
+
+def _version_key(user_id):
+    return f'notify:unread:{user_id}:version'
+
+
+def follow(follower_id, author_id):
+    """Follow `author_id`; returns False if already following."""
+    try:
+        with transaction.atomic():
+            Follow.objects.create(follower_id=follower_id, author_id=author_id)
+            CustomUser.objects.filter(pk=author_id).update(follower_count=F('follower_count') + 1)
+    except IntegrityError:
+        return False
+    return True
+
+
+def unfollow(follower_id, author_id):
+    """Stop following `author_id`; returns False if not following."""
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(follower_id=follower_id, author_id=author_id).delete()
+        if deleted:
+            CustomUser.objects.filter(pk=author_id).update(follower_count=F('follower_count') - 1)
+    return bool(deleted)
+
+
+def notify_published(article_ids):
+    """Queue the notifications for newly published articles. Call it in
+    the transaction that publishes them."""
+    enqueue_many('notify.article', {
+        f'notify:article:{pk}:0': {'article_id': pk, 'after': 0} for pk in article_ids
+    })
+
+
+def notify_commented(comment_ids):
+    """Queue the notifications for new comments, likewise."""
+    if comment_ids:
+        enqueue('notify.comments', {'ids': list(comment_ids)})
+
+
+def _bump(counts):
+    redis = get_redis()
+    pipe = redis.pipeline(transaction=False)
+    for user_id, count in counts.items():
+        pipe.eval(BUMP_UNREAD, 2, unread_key(user_id), _version_key(user_id), count, settings.NOTIFY_UNREAD_TTL)
+    pipe.execute()
+
+
+def _forget(user_id):
+    redis = get_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.incr(_version_key(user_id))
+    pipe.expire(_version_key(user_id), settings.NOTIFY_UNREAD_TTL)
+    pipe.delete(unread_key(user_id))
+    pipe.execute()
+
+
+def deliver(notifications):
+    """Insert `notifications` and, once that commits, count them into the
+    cached unread counts. Already delivered ones are skipped (though a
+    delivery that runs twice may count them twice until read)."""
+    Notification.objects.bulk_create(notifications, batch_size=settings.NOTIFY_BATCH_SIZE, ignore_conflicts=True)
+    if notifications and get_redis() is not None:
+        counts = Counter(notification.recipient_id for notification in notifications)
+        transaction.on_commit(lambda: _bump(counts), robust=True)
+
+
+@handler('notify.article')
+def fan_out_article(payload):
+    article = Article.objects.published().filter(pk=payload['article_id']).values(
+        'id', 'author_id', 'author__follower_count', 'published_date',
+    ).first()
+    if article is None:
+        return
+    author_id = article['author_id']
+    note = partial(
+        Notification, kind=Notification.ARTICLE, actor_id=author_id, article_id=article['id'],
+        created_at=article['published_date'],
+    )
+    after = payload['after']
+    if not after and article['author__follower_count'] > settings.NOTIFY_FANOUT_MAX_FOLLOWERS:
+        # Concurrent runs meet on notification_broadcast_unique.
+        Notification.objects.get_or_create(
+            recipient=None, article_id=article['id'],
+            defaults={'kind': Notification.ARTICLE, 'actor_id': author_id, 'created_at': article['published_date']},
+        )
+        return
+    followers = list(
+        Follow.objects.filter(author_id=author_id, id__gt=after).order_by('id')
+        .values_list('id', 'follower_id')[:settings.NOTIFY_BATCH_SIZE]
+    )
+    deliver([note(recipient_id=follower_id) for _, follower_id in followers])
+    if len(followers) == settings.NOTIFY_BATCH_SIZE:
+        last = followers[-1][0]
+        enqueue('notify.article', {'article_id': article['id'], 'after': last}, key=f'notify:article:{article["id"]}:{last}')
+
+
+@handler('notify.comments')
+def notify_comment_authors(payload):
+    notifications = []
+    for comment in Comment.objects.filter(pk__in=payload['ids']).values(
+        'id', 'user_id', 'article_id', 'article__author_id', 'parent__user_id', 'created_at',
+    ):
+        if comment['parent__user_id'] is not None:
+            recipient_id, kind = comment['parent__user_id'], Notification.REPLY
+        else:
+            recipient_id, kind = comment['article__author_id'], Notification.COMMENT
+        if recipient_id != comment['user_id']:
+            notifications.append(Notification(
+                recipient_id=recipient_id, kind=kind, actor_id=comment['user_id'], article_id=comment['article_id'],
+                comment_id=comment['id'], created_at=comment['created_at'],
+            ))
+    deliver(notifications)
+
+
+def _own(user_id):
+    return Notification.objects.filter(recipient_id=user_id)
+
+
+def _broadcasts(user_id):
+    # Only those sent since the user followed their author.
+    followed = Follow.objects.filter(
+        follower_id=user_id, author_id=OuterRef('actor_id'), created_at__lte=OuterRef('created_at'),
+    )
+    return Notification.objects.filter(Exists(followed), recipient=None)
+
+
+async def _read_id(user_id):
+    # Read afresh: the authenticated user may be a cached copy.
+    return await CustomUser.objects.filter(pk=user_id).values_list('notifications_read_id', flat=True).aget()
+
+
+async def inbox_page(user_id, cursor=None, limit=None):
+    """A page of a user's inbox as {"items": [...], "next_cursor": ...}:
+    one keyset query each for their own notifications and the broadcasts
+    they see, merged by id."""
+    ordering = ('-id',)
+    rows = []
+    for queryset in (_own(user_id), _broadcasts(user_id)):
+        page = page_queryset(values_queryset(queryset, NotificationSerializer, ['id']), ordering, cursor, limit)
+        rows += [row async for row in page]
+    rows.sort(key=lambda row: row['id'], reverse=True)
+    rows, next_cursor = build_page(rows, ordering, limit)
+    items = await ashape_rows(Notification, rows, NotificationSerializer)
+    read_id = await _read_id(user_id)
+    for item in items:
+        item['unread'] = item['id'] > read_id
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def unread_count(user_id):
+    """How many notifications `user_id` has not read: their own, from the
+    Redis count (filled from the database on a miss), plus broadcasts."""
+    redis = get_redis()
+    if redis is not None:
+        # Before counting, as FILL_UNREAD compares it.
+        version = redis.get(_version_key(user_id)) or b''
+    read_id = CustomUser.objects.filter(pk=user_id).values_list('notifications_read_id', flat=True).get()
+    count = _broadcasts(user_id).filter(id__gt=read_id).count()
+    own = redis.get(unread_key(user_id)) if redis is not None else None
+    if own is None:
+        own = _own(user_id).filter(id__gt=read_id).count()
+        if redis is not None:
+            redis.eval(FILL_UNREAD, 2, unread_key(user_id), _version_key(user_id), version, settings.NOTIFY_UNREAD_TTL, own)
+    return count + int(own)
+
+
+def mark_read(user_id):
+    """Mark everything delivered so far read."""
+    with transaction.atomic():
+        latest = Notification.objects.aggregate(latest=Max('id'))['latest'] or 0
+        CustomUser.objects.filter(pk=user_id, notifications_read_id__lt=latest).update(notifications_read_id=latest)
+        if get_redis() is not None:
+            transaction.on_commit(lambda: _forget(user_id), robust=True)
@@ -0,0 +1,131 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(topic):
+    """Register the function that carries out `topic` events. Handlers get
+    the event payload and must be idempotent: an event may run more than
+    once if a worker dies before recording that it finished."""
+    def register(func):
+        HANDLERS[topic] = func
+        return func
+    return register
+
+
+def enqueue(topic, payload, key=None):
+    """Record `topic` work for after the current transaction commits. Call it
+    inside the transaction making the change, so that both commit or neither
+    does. While an event with the same `key` is still pending this one is
+    absorbed into it, which coalesces bursts of writes to one object."""
+    enqueue_many(topic, {key or uuid.uuid4().hex: payload})
+
+
+def enqueue_many(topic, payloads):
+    """enqueue() for {key: payload}, in one INSERT."""
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(topic=topic, payload=payload, idempotency_key=key) for key, payload in payloads.items()],
+        ignore_conflicts=True,
+    )
+
+
+def claim(batch_size):
+    """Take up to `batch_size` due events, oldest first, including any left
+    in processing by a worker that died more than OUTBOX_CLAIM_TIMEOUT ago.
+    Concurrent workers skip each other's rows where the database can."""
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=OutboxEvent.PENDING, available_at__lte=now)
+                | Q(status=OutboxEvent.PROCESSING, claimed_at__lt=stale)
+            )
+            .order_by('id')[:batch_size]
+        )
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            status=OutboxEvent.PROCESSING, claimed_at=now,
+        )
+    return events
+
+
+def _fail(event, exc):
+    event.attempts += 1
+    event.last_error = f'{type(exc).__name__}: {exc}'
+    if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        event.status = OutboxEvent.DEAD
+        logger.error('Outbox event %s (%s) dead-lettered after %s attempts', event.pk, event.topic, event.attempts)
+    else:
+        event.status = OutboxEvent.PENDING
+        event.available_at = timezone.now() + timedelta(
+            seconds=settings.OUTBOX_RETRY_BASE_SECONDS * 2 ** (event.attempts - 1),
+        )
+    try:
+        with transaction.atomic():
+            event.save(update_fields=['attempts', 'last_error', 'status', 'available_at'])
+    except IntegrityError:
+        # A newer pending event with the same key will redo this work.
+        event.status = OutboxEvent.DONE
+        event.processed_at = timezone.now()
+        event.save(update_fields=['attempts', 'last_error', 'status', 'processed_at'])
+
+
+def process_batch(batch_size=None):
+    """Claim and run one batch of events; returns how many were claimed."""
+    events = claim(batch_size or settings.OUTBOX_BATCH_SIZE)
+    done = []
+    for event in events:
+        try:
+            with transaction.atomic():
+                HANDLERS[event.topic](event.payload)
+        except Exception as exc:
+            logger.exception('Outbox event %s (%s) failed', event.pk, event.topic)
+            _fail(event, exc)
+        else:
+            done.append(event.pk)
+    OutboxEvent.objects.filter(pk__in=done).update(status=OutboxEvent.DONE, processed_at=timezone.now())
+    return len(events)
+
+
+def drain(max_batches=None):
+    """Process batches until nothing is due (or `max_batches` ran), then
+    drop finished events older than OUTBOX_RETENTION. Returns the number of
+    events processed."""
+    processed = 0
+    for _ in range(max_batches or settings.OUTBOX_MAX_BATCHES):
+        claimed = process_batch()
+        processed += claimed
+        if not claimed:
+            break
+    OutboxEvent.objects.filter(
+        status=OutboxEvent.DONE, processed_at__lt=timezone.now() - timedelta(seconds=settings.OUTBOX_RETENTION),
+    ).delete()
+    return processed
+
+
+def retry(events):
+    """Send dead-lettered events back to the queue with a fresh budget;
+    returns how many were requeued."""
+    requeued = 0
+    for event in events.filter(status=OutboxEvent.DEAD):
+        try:
+            with transaction.atomic():
+                OutboxEvent.objects.filter(pk=event.pk).update(
+                    status=OutboxEvent.PENDING, attempts=0, available_at=timezone.now(), last_error='',
+                )
+            requeued += 1
+        except IntegrityError:
+            pass  # a pending event with the same key already covers it
+    return requeued
@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def clamp_limit(limit):
+    if not limit:
+        return settings.API_PAGE_SIZE
+    return max(1, min(int(limit), settings.API_MAX_PAGE_SIZE))
+
+
+def encode_cursor(values):
+    payload = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_values(cursor, count):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != count:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def decode_cursor(cursor, model, ordering):
+    values = decode_values(cursor, len(ordering))
+    try:
+        return [_field(model, name).to_python(value) for name, value in zip(ordering, values)]
+    except ValidationError:
+        raise InvalidCursor(cursor)
+
+
+def _field(model, name):
+    return model._meta.get_field(name.lstrip('-'))
+
+
+def _keyset_filter(ordering, values):
+    """Everything strictly after `values` in `ordering`, expanded as
+    (a > x) OR (a = x AND b > y) OR ... so the composite index can serve it."""
+    condition = Q()
+    equal = {}
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        lookup = '__lt' if name.startswith('-') else '__gt'
+        condition |= Q(**equal, **{field + lookup: value})
+        equal[field] = value
+    return condition
+
+
+def page_queryset(queryset, ordering, cursor=None, limit=None):
+    """Order `queryset` by `ordering` (Django order_by syntax), skip past
+    `cursor` and fetch one extra row so `build_page` can tell whether
+    another page follows. No OFFSET is ever issued."""
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(cursor, queryset.model, ordering)
+        queryset = queryset.filter(_keyset_filter(ordering, values))
+    return queryset[:clamp_limit(limit) + 1]
+
+
+def build_page(rows, ordering, limit=None):
+    limit = clamp_limit(limit)
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if isinstance(last, dict):
+        # .values() rows, keyed by field name.
+        values = [last[name.lstrip('-')] for name in ordering]
+    else:
+        values = [getattr(last, _field(type(last), name).attname) for name in ordering]
+    return rows, encode_cursor(values)
+
+
+def paginate(queryset, ordering, cursor=None, limit=None):
+    return build_page(page_queryset(queryset, ordering, cursor, limit), ordering, limit)
+
+
+async def apaginate(queryset, ordering, cursor=None, limit=None):
+    rows = [row async for row in page_queryset(queryset, ordering, cursor, limit)]
+    return build_page(rows, ordering, limit)
@@ -0,0 +1,111 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+
+from .executor import run_sync
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+# Submitted to the pool and not yet done, so shutdown can cancel them.
+_futures = set()
+
+
+class HasherBusy(Exception):
+    """More passwords are waiting to be hashed than PASSWORD_HASH_MAX_PENDING."""
+
+
+def _init_worker():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bloggin_system.settings')
+    django.setup()
+
+
+def get_pool():
+    """The process pool password hashing runs in, sized by
+    PASSWORD_HASH_PROCESSES, so that a burst of logins burns those CPUs
+    rather than the threads and the GIL the rest of the API runs on. Zero
+    disables it and hashing goes through run_sync like other sync code."""
+    global _pool
+    if not settings.PASSWORD_HASH_PROCESSES:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # Forking a process that already runs threads is unsafe.
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.PASSWORD_HASH_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            # What shutdown(cancel_futures=True) does, which is Python 3.9+.
+            for future in list(_futures):
+                future.cancel()
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def pending():
+    return _pending
+
+
+def _verify(password, encoded):
+    # Returns whether the password matches, and the password re-hashed with
+    # the current hasher and iteration count when the stored one is outdated.
+    updated = []
+    valid = check_password(password, encoded, setter=lambda raw: updated.append(make_password(raw)))
+    return valid, updated[0] if updated else None
+
+
+async def _run(func, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= settings.PASSWORD_HASH_MAX_PENDING:
+            raise HasherBusy
+        _pending += 1
+    try:
+        pool = get_pool()
+        if pool is None:
+            return await run_sync(func, *args)
+        future = pool.submit(func, *args)
+        _futures.add(future)
+        future.add_done_callback(_futures.discard)
+        return await asyncio.wrap_future(future)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+
+async def hash_password(password):
+    return await _run(make_password, password)
+
+
+async def authenticate(username, password):
+    """The model backend's authenticate(), with the database lookup on the
+    async ORM and the hashing in the pool. Returns the user or None."""
+    User = get_user_model()
+    user = await User._default_manager.filter(**{User.USERNAME_FIELD: username}).afirst()
+    if user is None:
+        # Take as long as a wrong password would, so usernames can't be probed.
+        await hash_password(password)
+        return None
+    valid, updated = await _run(_verify, password, user.password)
+    if not valid or not user.is_active:
+        return None
+    if updated:
+        user.password = updated
+        await user.asave(update_fields=['password'])
+    return user
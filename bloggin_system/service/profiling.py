@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+
+
+def _frame_name(code):
+    path = Path(code.co_filename)
+    return f'{code.co_name} ({path.parent.name}/{path.name}:{code.co_firstlineno})'
+
+
+def collapse(frame):
+    """A stack as one line of the collapsed format: outermost frame first,
+    frames separated by semicolons."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(threading.Thread):
+    """Samples the stacks of the given threads every PROFILE_INTERVAL
+    seconds until stopped. Cheap enough to leave on for one request, but it
+    sees whatever those threads run, including other requests sharing them."""
+
+    def __init__(self, thread_ids):
+        super().__init__(name='service-profiler', daemon=True)
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(settings.PROFILE_INTERVAL):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+def write_profile(profile_id, stacks):
+    """Save stacks as `<profile_id>.folded` in PROFILE_DIR, ready for
+    flamegraph.pl or speedscope."""
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(settings.PROFILE_DIR, f'{profile_id}.folded')
+    with open(path, 'w', encoding='utf-8') as output:
+        for stack, count in stacks.most_common():
+            output.write(f'{stack} {count}\n')
+    return path
+
+
+def read_profile(profile_id):
+    path = os.path.join(settings.PROFILE_DIR, f'{profile_id}.folded')
+    with open(path, encoding='utf-8') as profile:
+        return profile.read()
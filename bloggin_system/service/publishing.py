@@ -0,0 +1,55 @@
+"""Publishing drafts and scheduled articles.
+
+Articles created as drafts or scheduled stay out of every public listing,
+feed, search and the syndication documents. Publishing one (from the API,
+or by the periodic task once its publish_at has passed) goes through
+publish(), which flips the rows in one UPDATE and then does in aggregate
+what the Article signals do for an article created published."""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate
+from .feeds import AUTHOR, category_links, update_feeds
+from .models import Article, SearchDocument
+from .notifications import notify_published
+from .search import schedule_sync_ids
+from .syndication import schedule_render
+
+
+def publish(ids):
+    """Publish the drafts and scheduled articles among `ids` as of now.
+    Call it inside a transaction; returns the ids that were published."""
+    rows = list(Article.objects.filter(pk__in=ids).exclude(status=Article.PUBLISHED).values_list('pk', 'author_id'))
+    published = [pk for pk, _ in rows]
+    if not published:
+        return []
+    Article.objects.filter(pk__in=published).update(
+        status=Article.PUBLISHED, published_date=timezone.now(), publish_at=None,
+    )
+    changes = category_links(published)
+    for pk, author_id in rows:
+        changes.setdefault((AUTHOR, author_id), []).append(pk)
+    update_feeds('add', changes)
+    schedule_sync_ids(SearchDocument.ARTICLE, published)
+    schedule_render(published, listed=True)
+    notify_published(published)
+    invalidate('articles', *(f'article:{pk}' for pk in published))
+    return published
+
+
+def publish_due():
+    """Publish the scheduled articles whose publish_at has passed, oldest
+    first and PUBLISH_BATCH_SIZE to a transaction; concurrent runs skip
+    each other's rows where the database can. Returns how many went out."""
+    total = 0
+    while True:
+        with transaction.atomic():
+            due = list(
+                Article.objects.select_for_update(skip_locked=True)
+                .filter(status=Article.SCHEDULED, publish_at__lte=timezone.now())
+                .order_by('publish_at').values_list('pk', flat=True)[:settings.PUBLISH_BATCH_SIZE]
+            )
+            total += len(publish(due))
+        if len(due) < settings.PUBLISH_BATCH_SIZE:
+            return total
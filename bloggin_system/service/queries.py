@@ -0,0 +1,211 @@
+import typing
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from pydantic import BaseModel, create_model
+
+from .pagination import apaginate
+
+
+def _schema_of(annotation):
+    """The nested schema behind `annotation` (itself, Optional[...] or
+    List[...]), or None for scalar fields."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for arg in typing.get_args(annotation):
+        schema = _schema_of(arg)
+        if schema is not None:
+            return schema
+    return None
+
+
+def _model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        pass
+    # `article_id` style attributes read the foreign key column directly.
+    for field in model._meta.concrete_fields:
+        if field.attname == name:
+            return field
+    return None
+
+
+@lru_cache(maxsize=None)
+def query_plan(model, schema):
+    """Work out which columns and relations `schema` reads from `model`.
+
+    Returns (only, select_related, prefetch) where `only` is None when the
+    schema reads attributes that are not plain columns, since deferring
+    anything would then risk a lazy load per row."""
+    only = [model._meta.pk.name]
+    select = []
+    prefetch = []
+    for name, info in schema.model_fields.items():
+        field = _model_field(model, name)
+        if field is None:
+            only = None
+            continue
+        nested = _schema_of(info.annotation)
+        if field.many_to_many or field.one_to_many:
+            # A reverse foreign key needs its own column to be matched back.
+            keep = (field.field.name,) if field.one_to_many else ()
+            prefetch.append((field.name, field.related_model, nested, keep))
+        elif field.is_relation and nested is not None:
+            sub_only, sub_select, sub_prefetch = query_plan(field.related_model, nested)
+            select.append(field.name)
+            select.extend(f'{field.name}__{path}' for path in sub_select)
+            prefetch.extend((f'{field.name}__{path}', *rest) for path, *rest in sub_prefetch)
+            if only is not None:
+                only.append(field.name)
+                if sub_only is None:
+                    only = None
+                else:
+                    only.extend(f'{field.name}__{path}' for path in sub_only)
+        elif only is not None:
+            only.append(field.name)
+    return (tuple(only) if only is not None else None), tuple(select), tuple(prefetch)
+
+
+def plan_queryset(queryset, schema, keep=()):
+    """Shape `queryset` so that serializing its rows with `schema` issues a
+    fixed number of queries however many rows there are. `keep` names extra
+    columns the caller needs loaded, e.g. the ordering of a keyset page."""
+    only, select, prefetch = query_plan(queryset.model, schema)
+    if select:
+        queryset = queryset.select_related(*select)
+    for path, related_model, nested, related_keep in prefetch:
+        if nested is None:
+            queryset = queryset.prefetch_related(path)
+        else:
+            inner = plan_queryset(related_model._default_manager.all(), nested, related_keep)
+            queryset = queryset.prefetch_related(Prefetch(path, queryset=inner))
+    if only is not None:
+        queryset = queryset.only(*only, *keep)
+    return queryset
+
+
+@lru_cache(maxsize=None)
+def values_plan(model, schema, prefix=''):
+    """How to read `schema` from `model` with .values() instead of model
+    instances. Returns (columns, relations): columns are (lookup, key path)
+    pairs for the row itself and its nested foreign keys, and relations are
+    (name, columns, flat) for to-many fields, each read with one more query.
+    A to-many field serialized as a list of one column names that column in
+    the schema's `flat_relations`."""
+    columns = []
+    relations = []
+    for name, info in schema.model_fields.items():
+        field = _model_field(model, name)
+        if field is None:
+            raise ValueError(f'{schema.__name__}.{name} is not a field of {model.__name__}')
+        nested = _schema_of(info.annotation)
+        if field.many_to_many or field.one_to_many:
+            if prefix:
+                raise ValueError(f'{schema.__name__}.{name}: nested to-many fields are not supported')
+            flat = None if nested is not None else schema.flat_relations[name]
+            sub_columns = values_plan(field.related_model, nested, f'{name}__')[0] if nested is not None else ()
+            relations.append((name, sub_columns, flat))
+        elif field.is_relation and nested is not None:
+            sub_columns, _ = values_plan(field.related_model, nested, f'{prefix}{name}__')
+            columns.extend((lookup, (name, *path)) for lookup, path in sub_columns)
+        else:
+            columns.append((prefix + name, (name,)))
+    return tuple(columns), tuple(relations)
+
+
+@lru_cache(maxsize=None)
+def _sparse_schema(schema, fields):
+    sparse = create_model(
+        f'{schema.__name__}Fields',
+        **{name: (info.annotation, info) for name, info in schema.model_fields.items() if name in fields},
+    )
+    sparse.flat_relations = getattr(schema, 'flat_relations', {})
+    return sparse
+
+
+def sparse_schema(schema, fields):
+    """`schema` cut down to the names in `fields` (and the id), so that its
+    rows read only those columns and relations. The same names always give
+    the same class, whose plans are then cached like any schema's. Raises
+    ValueError naming any field `schema` does not have."""
+    unknown = set(fields) - set(schema.model_fields)
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+    return _sparse_schema(schema, frozenset(fields) | {'id'})
+
+
+def values_queryset(queryset, schema, keep=()):
+    """`queryset` as flat .values() rows holding what `schema` reads, plus
+    the `keep` columns (e.g. the ordering of a keyset page)."""
+    columns, _ = values_plan(queryset.model, schema)
+    lookups = [lookup for lookup, _ in columns]
+    return queryset.values(*lookups, *(name for name in keep if name not in lookups))
+
+
+def _nest(row, columns):
+    shaped = {}
+    for lookup, path in columns:
+        target = shaped
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = row[lookup]
+    return shaped
+
+
+def _relation_queryset(model, ids, name, columns, flat):
+    lookups = [f'{name}__{flat}'] if flat else [lookup for lookup, _ in columns]
+    return model._default_manager.filter(pk__in=ids).values('pk', f'{name}__pk', *lookups).order_by('pk', f'{name}__pk')
+
+
+def _attach(shaped, relation_rows, name, columns, flat):
+    by_pk = {item['id']: item for item in shaped}
+    for item in shaped:
+        item[name] = []
+    for row in relation_rows:
+        if row[f'{name}__pk'] is not None:
+            by_pk[row['pk']][name].append(row[f'{name}__{flat}'] if flat else _nest(row, columns))
+
+
+async def ashape_rows(model, rows, schema):
+    """Turn flat .values() rows into plain dicts shaped like `schema`,
+    trusted as they come from the ORM, so nothing is validated again."""
+    columns, relations = values_plan(model, schema)
+    shaped = [_nest(row, columns) for row in rows]
+    if shaped and relations:
+        ids = [item['id'] for item in shaped]
+        for name, sub_columns, flat in relations:
+            queryset = _relation_queryset(model, ids, name, sub_columns, flat)
+            _attach(shaped, [row async for row in queryset], name, sub_columns, flat)
+    return shaped
+
+
+def shape_rows(model, rows, schema):
+    columns, relations = values_plan(model, schema)
+    shaped = [_nest(row, columns) for row in rows]
+    if shaped and relations:
+        ids = [item['id'] for item in shaped]
+        for name, sub_columns, flat in relations:
+            _attach(shaped, _relation_queryset(model, ids, name, sub_columns, flat), name, sub_columns, flat)
+    return shaped
+
+
+async def avalues_page(queryset, schema, ordering, cursor=None, limit=None):
+    """A keyset page of `queryset` as {"items": [...], "next_cursor": ...}
+    with plain dict items, the lean counterpart of serializing each row
+    with `schema.model_validate`."""
+    keep = [name.lstrip('-') for name in ordering]
+    rows, next_cursor = await apaginate(values_queryset(queryset, schema, keep), ordering, cursor, limit)
+    return {"items": await ashape_rows(queryset.model, rows, schema), "next_cursor": next_cursor}
+
+
+async def avalues_list(queryset, schema):
+    return await ashape_rows(queryset.model, [row async for row in values_queryset(queryset, schema)], schema)
+
+
+async def avalues_get(queryset, schema, **lookups):
+    """The one row matching `lookups` as a `schema` shaped dict; raises the
+    model's DoesNotExist like .aget()."""
+    row = await values_queryset(queryset, schema).aget(**lookups)
+    return (await ashape_rows(queryset.model, [row], schema))[0]
@@ -0,0 +1,90 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from fastapi import HTTPException
+
+from .executor import run_sync
+from .redis_client import get_redis
+
+# Refill the bucket for the time since it was last touched, then take one
+# token if there is one. Returns 0 when the request may go ahead, otherwise
+# the whole seconds until a token will be available.
+TAKE_TOKEN = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or capacity
+local at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return wait
+"""
+
+
+class LocalBuckets:
+    """The same token buckets in process memory, for when there is no
+    Redis; each process then enforces its own limit. Holds at most
+    `maxsize` buckets, forgetting the least recently used."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - at) * rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = math.ceil((1 - tokens) / rate)
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+local_buckets = LocalBuckets(settings.RATE_LIMIT_LOCAL_BUCKETS)
+
+
+def take(key, capacity, window):
+    """Spend one of the `capacity` attempts `key` gets per `window` seconds;
+    returns 0, or how many seconds to wait when none are left."""
+    rate = capacity / window
+    redis = get_redis()
+    if redis is None:
+        return local_buckets.take(key, capacity, rate, time.monotonic())
+    return int(redis.eval(TAKE_TOKEN, 1, key, capacity, rate, time.time()))
+
+
+def client_ip(request):
+    return request.client.host if request.client else 'unknown'
+
+
+async def throttle(request, scope, username=None):
+    """Reject the request with a 429 once its client IP, or the account it
+    names, has used up its attempts at `scope`."""
+    buckets = [(f'ratelimit:{scope}:ip:{client_ip(request)}', settings.AUTH_RATE_PER_IP)]
+    if username is not None:
+        buckets.append((f'ratelimit:{scope}:user:{username}', settings.AUTH_RATE_PER_USERNAME))
+    for key, capacity in buckets:
+        wait = await run_sync(take, key, capacity, settings.AUTH_RATE_WINDOW)
+        if wait:
+            raise HTTPException(status_code=429, detail="Too many attempts", headers={"Retry-After": str(wait)})
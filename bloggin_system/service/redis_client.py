@@ -0,0 +1,11 @@
+from django.conf import settings
+
+
+def get_redis():
+    """The Redis client behind the default cache, or None when the cache is
+    not django-redis (local development, tests). Features built directly on
+    Redis data types check for None and degrade instead of failing."""
+    if not settings.CACHES['default']['BACKEND'].startswith('django_redis.'):
+        return None
+    from django_redis import get_redis_connection
+    return get_redis_connection('default')
@@ -0,0 +1,32 @@
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+# Aware UTC datetimes come out with a "Z" suffix, as pydantic writes them.
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def dump_json(content):
+    """JSON bytes for a pydantic model or for plain JSON-shaped data."""
+    if isinstance(content, BaseModel):
+        return content.model_dump_json().encode()
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """orjson-encoded response. Handlers that already hold plain dicts
+    return it directly, which skips FastAPI's response_model validation
+    and jsonable_encoder pass."""
+
+    def render(self, content):
+        return dump_json(content)
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """A streaming response whose content is produced while the request
+    body is still being read. StreamingResponse would otherwise listen
+    for a disconnect on the same receive channel the body arrives on,
+    and swallow parts of it; a disconnect still ends the body's stream."""
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
@@ -0,0 +1,119 @@
+"""Article revision history.
+
+A revision is recorded whenever an article's title or content changes.
+Its content is stored as a zlib-compressed delta against the revision
+before: the runs of the previous text's lines and sentences that are kept,
+and the text put in between them, so that a small edit to a long article
+costs about as much as the edit. Every REVISION_KEYFRAME_INTERVAL
+revisions the content is stored whole instead, as it is when the delta
+would come out no smaller or the article was changed without a revision
+being recorded. Rebuilding a revision reads its keyframe and the deltas
+after it: one query, at most REVISION_KEYFRAME_INTERVAL rows."""
+import hashlib
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+
+from .models import Article, ArticleRevision
+
+# Sentences and lines, each with the whitespace after it; joined back
+# together they give the text unchanged.
+_TOKEN = re.compile(r'[^.!?\n]*[.!?\n]+\s*|[^.!?\n]+')
+
+
+def _tokens(text):
+    return _TOKEN.findall(text)
+
+
+def digest(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def diff(old, new):
+    """The delta turning `old` into `new`: [start, end] runs of the tokens
+    of `old` to keep, and strings to insert, in order."""
+    a, b = _tokens(old), _tokens(new)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(b[j1:j2]))
+    return ops
+
+
+def patch(old, ops):
+    tokens = _tokens(old)
+    return ''.join(''.join(tokens[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+
+
+def _compress(text):
+    return zlib.compress(text.encode(), 9)
+
+
+def _latest(article_ids):
+    """{article id: the newest revision's number, keyframe, title, digest}."""
+    newest = ArticleRevision.objects.filter(article_id=OuterRef('article_id')).order_by('-number').values('number')[:1]
+    return {
+        row['article_id']: row
+        for row in ArticleRevision.objects.filter(article_id__in=article_ids, number=Subquery(newest)).values(
+            'article_id', 'number', 'keyframe', 'title', 'digest',
+        )
+    }
+
+
+def record_revisions(changes):
+    """Record a revision of each article in `changes`, a list of (article,
+    content before the change) pairs with None for new articles, unless
+    its title and content are those of its latest revision. Call it in the
+    transaction that saves the articles."""
+    ids = [article.pk for article, _ in changes]
+    # Lock the articles, in a fixed order, so concurrent edits of one take
+    # turns numbering its next revision instead of both taking the same.
+    list(Article.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk', flat=True))
+    latest = _latest(ids)
+    revisions = []
+    for article, previous in changes:
+        last = latest.get(article.pk)
+        content_digest = digest(article.content)
+        if last and (last['title'], last['digest']) == (article.title, content_digest):
+            continue
+        number = last['number'] + 1 if last else 1
+        data = _compress(article.content)
+        keyframe = number
+        # A delta only works against the content the last revision holds.
+        if (
+            last and previous is not None and last['digest'] == digest(previous)
+            and number - last['keyframe'] < settings.REVISION_KEYFRAME_INTERVAL
+        ):
+            delta = zlib.compress(json.dumps(diff(previous, article.content), separators=(',', ':')).encode(), 9)
+            if len(delta) < len(data):
+                data, keyframe = delta, last['keyframe']
+        revisions.append(ArticleRevision(
+            article_id=article.pk, number=number, keyframe=keyframe, title=article.title, data=data,
+            digest=content_digest, size=len(article.content),
+        ))
+    ArticleRevision.objects.bulk_create(revisions, batch_size=500)
+
+
+async def arevision(article_id, number):
+    """Revision `number` of an article with its content rebuilt, or None
+    if it has no such revision."""
+    keyframe = ArticleRevision.objects.filter(article_id=article_id, number=number).values('keyframe')
+    rows = [
+        row async for row in ArticleRevision.objects.filter(
+            article_id=article_id, number__gte=Subquery(keyframe), number__lte=number,
+        ).order_by('number').values('number', 'title', 'data', 'size', 'created_at')
+    ]
+    if not rows:
+        return None
+    content = zlib.decompress(rows[0]['data']).decode()
+    for row in rows[1:]:
+        content = patch(content, json.loads(zlib.decompress(row['data'])))
+    revision = rows[-1]
+    del revision['data']
+    return {**revision, 'content': content}
@@ -0,0 +1,54 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+class ReadRouting:
+    """Whether the current request may still read from a replica. Shared by
+    reference with the request's ORM threads, so a write made on any of them
+    sends the request's later reads to the primary."""
+
+    __slots__ = ('replica_ok',)
+
+    def __init__(self, replica_ok):
+        self.replica_ok = replica_ok
+
+
+_routing = ContextVar('read_routing', default=None)
+
+
+@contextmanager
+def reads_from(replica_ok):
+    token = _routing.set(ReadRouting(replica_ok))
+    try:
+        yield _routing.get()
+    finally:
+        _routing.reset(token)
+
+
+class ReplicaRouter:
+    """Send reads to a random replica in DATABASE_REPLICAS, but only in code
+    that opted in with reads_from(True), i.e. safe HTTP requests. Everything
+    else (writes, background tasks, management commands) reads and writes the
+    primary, since it may act on what it reads."""
+
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None and routing.replica_ok and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.replica_ok = False
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -1,44 +1,160 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from datetime import datetime
+from django.conf import settings
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
+from typing import ClassVar, Dict, Generic, List, Optional, TypeVar
+
+T = TypeVar('T')
 
 class UserSerializer(BaseModel):
     id: int
     username: str
     email: str
 
-class ArticleSerializer(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+class CategorySerializer(BaseModel):
+    id: int
+    name: str
+
+    model_config = ConfigDict(from_attributes=True)
+
+class ArticleSummary(BaseModel):
+    """An article as listings show it, with an excerpt for its content."""
     id: int
     title: str
-    content: str
+    excerpt: str = ''
     author: UserSerializer
-    published_date: str
-    tags: Optional[str] = None
+    status: str = 'published'
+    publish_at: Optional[datetime] = None
+    published_date: datetime
+    tags: List[str] = []
+    categories: List[CategorySerializer] = []
+    comment_count: int = 0
+    last_commented_at: Optional[datetime] = None
+    view_count: int = 0
+
+    model_config = ConfigDict(from_attributes=True)
+    flat_relations: ClassVar[Dict[str, str]] = {'tags': 'name'}
+
+    @field_validator('tags', mode='before')
+    @classmethod
+    def tag_names(cls, value):
+        if hasattr(value, 'all'):
+            return [tag.name for tag in value.all()]
+        return value
+
+    @field_validator('categories', mode='before')
+    @classmethod
+    def related_rows(cls, value):
+        if hasattr(value, 'all'):
+            return list(value.all())
+        return value
+
+class ArticleSerializer(ArticleSummary):
+    content: str
+
+class RevisionSerializer(BaseModel):
+    number: int
+    title: str
+    size: int
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class RevisionContent(RevisionSerializer):
+    content: str
 
-    class Config:
-        orm_mode = True
-        
 class FAQSerializer(BaseModel):
     id: int
     question: str
     answer: str
     created_by: UserSerializer
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
-class CategorySerializer(BaseModel):
-    id: int
+class TagSerializer(BaseModel):
     name: str
+    article_count: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class CommentSerializer(BaseModel):
     id: int
     article_id: int
+    parent_id: Optional[int] = None
     user: UserSerializer
     content: str
-    created_at: str
+    created_at: datetime
+    depth: int = 0
+    reply_count: int = 0
+
+    model_config = ConfigDict(from_attributes=True)
+
+class CommentThread(CommentSerializer):
+    """A comment with its replies nested below it, as far as was asked
+    for; `replies_cursor` fetches the replies not included."""
+    replies: List['CommentThread'] = []
+    replies_cursor: Optional[str] = None
+
+class NotificationArticle(BaseModel):
+    id: int
+    title: str
+
+class NotificationSerializer(BaseModel):
+    id: int
+    kind: str
+    actor: UserSerializer
+    article: NotificationArticle
+    comment_id: Optional[int] = None
+    created_at: datetime
+
+class InboxItem(NotificationSerializer):
+    unread: bool
+
+class UnreadCount(BaseModel):
+    unread: int
+
+class SearchHit(BaseModel):
+    kind: str
+    id: int
+    title: str
+    snippet: str
+    rank: float
+
+class BulkResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    status: int
+    error: Optional[str] = None
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+class MediaVariant(BaseModel):
+    url: str
+    width: int
+    height: int
+    size: int
+    content_type: str
+
+    @model_validator(mode='before')
+    @classmethod
+    def path_to_url(cls, value):
+        if isinstance(value, dict) and 'path' in value:
+            value = {**value, 'url': settings.MEDIA_URL + value['path']}
+        return value
+
+class MediaSerializer(BaseModel):
+    id: int
+    sha256: str
+    url: str
+    content_type: str
+    size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    status: str
+    variants: Dict[str, MediaVariant] = {}
+    created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
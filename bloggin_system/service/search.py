@@ -0,0 +1,218 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+
+from .models import Article, Comment, FAQ, SearchDocument
+from .outbox import enqueue_many, handler
+from .pagination import InvalidCursor, clamp_limit, decode_values, encode_cursor
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+# What the database brackets matches with: private use characters, so the
+# snippet can be HTML-escaped as a whole before they become the tags.
+_START_SENTINEL = '\ue000'
+_STOP_SENTINEL = '\ue001'
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+KINDS = {
+    Article: SearchDocument.ARTICLE,
+    FAQ: SearchDocument.FAQ,
+    Comment: SearchDocument.COMMENT,
+}
+
+
+def article_body(content, tag_names):
+    return '%s\n%s' % (content, ' '.join(tag_names))
+
+
+def document_fields(instance):
+    """(title, body) indexed for a model instance."""
+    if isinstance(instance, Article):
+        return instance.title, article_body(instance.content, instance.tags.values_list('name', flat=True))
+    if isinstance(instance, FAQ):
+        return instance.question, instance.answer
+    return '', instance.content
+
+
+def index_object(instance):
+    title, body = document_fields(instance)
+    SearchDocument.objects.update_or_create(
+        kind=KINDS[type(instance)], object_id=instance.pk, defaults={'title': title[:255], 'body': body},
+    )
+
+
+def bulk_index(kind, rows):
+    """Upsert the documents of many `kind` objects from (object_id, title,
+    body) rows in one statement per batch."""
+    SearchDocument.objects.bulk_create(
+        [SearchDocument(kind=kind, object_id=object_id, title=title[:255], body=body) for object_id, title, body in rows],
+        update_conflicts=True, unique_fields=['kind', 'object_id'], update_fields=['title', 'body'], batch_size=500,
+    )
+
+
+def unindex_object(instance):
+    SearchDocument.objects.filter(kind=KINDS[type(instance)], object_id=instance.pk).delete()
+
+
+def schedule_sync(instance):
+    """Queue the search document of `instance` to be brought up to date
+    (written, or removed if the object is gone) by the outbox worker."""
+    schedule_sync_ids(KINDS[type(instance)], [instance.pk])
+
+
+def schedule_sync_ids(kind, ids):
+    """schedule_sync() for many objects of one kind, in one INSERT."""
+    enqueue_many('search.sync', {f'search:{kind}:{pk}': {'kind': kind, 'id': pk} for pk in ids})
+
+
+@handler('search.sync')
+def sync_document(payload):
+    model = next(model for model, kind in KINDS.items() if kind == payload['kind'])
+    instance = model.objects.filter(pk=payload['id']).first()
+    # Drafts and scheduled articles are not searchable until they go out.
+    if instance is None or (isinstance(instance, Article) and instance.status != Article.PUBLISHED):
+        SearchDocument.objects.filter(kind=payload['kind'], object_id=payload['id']).delete()
+    else:
+        index_object(instance)
+
+
+class RawSQLBackend:
+    def search(self, query, kind, after, limit):
+        statement = self.search_sql(query, kind, after, limit)
+        if statement is None:
+            return []
+        with connection.cursor() as db:
+            db.execute(*statement)
+            return db.fetchall()
+
+
+class SQLiteBackend(RawSQLBackend):
+    """FTS5 external-content table kept in sync by triggers; ranked by bm25
+    with title matches weighted above body matches."""
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every term so user input can never be parsed as FTS syntax;
+        # adjacent terms are ANDed.
+        return ' '.join('"%s"' % term for term in _WORD.findall(query))
+
+    def matching_ids_sql(self, query, kind):
+        expression = self.match_expression(query)
+        if not expression:
+            return None
+        sql = ('SELECT d.object_id FROM service_searchdocument_fts f '
+               'JOIN service_searchdocument d ON d.id = f.rowid '
+               'WHERE service_searchdocument_fts MATCH %s AND d.kind = %s')
+        return sql, [expression, kind]
+
+    def search_sql(self, query, kind, after, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return None
+        params = [_START_SENTINEL, _STOP_SENTINEL, expression]
+        inner = ('SELECT d.id, d.kind, d.object_id, d.title, '
+                 "snippet(service_searchdocument_fts, 1, %s, %s, '…', 16) AS snippet, "
+                 'bm25(service_searchdocument_fts, 10.0, 1.0) AS rank '
+                 'FROM service_searchdocument_fts '
+                 'JOIN service_searchdocument d ON d.id = service_searchdocument_fts.rowid '
+                 'WHERE service_searchdocument_fts MATCH %s')
+        if kind:
+            inner += ' AND d.kind = %s'
+            params.append(kind)
+        sql = f'SELECT id, kind, object_id, title, snippet, rank FROM ({inner}) hits'
+        if after:
+            sql += ' WHERE rank > %s OR (rank = %s AND id > %s)'
+            params += [after[0], after[0], after[1]]
+        sql += ' ORDER BY rank, id LIMIT %s'
+        params.append(limit)
+        return sql, params
+
+
+class PostgresBackend(RawSQLBackend):
+    """Generated tsvector column with a GIN index, ranked by ts_rank_cd.
+    Ranks are negated so that, as with bm25, smaller sorts first."""
+
+    def matching_ids_sql(self, query, kind):
+        sql = ('SELECT object_id FROM service_searchdocument '
+               "WHERE search_vector @@ websearch_to_tsquery('english', %s) AND kind = %s")
+        return sql, [query, kind]
+
+    def search_sql(self, query, kind, after, limit):
+        params = [query]
+        inner = ('SELECT d.id, d.kind, d.object_id, d.title, d.body, q.query, '
+                 '-ts_rank_cd(d.search_vector, q.query) AS rank '
+                 "FROM service_searchdocument d, websearch_to_tsquery('english', %s) AS q(query) "
+                 'WHERE d.search_vector @@ q.query')
+        if kind:
+            inner += ' AND d.kind = %s'
+            params.append(kind)
+        where = ''
+        if after:
+            where = ' WHERE rank > %s OR (rank = %s AND id > %s)'
+            params += [after[0], after[0], after[1]]
+        # Headlines are expensive, so only the rows of the page get one.
+        sql = ('SELECT id, kind, object_id, title, '
+               "ts_headline('english', body, query, %s) AS snippet, rank "
+               f'FROM (SELECT * FROM ({inner}) ranked{where} ORDER BY rank, id LIMIT %s) page '
+               'ORDER BY rank, id')
+        params = [f'StartSel={_START_SENTINEL}, StopSel={_STOP_SENTINEL}, MaxFragments=1'] + params + [limit]
+        return sql, params
+
+
+class FallbackBackend:
+    """Unranked substring matching for databases without a native index."""
+
+    def matching_ids_sql(self, query, kind):
+        return None
+
+    def search(self, query, kind, after, limit):
+        documents = SearchDocument.objects.filter(Q(title__icontains=query) | Q(body__icontains=query))
+        if kind:
+            documents = documents.filter(kind=kind)
+        if after:
+            documents = documents.filter(id__gt=after[1])
+        return [
+            (doc.id, doc.kind, doc.object_id, doc.title, doc.body[:200], 0.0)
+            for doc in documents.order_by('id')[:limit]
+        ]
+
+
+def highlight(snippet):
+    """The snippet as HTML: its text escaped, matches in HIGHLIGHT_START
+    and HIGHLIGHT_STOP."""
+    return escape(snippet).replace(_START_SENTINEL, HIGHLIGHT_START).replace(_STOP_SENTINEL, HIGHLIGHT_STOP)
+
+
+def get_backend():
+    return {'sqlite': SQLiteBackend, 'postgresql': PostgresBackend}.get(connection.vendor, FallbackBackend)()
+
+
+def matching_ids(query, kind):
+    """A RawSQL-able (sql, params) pair selecting the ids of `kind` objects
+    that match `query`, or None when the backend has no index."""
+    return get_backend().matching_ids_sql(query, kind)
+
+
+def search(query, kind=None, cursor=None, limit=None):
+    """Ranked hits for `query` as (hits, next_cursor); hits are dicts with
+    kind, id, title, snippet and rank."""
+    limit = clamp_limit(limit)
+    after = None
+    if cursor:
+        after = decode_values(cursor, 2)
+        if not isinstance(after[0], (int, float)) or not isinstance(after[1], int):
+            raise InvalidCursor(cursor)
+    rows = get_backend().search(query, kind, after, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][5], rows[-1][0]])
+    hits = [
+        {'kind': kind_, 'id': object_id, 'title': title, 'snippet': highlight(snippet), 'rank': rank}
+        for _, kind_, object_id, title, snippet, rank in rows
+    ]
+    return hits, next_cursor
@@ -0,0 +1,179 @@
+from functools import wraps
+
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from .auth import invalidate_token, invalidate_user
+from .bulk import in_bulk
+from .cache import invalidate
+from .counters import comments_added, comments_removed, replies_changed
+from .feeds import AUTHOR, CATEGORY, remove_articles, update_feeds
+from .models import Article, ArticleTag, Category, Comment, CustomUser, FAQ, Tag
+from .notifications import notify_commented, notify_published
+from .search import schedule_sync
+from .syndication import schedule_render
+
+
+def unless_bulk(receiver):
+    """Skip `receiver` while a bulk operation does its work in aggregate."""
+    @wraps(receiver)
+    def wrapper(*args, **kwargs):
+        if not in_bulk():
+            return receiver(*args, **kwargs)
+    return wrapper
+
+
+@receiver([post_save, post_delete], sender=Article)
+@unless_bulk
+def invalidate_article(sender, instance, **kwargs):
+    invalidate(f'article:{instance.pk}', 'articles')
+
+
+@receiver([post_save, post_delete], sender=Comment)
+@unless_bulk
+def invalidate_commented_article(sender, instance, **kwargs):
+    # Listings show comment counts too.
+    invalidate(f'article:{instance.article_id}', 'articles')
+
+
+@receiver(post_save, sender=Comment)
+@unless_bulk
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        comments_added(instance.article_id, 1, instance.created_at)
+        if instance.parent_id is not None:
+            replies_changed({instance.parent_id: 1})
+
+
+@receiver(post_delete, sender=Comment)
+@unless_bulk
+def uncount_comment(sender, instance, **kwargs):
+    comments_removed(instance.article_id, 1)
+    # Replies deleted with their parent find it gone; that update is a no-op.
+    if instance.parent_id is not None:
+        replies_changed({instance.parent_id: -1})
+
+
+@receiver([post_save, post_delete], sender=FAQ)
+@unless_bulk
+def invalidate_faq(sender, instance, **kwargs):
+    invalidate(f'faq:{instance.pk}', 'faqs')
+
+
+@receiver([post_save, post_delete], sender=Article)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=FAQ)
+@unless_bulk
+def update_search_index(sender, instance, **kwargs):
+    schedule_sync(instance)
+
+
+@receiver(post_save, sender=Article)
+@unless_bulk
+def rerender_syndication(sender, instance, created, **kwargs):
+    if instance.status == Article.PUBLISHED:
+        schedule_render([instance.pk], listed=created)
+
+
+@receiver(post_delete, sender=Article)
+@unless_bulk
+def rerender_syndication_after_delete(sender, instance, **kwargs):
+    if instance.status == Article.PUBLISHED:
+        schedule_render([instance.pk], listed=True)
+
+
+@receiver(m2m_changed, sender=ArticleTag)
+@unless_bulk
+def article_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        if reverse:
+            Tag.objects.filter(pk=instance.pk).update(article_count=F('article_count') + len(pk_set))
+        else:
+            Tag.objects.filter(pk__in=pk_set).update(article_count=F('article_count') + 1)
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        articles = Article.objects.filter(pk__in=pk_set) if reverse else [instance]
+        for article in articles:
+            invalidate(f'article:{article.pk}', 'articles')
+            schedule_sync(article)
+        schedule_render([article.pk for article in articles])
+
+
+@receiver(post_save, sender=Article)
+@unless_bulk
+def add_to_author_feed(sender, instance, created, **kwargs):
+    # Drafts join their feeds when published (service.publishing).
+    if created and instance.status == Article.PUBLISHED:
+        update_feeds('add', {(AUTHOR, instance.author_id): [instance.pk]})
+
+
+@receiver(post_save, sender=Article)
+@unless_bulk
+def notify_followers(sender, instance, created, **kwargs):
+    if created and instance.status == Article.PUBLISHED:
+        notify_published([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+@unless_bulk
+def notify_comment(sender, instance, created, **kwargs):
+    if created:
+        notify_commented([instance.pk])
+
+
+@receiver(pre_delete, sender=Article)
+@unless_bulk
+def remove_from_feeds(sender, instance, **kwargs):
+    # Before the delete, while its category links are still there.
+    remove_articles([(instance.pk, instance.author_id)])
+
+
+@receiver(m2m_changed, sender=Article.categories.through)
+@unless_bulk
+def article_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.article_set if reverse else instance.categories
+        pk_set = set(related.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'pre_clear') or not pk_set:
+        return
+    # Only published articles are in feeds.
+    if reverse and action == 'post_add':
+        pk_set = set(Article.objects.published().filter(pk__in=pk_set).values_list('pk', flat=True))
+    elif not reverse and instance.status != Article.PUBLISHED:
+        return
+    if not pk_set:
+        return
+    if reverse:
+        changes = {(CATEGORY, instance.pk): sorted(pk_set)}
+    else:
+        changes = {(CATEGORY, category_id): [instance.pk] for category_id in pk_set}
+    update_feeds('add' if action == 'post_add' else 'remove', changes)
+
+
+@receiver(post_delete, sender=Category)
+def forget_category_feed(sender, instance, **kwargs):
+    update_feeds('forget', {(CATEGORY, instance.pk): []})
+
+
+@receiver(post_delete, sender=ArticleTag)
+@unless_bulk
+def uncount_article_tag(sender, instance, **kwargs):
+    # Removals, clears and cascades from deleted articles all delete
+    # through rows one by one once a receiver is connected, so decrements
+    # are counted here rather than from m2m_changed.
+    Tag.objects.filter(pk=instance.tag_id).update(article_count=F('article_count') - 1)
+
+
+@receiver(post_delete, sender=Token)
+def forget_revoked_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=CustomUser)
+def forget_changed_user(sender, instance, created, **kwargs):
+    # Password resets, deactivation and renames must not be masked by a
+    # cached copy of the user.
+    if not created:
+        invalidate_user(instance)
@@ -0,0 +1,190 @@
+"""RSS and Atom feeds of the newest articles and a sharded sitemap of all
+of them, rendered ahead of time into cached blobs, so that feed readers
+and crawlers are served from the cache and answered 304 when they hold
+the current version.
+
+Each document is re-rendered by an outbox event (coalesced while one is
+pending) that article changes enqueue: the feeds on any change, and when
+an article is published or deleted the sitemap shard holding it, which queues
+the sitemap index in turn when its entry changed. A blob missing from the
+cache is rendered by the request that finds it missing."""
+import hashlib
+import time
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import feedgenerator
+from django.utils.http import http_date, parse_http_date_safe
+from fastapi import HTTPException, Response
+
+from .cache import etag_matches
+from .executor import run_sync
+from .models import Article, ArticleTag
+from .outbox import enqueue, enqueue_many, handler
+
+RSS = 'rss'
+ATOM = 'atom'
+SITEMAP = 'sitemap'
+
+MEDIA_TYPES = {
+    RSS: 'application/rss+xml; charset=utf-8',
+    ATOM: 'application/atom+xml; charset=utf-8',
+    SITEMAP: 'application/xml; charset=utf-8',
+}
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def shard_name(shard):
+    return f'{SITEMAP}-{shard}'
+
+
+def _blob_key(name):
+    return f'syndication:{name}'
+
+
+def article_url(article_id):
+    return f'{settings.SITE_URL}/articles/{article_id}/'
+
+
+def _render_feed(feed_class, path):
+    articles = list(
+        Article.objects.published().order_by('-published_date', '-id')
+        .values('id', 'title', 'excerpt', 'published_date')[:settings.SYNDICATION_FEED_SIZE]
+    )
+    tags = {}
+    for article_id, name in ArticleTag.objects.filter(article_id__in=[article['id'] for article in articles]).order_by(
+        'tag__name'
+    ).values_list('article_id', 'tag__name'):
+        tags.setdefault(article_id, []).append(name)
+    feed = feed_class(
+        title=settings.SYNDICATION_TITLE, link=f'{settings.SITE_URL}/', description=settings.SYNDICATION_DESCRIPTION,
+        feed_url=f'{settings.SITE_URL}{path}', language='en',
+    )
+    for article in articles:
+        url = article_url(article['id'])
+        feed.add_item(
+            title=article['title'], link=url, description=article['excerpt'], unique_id=url,
+            pubdate=article['published_date'], updateddate=article['published_date'],
+            categories=tags.get(article['id'], ()),
+        )
+    return feed.writeString('utf-8').encode(), {}
+
+
+def _urlset(rows):
+    yield '<?xml version="1.0" encoding="UTF-8"?>'
+    yield f'<urlset xmlns="{SITEMAP_NS}">'
+    for article_id, published in rows:
+        yield f'<url><loc>{escape(article_url(article_id))}</loc><lastmod>{published.isoformat()}</lastmod></url>'
+    yield '</urlset>'
+
+
+def _render_shard(shard):
+    """Published articles with ids in [shard, shard + 1) *
+    SITEMAP_SHARD_SIZE, read off the primary key; ids never move between
+    shards."""
+    size = settings.SITEMAP_SHARD_SIZE
+    rows = list(
+        Article.objects.published().filter(id__gte=shard * size, id__lt=(shard + 1) * size)
+        .order_by('id').values_list('id', 'published_date')
+    )
+    lastmod = max((published for _, published in rows), default=None)
+    body = '\n'.join(_urlset(rows)) + '\n'
+    return body.encode(), {'count': len(rows), 'lastmod': lastmod.isoformat() if lastmod else None}
+
+
+def _render_index():
+    """The shards up to the one holding the newest id, from their blobs
+    (rendering those that are missing) rather than from the articles."""
+    last_id = Article.objects.aggregate(last=Max('id'))['last']
+    shards = range(last_id // settings.SITEMAP_SHARD_SIZE + 1) if last_id is not None else range(0)
+    blobs = cache.get_many([_blob_key(shard_name(shard)) for shard in shards])
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', f'<sitemapindex xmlns="{SITEMAP_NS}">']
+    listed = []
+    for shard in shards:
+        blob = blobs.get(_blob_key(shard_name(shard))) or render(shard_name(shard))
+        if blob['count']:
+            listed.append(shard)
+            loc = escape(f'{settings.SITE_URL}/{shard_name(shard)}.xml')
+            lines.append(f'<sitemap><loc>{loc}</loc><lastmod>{blob["lastmod"]}</lastmod></sitemap>')
+    lines.append('</sitemapindex>')
+    return ('\n'.join(lines) + '\n').encode(), {'shards': listed}
+
+
+def _render(name):
+    if name == RSS:
+        return _render_feed(feedgenerator.Rss201rev2Feed, '/feed.xml')
+    if name == ATOM:
+        return _render_feed(feedgenerator.Atom1Feed, '/atom.xml')
+    if name == SITEMAP:
+        return _render_index()
+    return _render_shard(int(name[len(f'{SITEMAP}-'):]))
+
+
+def render(name):
+    """Render document `name` into its blob and return the blob. One that
+    comes out the same keeps its Last-Modified, so pollers stay on 304."""
+    body, meta = _render(name)
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+    old = cache.get(_blob_key(name))
+    modified = old['last_modified'] if old and old['etag'] == etag else int(time.time())
+    blob = {'etag': etag, 'last_modified': modified, 'body': body, **meta}
+    cache.set(_blob_key(name), blob, None)
+    return blob
+
+
+def schedule_render(article_ids, listed=False):
+    """Queue the documents showing `article_ids` to be rendered again: the
+    feeds, and when articles were added or removed (`listed`), their
+    sitemap shards."""
+    names = [RSS, ATOM]
+    if listed:
+        names += sorted({shard_name(pk // settings.SITEMAP_SHARD_SIZE) for pk in article_ids})
+    enqueue_many('syndication.render', {_blob_key(name): {'name': name} for name in names})
+
+
+@handler('syndication.render')
+def render_document(payload):
+    name = payload['name']
+    old = cache.get(_blob_key(name))
+    blob = render(name)
+    if name.startswith(f'{SITEMAP}-') and (old is None or (old['count'], old['lastmod']) != (blob['count'], blob['lastmod'])):
+        enqueue('syndication.render', {'name': SITEMAP}, key=_blob_key(SITEMAP))
+
+
+def not_modified(request, blob):
+    # If-None-Match wins over If-Modified-Since when a client sends both.
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        return etag_matches(if_none_match, blob['etag'])
+    since = parse_http_date_safe(request.headers.get('if-modified-since') or '')
+    return since is not None and since >= blob['last_modified']
+
+
+async def serve(request, name):
+    """The blob of document `name` as a response, or a 304 for a client
+    whose copy is current; the database is only read on a cache miss."""
+    blob = await cache.aget(_blob_key(name))
+    if blob is None:
+        blob = await run_sync(render, name)
+    headers = {
+        'ETag': blob['etag'],
+        'Last-Modified': http_date(blob['last_modified']),
+        'Cache-Control': f'public, max-age={settings.SYNDICATION_MAX_AGE}',
+    }
+    if not_modified(request, blob):
+        return Response(status_code=304, headers=headers)
+    return Response(content=blob['body'], media_type=MEDIA_TYPES[name.split('-')[0]], headers=headers)
+
+
+async def serve_shard(request, shard):
+    """A sitemap shard, if the index lists it; other numbers are 404s
+    rather than renders."""
+    index = await cache.aget(_blob_key(SITEMAP))
+    if index is None:
+        index = await run_sync(render, SITEMAP)
+    if shard not in index['shards']:
+        raise HTTPException(status_code=404, detail="Sitemap not found")
+    return await serve(request, shard_name(shard))
@@ -0,0 +1,39 @@
+import re
+
+from .models import ArticleTag, Tag
+
+
+def parse_tags(raw):
+    """Normalize tag input, either a list of names or one free-form string
+    (comma or semicolon separated if it has any, else whitespace)."""
+    if isinstance(raw, str):
+        raw = re.split(r'[,;]', raw) if re.search(r'[,;]', raw) else raw.split()
+    names = []
+    for part in raw:
+        name = part.strip().lstrip('#').strip().lower()[:50]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def get_or_create_tags(names):
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    return list(Tag.objects.filter(name__in=names))
+
+
+def set_article_tags(article, raw):
+    article.tags.set(get_or_create_tags(parse_tags(raw)))
+
+
+def filter_by_tags(queryset, names, match='any'):
+    """Restrict an Article queryset to those tagged with any (or all) of
+    `names`. Each condition is an id subquery driven by the (tag, article)
+    index, so no LIKE scan and no duplicate rows."""
+    names = parse_tags(names)
+    if not names:
+        return queryset
+    if match == 'all':
+        for name in names:
+            queryset = queryset.filter(pk__in=ArticleTag.objects.filter(tag__name=name).values('article_id'))
+        return queryset
+    return queryset.filter(pk__in=ArticleTag.objects.filter(tag__name__in=names).values('article_id'))
@@ -1,5 +1,10 @@
 from celery import shared_task
 
+from . import media, outbox  # noqa: F401  (media registers its outbox handler)
+from .counters import reconcile_comment_counts as _reconcile_comment_counts
+from .publishing import publish_due
+from .viewcounts import flush_view_counts as _flush_view_counts
+
 @shared_task
 def add(x, y):
     return x + y
@@ -10,4 +15,20 @@ def mul(x, y):
 
 @shared_task
 def xsum(numbers):
-    return sum(numbers)
\ No newline at end of file
+    return sum(numbers)
+
+@shared_task
+def reconcile_comment_counts():
+    return _reconcile_comment_counts()
+
+@shared_task
+def flush_view_counts():
+    return _flush_view_counts()
+
+@shared_task
+def drain_outbox():
+    return outbox.drain()
+
+@shared_task
+def publish_scheduled_articles():
+    return publish_due()
@@ -1,3 +1,1546 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, router, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pydantic import ValidationError
+from PIL import Image
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.requests import Request
+
+import fastapi_app as api
+from redis.exceptions import ConnectionError as RedisConnectionError
+from rest_framework.authtoken.models import Token
+
+from service import notifications, outbox, tasks
+from service.auth import cache_stats, get_current_user, local_tokens
+from service.cache import cached_response
+from service.counters import reconcile_comment_counts
+from service.export import aexport_articles, export_articles
+from service.models import Article, ArticleRevision, Category, Comment, CustomUser, FAQ, MediaFile, Notification, OutboxEvent, SearchDocument, Tag
+from service.pagination import InvalidCursor, encode_cursor, paginate
+from service.queries import plan_queryset
+from service.revisions import diff, patch
+from service.search import search
+from service.schemas import ArticleSerializer, CommentThread, UserSerializer
+from service.tags import parse_tags, set_article_tags
+from service.passwords import HasherBusy, hash_password, shutdown_pool
+from service.metrics import record_cache, registry
+from service import fields, media, middleware
+from service.middleware import CompressionMiddleware, MetricsMiddleware, ReadRoutingMiddleware
+from service.profiling import Sampler
+from service.publishing import publish
+from service.ratelimit import local_buckets
+from service.viewcounts import decay_factor, view_buffer
+
+NO_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def make_request(headers=None):
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'path': '/',
+        'query_string': b'',
+        'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    })
+
+
+def payload(response):
+    return json.loads(response.body)
+
+
+@override_settings(CACHES=NO_CACHES)
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.articles = [
+            Article.objects.create(title=f'Article {i}', content='body', author=cls.user)
+            for i in range(5)
+        ]
+
+    async def test_pages_cover_every_row_once_newest_first(self):
+        seen = []
+        cursor = None
+        while True:
+            page = payload(await api.list_articles(make_request(), cursor=cursor, limit=2))
+            seen.extend(item['id'] for item in page['items'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, [a.id for a in reversed(self.articles)])
+
+    def test_ties_on_timestamp_are_broken_by_id(self):
+        Article.objects.update(published_date=self.articles[0].published_date)
+        first, cursor = paginate(Article.objects.all(), ('-published_date', '-id'), limit=3)
+        rest, end = paginate(Article.objects.all(), ('-published_date', '-id'), cursor, limit=3)
+        self.assertEqual([a.id for a in first + rest], sorted((a.id for a in self.articles), reverse=True))
+        self.assertIsNone(end)
+
+    def test_invalid_cursor_is_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            paginate(Article.objects.all(), ('-published_date', '-id'), 'not-a-cursor')
+
+    async def test_comments_are_paged_oldest_first(self):
+        article = self.articles[0]
+        comments = [await Comment.objects.acreate(article=article, user=self.user, content=str(i)) for i in range(3)]
+        page = payload(await api.list_comments(article.id, cursor=None, limit=2))
+        self.assertEqual([c['id'] for c in page['items']], [c.id for c in comments[:2]])
+        page = payload(await api.list_comments(article.id, cursor=page['next_cursor'], limit=2))
+        self.assertEqual([c['id'] for c in page['items']], [comments[2].id])
+        self.assertIsNone(page['next_cursor'])
+
+    async def test_faqs_are_paged(self):
+        for i in range(3):
+            await FAQ.objects.acreate(question=f'Q{i}', answer='A', created_by=self.user)
+        page = payload(await api.list_faqs(make_request(), cursor=None, limit=2))
+        self.assertEqual(len(page['items']), 2)
+        self.assertIsNotNone(page['next_cursor'])
+
+
+@override_settings(CACHES=NO_CACHES, VIEW_BUFFER_FLUSH_SECONDS=3600)
+class QueryCountTests(TestCase):
+    """Listing endpoints must cost the same number of queries whatever the
+    number of rows, otherwise serialization has grown an N+1."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.article_owner = CustomUser.objects.create(username='owner', email='owner@example.com')
+        cls.article = Article.objects.create(title='Thread', content='body', author=cls.article_owner)
+
+    def setUp(self):
+        view_buffer.drain()
+
+    def make_user(self, i):
+        return CustomUser.objects.create(username=f'user{i}', email=f'user{i}@example.com')
+
+    def count_queries(self, call):
+        with CaptureQueriesContext(connection) as ctx:
+            page = async_to_sync(call)()
+            if isinstance(page, dict):
+                # Touch every serialized field the way the response encoder would.
+                [item.model_dump() for item in page['items']]
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, call, add_row):
+        add_row(0)
+        small = self.count_queries(call)
+        for i in range(1, 15):
+            add_row(i)
+        self.assertEqual(self.count_queries(call), small)
+
+    def test_list_articles(self):
+        self.assertConstantQueries(
+            lambda: api.list_articles(make_request(), cursor=None, limit=50),
+            lambda i: Article.objects.create(title=str(i), content='body', author=self.make_user(i)),
+        )
+
+    def test_list_comments(self):
+        self.assertConstantQueries(
+            lambda: api.list_comments(self.article.id, cursor=None, limit=50),
+            lambda i: Comment.objects.create(article=self.article, user=self.make_user(i), content=str(i)),
+        )
+
+    def test_list_faqs(self):
+        self.assertConstantQueries(
+            lambda: api.list_faqs(make_request(), cursor=None, limit=50),
+            lambda i: FAQ.objects.create(question=str(i), answer='A', created_by=self.make_user(i)),
+        )
+
+    def test_detail_is_one_query_plus_one_per_relation(self):
+        with self.assertNumQueries(3):
+            async_to_sync(api.get_article)(make_request(), self.article.id)
+
+    def test_lean_rows_match_the_serializer(self):
+        set_article_tags(self.article, 'python, web')
+        self.article.categories.set([Category.objects.create(name='News')])
+        article = plan_queryset(Article.objects.all(), ArticleSerializer).get(id=self.article.id)
+        expected = json.loads(ArticleSerializer.model_validate(article).model_dump_json())
+        lean = payload(async_to_sync(api.get_article)(make_request(), self.article.id))
+        self.assertEqual(lean, expected)
+        comment = Comment.objects.create(article=self.article, user=self.article_owner, content='hi')
+        expected = json.loads(CommentThread.model_validate(comment).model_dump_json())
+        self.assertEqual(payload(async_to_sync(api.list_comments)(self.article.id, cursor=None, limit=5))['items'], [expected])
+
+    def test_plan_defers_unused_user_columns(self):
+        query = str(plan_queryset(Article.objects.all(), ArticleSerializer).query)
+        self.assertIn('"service_customuser"."username"', query)
+        self.assertNotIn('"service_customuser"."password"', query)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, VIEW_BUFFER_FLUSH_SECONDS=3600)
+class ResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.article = Article.objects.create(title='Cached', content='body', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        view_buffer.drain()
+
+    def get_article(self, headers=None):
+        return async_to_sync(api.get_article)(make_request(headers), self.article.id)
+
+    def test_second_read_is_served_from_cache(self):
+        first = self.get_article()
+        with self.assertNumQueries(0):
+            second = self.get_article()
+        self.assertEqual(second.body, first.body)
+        self.assertEqual(second.headers['etag'], first.headers['etag'])
+
+    def test_matching_etag_gets_304(self):
+        etag = self.get_article().headers['etag']
+        response = self.get_article({'If-None-Match': f'W/{etag}'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.body, b'')
+
+    def test_update_invalidates_detail_and_list(self):
+        list_before = payload(async_to_sync(api.list_articles)(make_request(), cursor=None, limit=10))
+        self.get_article()
+        self.article.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.save()
+        self.assertEqual(payload(self.get_article())['title'], 'Renamed')
+        list_after = payload(async_to_sync(api.list_articles)(make_request(), cursor=None, limit=10))
+        self.assertEqual(list_before['items'][0]['title'], 'Cached')
+        self.assertEqual(list_after['items'][0]['title'], 'Renamed')
+
+    def test_new_comment_invalidates_parent_article(self):
+        self.get_article()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(article=self.article, user=self.user, content='hi')
+        with self.assertNumQueries(3):
+            self.get_article()
+
+    def test_delete_invalidates(self):
+        self.get_article()
+        with self.captureOnCommitCallbacks(execute=True):
+            Article.objects.filter(pk=self.article.pk).get().delete()
+        with self.assertRaises(api.HTTPException):
+            self.get_article()
+
+    def test_cache_outage_after_commit_is_logged(self):
+        with mock.patch.object(cache, 'incr', side_effect=ConnectionError), self.assertLogs('django.test', 'ERROR') as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.article.save()
+        self.assertIn('invalidate', logs.output[0])
+
+    def test_invalidation_waits_for_commit(self):
+        self.get_article()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.article.title = 'Renamed'
+            self.article.save()
+            # Still the cached copy until the commit bumps the version.
+            self.assertEqual(payload(self.get_article())['title'], 'Cached')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(payload(self.get_article())['title'], 'Renamed')
+
+    async def test_concurrent_misses_build_once(self):
+        calls = []
+
+        async def build():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return UserSerializer.model_validate(self.user)
+
+        responses = await asyncio.gather(*(
+            cached_response(make_request(), 'single-flight', (), build) for _ in range(5)
+        ))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({response.body for response in responses}), 1)
+
+    async def test_waiters_stop_polling_when_the_build_fails(self):
+        async def build():
+            await asyncio.sleep(0.1)
+            raise api.HTTPException(status_code=404)
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(
+            cached_response(make_request(), 'failing', (), build) for _ in range(3)
+        ), return_exceptions=True)
+        self.assertEqual({result.status_code for result in results}, {404})
+        self.assertLess(time.monotonic() - started, settings.RESPONSE_CACHE_LOCK_TIMEOUT / 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SYNC_EXECUTOR_WORKERS=0, PASSWORD_HASH_PROCESSES=0)
+class TokenCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='writer', email='writer@example.com')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+
+    def resolve(self, key=None):
+        return async_to_sync(get_current_user)(key or self.token.key)
+
+    def test_only_the_first_lookup_hits_the_database(self):
+        before = cache_stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.resolve().pk, self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve().pk, self.user.pk)
+        after = cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['local_hits'] - before['local_hits'], 1)
+
+    def test_shared_tier_serves_other_processes(self):
+        self.resolve()
+        local_tokens.clear()
+        with self.assertNumQueries(0):
+            self.resolve()
+
+    def test_revoked_token_is_rejected(self):
+        key = self.token.key
+        self.resolve(key)
+        Token.objects.get(key=key).delete()
+        with self.assertRaises(api.HTTPException) as raised:
+            self.resolve(key)
+        self.assertEqual(raised.exception.status_code, 401)
+
+    def test_password_reset_revokes_tokens(self):
+        self.resolve()
+        async_to_sync(api.reset_password)(make_request(), 'writer', 'a-new-password')
+        with self.assertRaises(api.HTTPException) as raised:
+            self.resolve()
+        self.assertEqual(raised.exception.status_code, 401)
+        user = self.resolve(Token.objects.create(user=self.user).key)
+        self.assertTrue(user.check_password('a-new-password'))
+
+    def test_unknown_token_is_rejected(self):
+        with self.assertRaises(api.HTTPException):
+            self.resolve('0' * 40)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES, SYNC_EXECUTOR_WORKERS=0, PASSWORD_HASH_PROCESSES=0, AUTH_RATE_PER_USERNAME=2,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class CredentialTests(TestCase):
+    def setUp(self):
+        local_buckets.clear()
+        async_to_sync(api.create_user)(make_request(), api.UserCreate(username='reader', email='reader@example.com', password='s3cret'))
+
+    def login(self, username, password):
+        form = api.OAuth2PasswordRequestForm(username=username, password=password)
+        return async_to_sync(api.login)(make_request(), form)
+
+    def test_signup_and_login(self):
+        self.assertTrue(CustomUser.objects.get(username='reader').check_password('s3cret'))
+        self.assertEqual(self.login('reader', 's3cret')['token_type'], 'bearer')
+        for username, password in (('reader', 'wrong'), ('nobody', 's3cret')):
+            with self.assertRaises(api.HTTPException) as raised:
+                self.login(username, password)
+            self.assertEqual(raised.exception.status_code, 400)
+
+    def test_attempts_per_username_are_limited(self):
+        for _ in range(2):
+            with self.assertRaises(api.HTTPException):
+                self.login('reader', 'wrong')
+        with self.assertRaises(api.HTTPException) as raised:
+            self.login('reader', 's3cret')
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertIn('Retry-After', raised.exception.headers)
+        with self.assertRaises(api.HTTPException) as raised:
+            self.login('someone-else', 'x')
+        self.assertEqual(raised.exception.status_code, 400)
+
+    def test_saturated_hasher_sheds_load(self):
+        with self.settings(PASSWORD_HASH_MAX_PENDING=0), self.assertRaises(HasherBusy):
+            self.login('reader', 's3cret')
+        response = api.hasher_busy_handler(make_request(), HasherBusy())
+        self.assertEqual((response.status_code, response.headers['Retry-After']), (429, '1'))
+
+    @override_settings(PASSWORD_HASH_PROCESSES=1)
+    def test_hashing_in_the_process_pool(self):
+        self.addCleanup(shutdown_pool)
+        # The worker hashes with the project's settings, not this test's.
+        encoded = async_to_sync(hash_password)('pooled')
+        self.assertTrue(PBKDF2PasswordHasher().verify('pooled', encoded))
+
+
+@override_settings(CACHES=NO_CACHES)
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.in_title = Article.objects.create(title='Caching strategies', content='How we speed things up.', author=cls.user)
+        cls.in_body = Article.objects.create(title='Operations', content='Notes on caching and queues.', author=cls.user)
+        cls.faq = FAQ.objects.create(question='Do you cache pages?', answer='Yes, caching is on.', created_by=cls.user)
+        cls.comment = Comment.objects.create(article=cls.in_body, user=cls.user, content='More caching please')
+        outbox.drain()
+
+    def test_title_matches_rank_first_and_are_highlighted(self):
+        hits, _ = search('caching', kind='article')
+        self.assertEqual([hit['id'] for hit in hits], [self.in_title.id, self.in_body.id])
+        self.assertIn('<mark>caching</mark>', hits[1]['snippet'])
+
+    def test_all_kinds_are_indexed_and_paged(self):
+        seen = []
+        cursor = None
+        while True:
+            hits, cursor = search('caching', cursor=cursor, limit=1)
+            seen.extend((hit['kind'], hit['id']) for hit in hits)
+            if cursor is None:
+                break
+        self.assertCountEqual(seen, [
+            ('article', self.in_title.id), ('article', self.in_body.id),
+            ('faq', self.faq.id), ('comment', self.comment.id),
+        ])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.in_title.title = 'Something else'
+        self.in_title.content = 'Nothing relevant'
+        self.in_title.save()
+        self.comment.delete()
+        outbox.drain()
+        kinds = {(hit['kind'], hit['id']) for hit in search('caching')[0]}
+        self.assertNotIn(('article', self.in_title.id), kinds)
+        self.assertNotIn(('comment', self.comment.id), kinds)
+
+    def test_snippets_escape_the_indexed_text(self):
+        comment = Comment.objects.create(article=self.in_body, user=self.user, content='<script>alert(1)</script> caching')
+        outbox.drain()
+        hit = next(hit for hit in search('caching', kind='comment')[0] if hit['id'] == comment.id)
+        self.assertNotIn('<script>', hit['snippet'])
+        self.assertIn('&lt;script&gt;', hit['snippet'])
+        self.assertIn('<mark>caching</mark>', hit['snippet'])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(search('"caching (strategies')[0][0]['id'], self.in_title.id)
+        self.assertEqual(search('***'), ([], None))
+
+
+@override_settings(CACHES=NO_CACHES)
+class TagTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.python = Article.objects.create(title='Python', content='body', author=cls.user)
+        cls.both = Article.objects.create(title='Both', content='body', author=cls.user)
+        cls.django = Article.objects.create(title='Django', content='body', author=cls.user)
+        set_article_tags(cls.python, 'python')
+        set_article_tags(cls.both, ['python', 'django'])
+        set_article_tags(cls.django, 'django')
+
+    def listed(self, tags, match='any'):
+        page = payload(async_to_sync(api.list_articles)(make_request(), cursor=None, limit=20, tag=tags, match=match))
+        return [item['id'] for item in page['items']]
+
+    def counts(self):
+        return dict(Tag.objects.values_list('name', 'article_count'))
+
+    def test_parse_tags(self):
+        self.assertEqual(parse_tags('Python, #Django; python'), ['python', 'django'])
+        self.assertEqual(parse_tags('python  django'), ['python', 'django'])
+        self.assertEqual(parse_tags(['', ' Web ']), ['web'])
+
+    def test_filter_any_and_all(self):
+        self.assertEqual(self.listed(['python']), [self.both.id, self.python.id])
+        self.assertEqual(self.listed(['python', 'django']), [self.django.id, self.both.id, self.python.id])
+        self.assertEqual(self.listed(['python', 'django'], 'all'), [self.both.id])
+        self.assertEqual(self.listed(['missing']), [])
+
+    def test_counts_follow_changes(self):
+        self.assertEqual(self.counts(), {'python': 2, 'django': 2})
+        set_article_tags(self.both, 'django, web')
+        self.assertEqual(self.counts(), {'python': 1, 'django': 2, 'web': 1})
+        self.django.delete()
+        self.assertEqual(self.counts(), {'python': 1, 'django': 1, 'web': 1})
+
+    def test_tag_cloud_and_serialized_tags(self):
+        cloud = async_to_sync(api.tag_cloud)(limit=20)
+        self.assertEqual([(tag.name, tag.article_count) for tag in cloud], [('django', 2), ('python', 2)])
+        article = async_to_sync(api.get_article)(make_request(), self.both.id)
+        self.assertCountEqual(payload(article)['tags'], ['python', 'django'])
+
+
+@override_settings(CACHES=NO_CACHES)
+class FeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.other = CustomUser.objects.create(username='other', email='other@example.com')
+        cls.news = Category.objects.create(name='News')
+        cls.articles = [Article.objects.create(title=f'Post {i}', content='body', author=cls.user) for i in range(5)]
+        Article.objects.create(title='Elsewhere', content='body', author=cls.other)
+        for article in cls.articles[1::2]:
+            article.categories.add(cls.news)
+
+    def pages(self, endpoint, owner_id, limit):
+        ids, cursor = [], None
+        while True:
+            page = payload(async_to_sync(endpoint)(owner_id, cursor=cursor, limit=limit))
+            ids.append([item['id'] for item in page['items']])
+            cursor = page['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_author_feed_pages_newest_first(self):
+        ids = [article.id for article in reversed(self.articles)]
+        self.assertEqual(self.pages(api.author_articles, self.user.id, 2), [ids[:2], ids[2:4], ids[4:]])
+
+    def test_category_feed_follows_assignment(self):
+        self.assertEqual(self.pages(api.category_articles, self.news.id, 5), [[self.articles[3].id, self.articles[1].id]])
+        self.articles[3].categories.remove(self.news)
+        self.articles[4].categories.add(self.news)
+        self.assertEqual(self.pages(api.category_articles, self.news.id, 5), [[self.articles[4].id, self.articles[1].id]])
+
+    def test_published_drafts_go_on_top(self):
+        draft = Article.objects.create(title='Draft', content='body', author=self.user, status=Article.DRAFT)
+        draft.categories.add(self.news)
+        newer = Article.objects.create(title='Newer', content='body', author=self.user)
+        with transaction.atomic():
+            publish([draft.id])
+        self.assertEqual(self.pages(api.author_articles, self.user.id, 1)[:3], [[draft.id], [newer.id], [self.articles[4].id]])
+        self.assertEqual(self.pages(api.category_articles, self.news.id, 5), [[draft.id, self.articles[3].id, self.articles[1].id]])
+
+    def test_articles_published_together_page_by_id(self):
+        drafts = [Article.objects.create(title=f'Draft {i}', content='body', author=self.user, status=Article.DRAFT) for i in range(3)]
+        with transaction.atomic():
+            publish([draft.id for draft in drafts])
+        pages = self.pages(api.author_articles, self.user.id, 2)
+        self.assertEqual(pages[:2], [[drafts[2].id, drafts[1].id], [drafts[0].id, self.articles[4].id]])
+
+    def test_page_is_one_ids_query_and_one_rows_query(self):
+        # Plus one per to-many field of the serializer (tags, categories).
+        with self.assertNumQueries(4):
+            async_to_sync(api.author_articles)(self.user.id, cursor=None, limit=3)
+
+    def test_unknown_owner_is_404(self):
+        for endpoint in (api.author_articles, api.category_articles):
+            with self.assertRaises(api.HTTPException) as raised:
+                async_to_sync(endpoint)(999, cursor=None, limit=3)
+            self.assertEqual(raised.exception.status_code, 404)
+        with self.assertRaises(InvalidCursor):
+            async_to_sync(api.author_articles)(self.user.id, cursor=encode_cursor(['x']), limit=3)
+
+
+@override_settings(CACHES=NO_CACHES)
+class ThreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.article = Article.objects.create(title='Thread', content='body', author=cls.user)
+
+    def reply(self, parent, content):
+        return async_to_sync(api.create_comment)(
+            self.article.id, api.CommentCreate(content=content, parent_id=parent and parent.id), self.user,
+        )
+
+    def setUp(self):
+        self.top = self.reply(None, 'top')
+        self.first, self.second, self.third, self.fourth = (self.reply(self.top, name) for name in ('1', '2', '3', '4'))
+        self.nested = self.reply(self.first, '1.1')
+        self.deepest = self.reply(self.nested, '1.1.1')
+        self.other = self.reply(None, 'other')
+
+    def shape(self, items):
+        return [(item['content'], self.shape(item['replies']), bool(item['replies_cursor'])) for item in items]
+
+    def test_threads_nest_replies_to_the_requested_depth(self):
+        with self.assertNumQueries(3):
+            page = payload(async_to_sync(api.list_comments)(self.article.id, cursor=None, limit=5, depth=2, replies=3))
+        self.assertEqual(self.shape(page['items']), [
+            ('top', [('1', [('1.1', [], True)], False), ('2', [], False), ('3', [], False)], True),
+            ('other', [], False),
+        ])
+        self.assertEqual((page['items'][0]['reply_count'], page['items'][0]['replies'][0]['depth']), (4, 1))
+
+    def test_cursors_load_the_replies_left_out(self):
+        top = payload(async_to_sync(api.list_comments)(self.article.id, cursor=None, limit=5, depth=2, replies=3))['items'][0]
+        more = payload(async_to_sync(api.list_replies)(self.top.id, cursor=top['replies_cursor'], limit=5, depth=0))
+        self.assertEqual([item['id'] for item in more['items']], [self.fourth.id])
+        nested = top['replies'][0]['replies'][0]
+        with self.assertNumQueries(3):
+            deeper = payload(async_to_sync(api.list_replies)(nested['id'], cursor=nested['replies_cursor'], limit=5))
+        self.assertEqual([item['id'] for item in deeper['items']], [self.deepest.id])
+
+    def test_replies_stay_in_their_thread(self):
+        elsewhere = Article.objects.create(title='Other', content='body', author=self.user)
+        with self.assertRaises(api.HTTPException) as raised:
+            async_to_sync(api.create_comment)(elsewhere.id, api.CommentCreate(content='x', parent_id=self.top.id), self.user)
+        self.assertEqual(raised.exception.status_code, 404)
+        with self.settings(COMMENT_MAX_DEPTH=2), self.assertRaises(api.HTTPException) as raised:
+            self.reply(self.nested, 'too deep')
+        self.assertEqual(raised.exception.status_code, 400)
+
+    def test_deleting_a_comment_takes_its_replies(self):
+        results = async_to_sync(api.bulk_delete_comments)(api.BulkDelete(ids=[self.first.id]), self.user)
+        self.assertEqual(results[0]['status'], 200)
+        self.assertFalse(Comment.objects.filter(pk__in=[self.nested.id, self.deepest.id]).exists())
+        self.assertEqual(Comment.objects.get(pk=self.top.id).reply_count, 3)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.comment_count, 5)
+        results = async_to_sync(api.bulk_create_comments)(self.article.id, [
+            api.CommentCreate(content='bulk', parent_id=self.second.id), api.CommentCreate(content='x', parent_id=999),
+        ], self.user)
+        self.assertEqual([result['status'] for result in results], [201, 404])
+        reply = Comment.objects.get(pk=results[0]['id'])
+        self.assertEqual((reply.depth, reply.path), (2, Comment.objects.get(pk=self.second.id).path + f'{reply.id:010d}'))
+        self.assertEqual(Comment.objects.get(pk=self.second.id).reply_count, 1)
+
+
+@override_settings(CACHES=NO_CACHES, BULK_BATCH_SIZE=2)
+class BulkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.other = CustomUser.objects.create(username='other', email='other@example.com')
+        cls.category = Category.objects.create(name='News')
+
+    def create(self, items):
+        return async_to_sync(api.bulk_create_articles)([api.ArticleCreate(**item) for item in items], self.user)
+
+    def test_create_reports_each_item_and_applies_side_effects(self):
+        results = self.create([
+            {'title': 'One', 'content': 'first bulk', 'tags': 'python, web', 'categories': [self.category.id]},
+            {'title': 'Two', 'content': 'second', 'categories': [999]},
+            {'title': 'Three', 'content': 'third bulk', 'tags': ['python']},
+        ])
+        self.assertEqual([(r['index'], r['status']) for r in results], [(0, 201), (1, 400), (2, 201)])
+        one = Article.objects.get(pk=results[0]['id'])
+        self.assertEqual(list(one.categories.all()), [self.category])
+        self.assertEqual(dict(Tag.objects.values_list('name', 'article_count')), {'python': 2, 'web': 1})
+        self.assertEqual({hit['id'] for hit in search('bulk')[0]}, {results[0]['id'], results[2]['id']})
+
+    def test_a_failed_chunk_keeps_its_rejections(self):
+        items = [{'title': 'Bad', 'content': 'x', 'categories': [999]}, {'title': 'Good', 'content': 'x'}]
+        with mock.patch.object(Article.objects, 'bulk_create', side_effect=DatabaseError('down')), self.assertLogs('service.bulk'):
+            results = self.create(items)
+        self.assertEqual([(r['status'], r['error']) for r in results], [(400, 'Unknown categories: [999]'), (500, 'down')])
+        self.assertFalse(Article.objects.exists())
+
+    def test_update_and_delete_only_touch_own_articles(self):
+        ids = [r['id'] for r in self.create([{'title': str(i), 'content': 'x', 'tags': 'a b'} for i in range(3)])]
+        foreign = Article.objects.create(title='Foreign', content='x', author=self.other)
+        updates = [api.ArticleUpdate(id=pk, title='Renamed', content='y', tags='b c') for pk in ids + [foreign.id]]
+        results = async_to_sync(api.bulk_update_articles)(updates, self.user)
+        self.assertEqual([r['status'] for r in results], [200, 200, 200, 404])
+        self.assertEqual(Article.objects.filter(title='Renamed').count(), 3)
+        self.assertEqual(dict(Tag.objects.values_list('name', 'article_count')), {'a': 0, 'b': 3, 'c': 3})
+
+        Comment.objects.create(article_id=ids[0], user=self.other, content='comment')
+        results = async_to_sync(api.bulk_delete_articles)(api.BulkDelete(ids=ids[:2] + [foreign.id]), self.user)
+        self.assertEqual([r['status'] for r in results], [200, 200, 404])
+        self.assertEqual(set(Article.objects.values_list('id', flat=True)), {ids[2], foreign.id})
+        self.assertEqual(Tag.objects.get(name='b').article_count, 1)
+        self.assertFalse(SearchDocument.objects.filter(kind='comment').exists())
+
+    def upload_ndjson(self, *chunks):
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': True} for chunk in chunks]
+        messages[-1]['more_body'] = False
+
+        async def receive():
+            return messages.pop(0)
+
+        async def results():
+            request = Request({'type': 'http', 'method': 'POST', 'path': '/', 'query_string': b'', 'headers': []}, receive)
+            response = await api.bulk_create_articles_ndjson(request, self.user)
+            return [json.loads(line) async for piece in response.body_iterator for line in piece.splitlines()]
+        return async_to_sync(results)()
+
+    def test_ndjson_upload_is_validated_line_by_line(self):
+        lines = [b'{"title": "A", "content": "x"}', b'not json', b'', b'{"title": "B"}', b'{"title": "C", "content": "z"}']
+        results = self.upload_ndjson(b'\n'.join(lines))
+        self.assertEqual([(r['index'], r['status']) for r in results], [(0, 201), (1, 422), (2, 422), (3, 201)])
+        self.assertEqual(Article.objects.count(), 2)
+
+    @override_settings(BULK_MAX_LINE_BYTES=40, BULK_BATCH_SIZE=2)
+    def test_ndjson_lines_are_capped_and_results_streamed_in_order(self):
+        long = b'{"title": "Long", "content": "%s"}' % (b'x' * 40)
+        results = self.upload_ndjson(
+            b'{"title": "A", ', b'"content": "x"}\n' + long[:20], long[20:] + b'\nnot json\n', b'{"title": "B", "content": "y"}',
+        )
+        self.assertEqual([(r['index'], r['status']) for r in results], [(0, 201), (1, 413), (2, 422), (3, 201)])
+        self.assertEqual(sorted(Article.objects.values_list('title', flat=True)), ['A', 'B'])
+
+    def test_comments_and_categories(self):
+        article = Article.objects.create(title='Thread', content='x', author=self.user)
+        results = async_to_sync(api.bulk_create_comments)(article.id, [api.CommentCreate(content=str(i)) for i in range(3)], self.user)
+        self.assertEqual(article.comments.count(), 3)
+        results = async_to_sync(api.bulk_delete_comments)(api.BulkDelete(ids=[r['id'] for r in results]), self.other)
+        self.assertEqual({r['status'] for r in results}, {404})
+        results = async_to_sync(api.bulk_create_categories)([api.CategoryCreate(name='A'), api.CategoryCreate(name='B')], self.user)
+        self.assertEqual([r['status'] for r in results], [201, 201])
+        with self.assertRaises(api.HTTPException):
+            async_to_sync(api.bulk_delete_categories)(api.BulkDelete(ids=[results[0]['id']]), self.user)
+
+
+@override_settings(CACHES=NO_CACHES, SYNC_EXECUTOR_WORKERS=0)
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.articles = [Article.objects.create(title=f'Article {i}', content='body', author=cls.user) for i in range(5)]
+        set_article_tags(cls.articles[0], 'python, web')
+        Article.objects.create(title='Draft', content='body', author=cls.user, status=Article.DRAFT)
+
+    def test_rows_are_streamed_in_chunks_and_resumable(self):
+        async def collect(**kwargs):
+            return [piece async for piece in aexport_articles(chunk_size=2, **kwargs)]
+
+        pieces = async_to_sync(collect)()
+        self.assertEqual(len(pieces), 3)
+        rows = [json.loads(line) for line in ''.join(pieces).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [a.id for a in self.articles])
+        self.assertEqual(rows[0]['tags'], ['python', 'web'])
+        self.assertEqual(rows[0]['author'], 'author')
+        resumed = ''.join(async_to_sync(collect)(after_id=self.articles[2].id)).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in resumed], [a.id for a in self.articles[3:]])
+
+    def test_csv_and_since(self):
+        Article.objects.filter(pk__in=[a.pk for a in self.articles[:3]]).update(published_date='2020-01-01T00:00:00Z')
+        rows = list(csv.DictReader(io.StringIO(''.join(export_articles('csv', since=self.articles[3].published_date)))))
+        self.assertEqual([int(row['id']) for row in rows], [a.id for a in self.articles[3:]])
+        self.assertEqual(rows[0]['tags'], '')
+
+    def test_management_command_appends_to_file(self):
+        handle, path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command('export_articles', output=path, chunk_size=2, after_id=self.articles[1].id)
+        call_command('export_articles', output=path, after_id=self.articles[3].id)
+        with open(path) as output:
+            ids = [json.loads(line)['id'] for line in output]
+        self.assertEqual(ids, [a.id for a in self.articles[2:]] + [self.articles[4].id])
+
+    def test_export_endpoint_is_staff_only(self):
+        with self.assertRaises(api.HTTPException):
+            async_to_sync(api.export_articles)('ndjson', None, None, self.user)
+
+
+@override_settings(CACHES=NO_CACHES)
+class CommentCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.quiet = Article.objects.create(title='Quiet', content='body', author=cls.user)
+        cls.busy = Article.objects.create(title='Busy', content='body', author=cls.user)
+
+    def test_counts_follow_creates_and_deletes(self):
+        first = Comment.objects.create(article=self.busy, user=self.user, content='1')
+        second = Comment.objects.create(article=self.busy, user=self.user, content='2')
+        self.busy.refresh_from_db()
+        self.assertEqual((self.busy.comment_count, self.busy.last_commented_at), (2, second.created_at))
+        second.delete()
+        self.busy.refresh_from_db()
+        self.assertEqual((self.busy.comment_count, self.busy.last_commented_at), (1, first.created_at))
+
+    def test_bulk_comments_are_counted(self):
+        results = async_to_sync(api.bulk_create_comments)(self.busy.id, [api.CommentCreate(content=str(i)) for i in range(3)], self.user)
+        async_to_sync(api.bulk_delete_comments)(api.BulkDelete(ids=[results[0]['id']]), self.user)
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.comment_count, 2)
+        self.assertIsNotNone(self.busy.last_commented_at)
+
+    def test_most_discussed_sort(self):
+        Comment.objects.create(article=self.quiet, user=self.user, content='1')
+        for i in range(2):
+            Comment.objects.create(article=self.busy, user=self.user, content=str(i))
+        page = payload(async_to_sync(api.list_articles)(make_request(), cursor=None, limit=1, sort='most_discussed'))
+        self.assertEqual([(a['id'], a['comment_count']) for a in page['items']], [(self.busy.id, 2)])
+        page = payload(async_to_sync(api.list_articles)(make_request(), cursor=page['next_cursor'], limit=1, sort='most_discussed'))
+        self.assertEqual([a['id'] for a in page['items']], [self.quiet.id])
+
+    def test_reconcile_repairs_drift(self):
+        comment = Comment.objects.create(article=self.busy, user=self.user, content='1')
+        Article.objects.filter(pk=self.busy.pk).update(comment_count=7, last_commented_at=None)
+        Article.objects.filter(pk=self.quiet.pk).update(comment_count=3)
+        self.assertEqual(reconcile_comment_counts(), 2)
+        self.assertEqual(
+            list(Article.objects.order_by('pk').values_list('comment_count', 'last_commented_at')),
+            [(0, None), (1, comment.created_at)],
+        )
+        self.assertEqual(reconcile_comment_counts(), 0)
+
+
+@override_settings(CACHES=NO_CACHES, SYNC_EXECUTOR_WORKERS=0, VIEW_BUFFER_MAX_PENDING=3, VIEW_BUFFER_FLUSH_SECONDS=3600)
+class ViewCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.popular = Article.objects.create(title='Popular', content='body', author=cls.user)
+        cls.other = Article.objects.create(title='Other', content='body', author=cls.user)
+
+    def setUp(self):
+        view_buffer.drain()
+
+    def view(self, article):
+        async_to_sync(api.get_article)(make_request(), article.id)
+
+    def test_views_are_written_in_batches(self):
+        # A read is three queries; only the view that completes a batch adds one.
+        self.view(self.popular)
+        with self.assertNumQueries(3):
+            self.view(self.popular)
+        self.popular.refresh_from_db()
+        self.assertEqual(self.popular.view_count, 0)
+        with self.assertNumQueries(4):
+            self.view(self.other)
+        self.assertEqual(dict(Article.objects.values_list('id', 'view_count')), {self.popular.id: 2, self.other.id: 1})
+
+    def test_views_survive_a_redis_outage(self):
+        unreachable = mock.Mock()
+        unreachable.pipeline.return_value.execute.side_effect = RedisConnectionError
+        with mock.patch('service.viewcounts.get_redis', return_value=unreachable), self.assertLogs('service.viewcounts', 'WARNING'):
+            for article in (self.popular, self.popular, self.other):
+                self.view(article)
+        self.assertEqual(dict(Article.objects.values_list('id', 'view_count')), {self.popular.id: 2, self.other.id: 1})
+
+    def test_missing_articles_are_not_counted(self):
+        with self.assertRaises(api.HTTPException):
+            async_to_sync(api.get_article)(make_request(), 999)
+        self.assertEqual(view_buffer.pending, 0)
+
+    def test_trending_without_redis_falls_back_to_total_views(self):
+        for article in (self.other, self.other, self.popular):
+            self.view(article)
+        Article.objects.create(title='Draft', content='body', author=self.user, status=Article.DRAFT, view_count=10)
+        trending = payload(async_to_sync(api.trending_articles)(limit=2))
+        self.assertEqual([(a['id'], a['view_count']) for a in trending], [(self.other.id, 2), (self.popular.id, 1)])
+
+    def test_decay_halves_per_half_life(self):
+        self.assertEqual(decay_factor(0, 60), 1.0)
+        self.assertAlmostEqual(decay_factor(120, 60), 0.25)
+
+
+@override_settings(CACHES=NO_CACHES, OUTBOX_MAX_ATTEMPTS=3, OUTBOX_RETRY_BASE_SECONDS=10)
+class OutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+
+    def setUp(self):
+        self.calls = []
+        outbox.HANDLERS['test.flaky'] = self.flaky
+        self.addCleanup(outbox.HANDLERS.pop, 'test.flaky')
+
+    def flaky(self, payload):
+        self.calls.append(payload)
+        raise RuntimeError('downstream unavailable')
+
+    def test_saves_coalesce_into_one_pending_event(self):
+        article = Article.objects.create(title='Draft', content='outbox body', author=self.user)
+        article.title = 'Final'
+        article.save()
+        event = OutboxEvent.objects.get(topic='search.sync')
+        self.assertEqual((event.status, event.payload), ('pending', {'kind': 'article', 'id': article.id}))
+        self.assertFalse(SearchDocument.objects.exists())
+        self.assertGreater(tasks.drain_outbox.apply().get(), 1)
+        self.assertEqual(search('final')[0][0]['id'], article.id)
+        self.assertEqual(OutboxEvent.objects.get(topic='search.sync').status, 'done')
+
+    def test_rolled_back_writes_leave_no_event(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Article.objects.create(title='Gone', content='x', author=self.user)
+            raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_deletes_remove_the_document(self):
+        article = Article.objects.create(title='Temporary', content='x', author=self.user)
+        outbox.drain()
+        article.delete()
+        outbox.drain()
+        self.assertFalse(SearchDocument.objects.exists())
+
+    def test_failures_back_off_then_dead_letter(self):
+        outbox.enqueue('test.flaky', {'n': 1})
+        with self.assertLogs('service.outbox', 'ERROR') as logs:
+            outbox.drain()
+            event = OutboxEvent.objects.get()
+            self.assertEqual((event.status, event.attempts), ('pending', 1))
+            self.assertIn('downstream unavailable', event.last_error)
+            # Not due again until the backoff has passed.
+            outbox.drain()
+            self.assertEqual(len(self.calls), 1)
+            for _ in range(2):
+                OutboxEvent.objects.update(available_at=event.created_at)
+                outbox.drain()
+        self.assertIn('dead-lettered after 3 attempts', logs.output[-1])
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts, len(self.calls)), ('dead', 3, 3))
+
+        outbox.HANDLERS['test.flaky'] = self.calls.append
+        self.assertEqual(outbox.retry(OutboxEvent.objects.all()), 1)
+        outbox.drain()
+        self.assertEqual(OutboxEvent.objects.get().status, 'done')
+
+
+@override_settings(CACHES=LOCMEM_CACHES, SYNC_EXECUTOR_WORKERS=0, SITEMAP_SHARD_SIZE=2, SITE_URL='https://blog.example')
+class SyndicationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.articles = [Article.objects.create(title=f'Post {i}', content='body', author=cls.user) for i in range(3)]
+        set_article_tags(cls.articles[0], 'python, cache')
+
+    def setUp(self):
+        cache.clear()
+        outbox.drain()
+
+    def get(self, endpoint, *args, **headers):
+        return async_to_sync(endpoint)(make_request(headers), *args)
+
+    def rendered(self):
+        names = [event.payload['name'] for event in OutboxEvent.objects.filter(topic='syndication.render', status='pending')]
+        outbox.drain()
+        return sorted(names)
+
+    def test_feeds_answer_repeat_polls_with_304_from_the_cache(self):
+        response = self.get(api.rss_feed)
+        self.assertEqual(response.media_type, 'application/rss+xml; charset=utf-8')
+        self.assertIn(b'<title>Post 2</title>', response.body)
+        self.assertIn(b'<category>python</category>', response.body)
+        self.assertIn(b'<link>https://blog.example/articles/%d/</link>' % self.articles[0].id, response.body)
+        self.assertIn(b'term="cache"', self.get(api.atom_feed).body)
+        with self.assertNumQueries(0):
+            revalidated = self.get(api.rss_feed, **{'If-None-Match': response.headers['ETag']})
+            since = self.get(api.rss_feed, **{'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual((revalidated.status_code, since.status_code), (304, 304))
+
+    def test_sitemap_is_sharded_by_id(self):
+        index = self.get(api.sitemap_index).body.decode()
+        shards = sorted({article.id // 2 for article in self.articles})
+        self.assertEqual(index.count('<sitemap>'), len(shards))
+        shard = self.get(api.sitemap_shard, shards[0]).body.decode()
+        self.assertIn('<loc>https://blog.example/articles/', shard)
+        with self.assertRaises(api.HTTPException):
+            self.get(api.sitemap_shard, shards[-1] + 1)
+
+    def test_changes_render_only_the_documents_they_affect(self):
+        article = self.articles[1]
+        article.title = 'Renamed'
+        article.save()
+        self.assertEqual(self.rendered(), ['atom', 'rss'])
+        self.assertIn(b'Renamed', self.get(api.rss_feed).body)
+        index_renders = OutboxEvent.objects.filter(payload={'name': 'sitemap'})
+        before = index_renders.count()
+        shard = f'sitemap-{article.id // 2}'
+        article.delete()
+        self.assertEqual(self.rendered(), ['atom', 'rss', shard])
+        # The shard changed, so the same drain rendered the index as well.
+        self.assertEqual(self.rendered(), [])
+        self.assertEqual(index_renders.filter(status='done').count(), before + 1)
+
+
+@override_settings(CACHES=NO_CACHES)
+class PublishingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+
+    def create(self, title, **fields):
+        article = api.ArticleCreate(title=title, content=f'{title} body', **fields)
+        return async_to_sync(api.create_article)(article, self.user)
+
+    def public_ids(self):
+        page = payload(async_to_sync(api.list_articles)(make_request(), cursor=None, limit=20))
+        return [item['id'] for item in page['items']]
+
+    def test_drafts_stay_private_until_published(self):
+        draft = self.create('Draft', status='draft')
+        self.assertEqual(self.public_ids(), [])
+        for call in (
+            lambda: async_to_sync(api.get_article)(make_request(), draft.id),
+            lambda: async_to_sync(api.create_comment)(draft.id, api.CommentCreate(content='early'), self.user),
+        ):
+            with self.assertRaises(api.HTTPException) as raised:
+                call()
+            self.assertEqual(raised.exception.status_code, 404)
+        drafts = payload(async_to_sync(api.list_drafts)(cursor=None, limit=10, user=self.user))
+        self.assertEqual([item['status'] for item in drafts['items']], ['draft'])
+        outbox.drain()
+        self.assertFalse(SearchDocument.objects.filter(kind='article', object_id=draft.id).exists())
+
+        # A draft edited without a status stays a draft.
+        async_to_sync(api.update_article)(draft.id, api.ArticleCreate(title='Draft', content='edited'), self.user)
+        self.assertEqual(Article.objects.get(pk=draft.id).status, 'draft')
+        published = async_to_sync(api.update_article)(
+            draft.id, api.ArticleCreate(title='Out', content='edited', status='published'), self.user,
+        )
+        self.assertEqual(published.status, 'published')
+        self.assertGreater(published.published_date, draft.published_date)
+        self.assertEqual(self.public_ids(), [draft.id])
+        outbox.drain()
+        self.assertTrue(SearchDocument.objects.filter(kind='article', object_id=draft.id).exists())
+
+    @override_settings(PUBLISH_BATCH_SIZE=1)
+    def test_scheduled_articles_go_out_when_due(self):
+        with self.assertRaises(ValidationError):
+            api.ArticleCreate(title='No time', content='body', status='scheduled')
+        now = timezone.now()
+        due = [self.create(f'Due {i}', status='scheduled', publish_at=now - timedelta(minutes=i)) for i in range(2)]
+        later = self.create('Later', status='scheduled', publish_at=now + timedelta(hours=1))
+        self.assertEqual(tasks.publish_scheduled_articles(), 2)
+        self.assertEqual(sorted(self.public_ids()), sorted(article.id for article in due))
+        self.assertEqual(Article.objects.get(pk=later.id).status, 'scheduled')
+        self.assertEqual(tasks.publish_scheduled_articles(), 0)
+
+    def test_published_articles_cannot_be_unpublished(self):
+        article = self.create('Live')
+        with self.assertRaises(api.HTTPException) as raised:
+            async_to_sync(api.update_article)(
+                article.id, api.ArticleCreate(title='Live', content='body', status='draft'), self.user,
+            )
+        self.assertEqual(raised.exception.status_code, 400)
+        draft = self.create('Draft', status='draft')
+        results = async_to_sync(api.bulk_update_articles)([
+            api.ArticleUpdate(id=article.id, title='Live', content='body', status='draft'),
+            api.ArticleUpdate(id=draft.id, title='Draft', content='body', status='published'),
+        ], self.user)
+        self.assertEqual([result['status'] for result in results], [400, 200])
+        self.assertEqual(sorted(self.public_ids()), sorted([article.id, draft.id]))
+
+
+@override_settings(CACHES=NO_CACHES, REVISION_KEYFRAME_INTERVAL=4)
+class RevisionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+
+    def edit(self, article_id, content, title='Long read'):
+        async_to_sync(api.update_article)(article_id, api.ArticleCreate(title=title, content=content), self.user)
+
+    def revision(self, article_id, number):
+        return async_to_sync(api.get_revision)(article_id, number, self.user)
+
+    def test_edits_are_stored_as_deltas_between_keyframes(self):
+        sentences = [f'Sentence number {i} says something new.' for i in range(300)]
+        versions = ['\n\n'.join(sentences)]
+        article = async_to_sync(api.create_article)(api.ArticleCreate(title='Long read', content=versions[0]), self.user)
+        for i in range(1, 9):
+            sentences[i * 30] = f'Edit {i} rewrote this one!'
+            versions.append('\n\n'.join(sentences))
+            self.edit(article.id, versions[-1])
+        self.edit(article.id, versions[-1])  # unchanged, so not recorded
+
+        revisions = list(ArticleRevision.objects.filter(article_id=article.id).order_by('number'))
+        self.assertEqual([revision.keyframe for revision in revisions], [1, 1, 1, 1, 5, 5, 5, 5, 9])
+        full = len(revisions[0].data)
+        self.assertTrue(all(len(revision.data) < full / 10 for revision in revisions[1:4]))
+        for number, content in enumerate(versions, 1):
+            with self.assertNumQueries(2):
+                revision = self.revision(article.id, number)
+            self.assertEqual((revision.number, revision.content), (number, content))
+        page = payload(async_to_sync(api.list_revisions)(article.id, cursor=None, limit=3, user=self.user))
+        self.assertEqual([item['number'] for item in page['items']], [9, 8, 7])
+        with self.assertRaises(api.HTTPException):
+            self.revision(article.id, 10)
+
+    def test_changes_made_outside_the_history_start_a_keyframe(self):
+        article = async_to_sync(api.create_article)(api.ArticleCreate(title='Long read', content='One. Two.'), self.user)
+        Article.objects.filter(pk=article.id).update(content='Changed elsewhere.')
+        self.edit(article.id, 'Changed elsewhere. Then here.')
+        latest = ArticleRevision.objects.get(article_id=article.id, number=2)
+        self.assertEqual(latest.keyframe, 2)
+        self.assertEqual(self.revision(article.id, 2).content, 'Changed elsewhere. Then here.')
+        self.assertEqual(patch('a. b.\nc', diff('a. b.\nc', 'b.\nc? d')), 'b.\nc? d')
+
+
+@override_settings(CACHES=NO_CACHES, SYNC_EXECUTOR_WORKERS=0)
+class NotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.readers = [CustomUser.objects.create(username=f'reader{i}', email=f'reader{i}@example.com') for i in range(3)]
+
+    def follow(self, reader, author=None):
+        return async_to_sync(api.follow_author)((author or self.author).id, reader)
+
+    def publish(self, title, **fields):
+        article = api.ArticleCreate(title=title, content=f'{title} body', **fields)
+        return async_to_sync(api.create_article)(article, self.author)
+
+    def inbox(self, user, cursor=None, limit=20):
+        return payload(async_to_sync(api.list_notifications)(cursor=cursor, limit=limit, user=user))
+
+    def unread(self, user):
+        return async_to_sync(api.unread_notifications)(user)['unread']
+
+    def test_articles_fan_out_to_followers_in_batches(self):
+        for reader in self.readers:
+            self.assertEqual(self.follow(reader), {'message': 'Following'})
+        self.assertEqual(self.follow(self.readers[0]), {'message': 'Already following'})
+        with self.assertRaises(api.HTTPException) as raised:
+            self.follow(self.author)
+        self.assertEqual(raised.exception.status_code, 400)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.follower_count, 3)
+
+        article = self.publish('Hello')
+        draft = self.publish('Later', status='draft')
+        # Nothing is delivered while the article is saved.
+        self.assertFalse(Notification.objects.exists())
+        with self.settings(NOTIFY_BATCH_SIZE=2):
+            outbox.drain()
+        self.assertEqual(OutboxEvent.objects.filter(topic='notify.article').count(), 2)
+        for reader in self.readers:
+            items = self.inbox(reader)['items']
+            self.assertEqual([(item['kind'], item['article'], item['actor']['id'], item['unread']) for item in items], [
+                ('article', {'id': article.id, 'title': 'Hello'}, self.author.id, True),
+            ])
+            self.assertEqual(self.unread(reader), 1)
+
+        async_to_sync(api.unfollow_author)(self.author.id, self.readers[2])
+        with transaction.atomic():
+            publish([draft.id])
+        outbox.drain()
+        self.assertEqual([item['article']['id'] for item in self.inbox(self.readers[0])['items']], [draft.id, article.id])
+        self.assertEqual(len(self.inbox(self.readers[2])['items']), 1)
+
+    @override_settings(NOTIFY_FANOUT_MAX_FOLLOWERS=1)
+    def test_articles_of_big_authors_are_read_from_one_broadcast(self):
+        reader, other, late = self.readers
+        self.follow(reader)
+        self.follow(other)
+        first = self.publish('First')
+        second = self.publish('Second')
+        article = Article.objects.create(title='Mine', content='body', author=reader)
+        Comment.objects.create(article=article, user=self.author, content='Nice')
+        outbox.drain()
+        self.follow(late)
+        self.assertEqual(Notification.objects.filter(recipient=None).count(), 2)
+        self.assertEqual(Notification.objects.filter(recipient__isnull=False).count(), 1)
+        # A delivery that runs again finds the broadcast already there.
+        notifications.fan_out_article({'article_id': first.id, 'after': 0})
+        self.assertEqual(Notification.objects.filter(recipient=None).count(), 2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Notification.objects.create(kind=Notification.ARTICLE, actor=self.author, article_id=first.id)
+
+        # The broadcasts and the reader's own notification page together.
+        items, cursor = [], None
+        while True:
+            page = self.inbox(reader, cursor, limit=1)
+            items += page['items']
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual([(item['kind'], item['article']['id']) for item in items], [
+            ('comment', article.id), ('article', second.id), ('article', first.id),
+        ])
+        self.assertEqual(self.unread(reader), 3)
+        self.assertEqual([item['article']['id'] for item in self.inbox(other)['items']], [second.id, first.id])
+        self.assertEqual(self.inbox(late)['items'], [])
+
+        self.assertEqual(async_to_sync(api.read_notifications)(reader), {'unread': 0})
+        self.assertFalse(any(item['unread'] for item in self.inbox(reader)['items']))
+        self.assertEqual(self.unread(other), 2)
+
+    def test_comments_notify_the_author_they_answer(self):
+        reader = self.readers[0]
+        article = self.publish('Discuss')
+        create = async_to_sync(api.create_comment)
+        comment = create(article.id, api.CommentCreate(content='First!'), reader)
+        reply = create(article.id, api.CommentCreate(content='Thanks', parent_id=comment.id), self.author)
+        create(article.id, api.CommentCreate(content='Also me', parent_id=comment.id), reader)
+        [again] = async_to_sync(api.bulk_create_comments)(article.id, [api.CommentCreate(content='Again', parent_id=reply.id)], reader)
+        outbox.drain()
+        self.assertEqual([(item['kind'], item['comment_id']) for item in self.inbox(self.author)['items']], [
+            ('reply', again['id']), ('comment', comment.id),
+        ])
+        self.assertEqual([(item['kind'], item['actor']['id']) for item in self.inbox(reader)['items']], [
+            ('reply', self.author.id),
+        ])
+
+
+@override_settings(CACHES=NO_CACHES)
+class ArticleBodyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='author', email='author@example.com')
+        cls.content = ' '.join(f'Paragraph {i} goes on at length about caching.' for i in range(500))
+        cls.article = Article.objects.create(title='Long read', content=cls.content, author=cls.user)
+
+    def test_listings_show_an_excerpt_and_never_read_the_content(self):
+        with CaptureQueriesContext(connection) as ctx:
+            page = payload(async_to_sync(api.list_articles)(make_request(), cursor=None, limit=10))
+        item = page['items'][0]
+        self.assertNotIn('content', item)
+        self.assertTrue(item['excerpt'].startswith('Paragraph 0 goes on'))
+        self.assertTrue(item['excerpt'].endswith('…'))
+        self.assertLessEqual(len(item['excerpt']), 281)
+        self.assertFalse(any('"content"' in query['sql'] for query in ctx.captured_queries))
+        self.assertEqual(payload(async_to_sync(api.get_article)(make_request(), self.article.id))['content'], self.content)
+
+    def test_sparse_fieldsets(self):
+        page = payload(async_to_sync(api.list_articles)(make_request(), cursor=None, limit=10, fields='title,content'))
+        self.assertEqual(page['items'], [{'id': self.article.id, 'title': 'Long read', 'content': self.content}])
+        page = payload(async_to_sync(api.author_articles)(self.user.id, cursor=None, limit=10, fields='tags'))
+        self.assertEqual(page['items'], [{'id': self.article.id, 'tags': []}])
+        with self.assertRaises(api.HTTPException) as raised:
+            async_to_sync(api.list_articles)(make_request(), cursor=None, limit=10, fields='title,secret')
+        self.assertEqual(raised.exception.status_code, 400)
+
+    def stored(self, article):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT content FROM service_article WHERE id = %s', [article.id])
+            return bytes(cursor.fetchone()[0])
+
+    @unittest.skipUnless(fields.zstandard, 'zstandard is not installed')
+    def test_long_bodies_are_stored_compressed(self):
+        stored = self.stored(self.article)
+        self.assertTrue(stored.startswith(fields.ZSTD_MAGIC))
+        self.assertLess(len(stored), len(self.content) / 10)
+        self.assertEqual(Article.objects.values_list('content', flat=True).get(pk=self.article.id), self.content)
+        short = Article.objects.create(title='Short', content='Brief.', author=self.user)
+        self.assertEqual(self.stored(short), b'Brief.')
+        with self.settings(COMPRESSED_TEXT_MIN_BYTES=0):
+            self.article.save()
+        self.assertEqual(self.stored(self.article), self.content.encode())
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.content, self.content)
+
+async def instrumented_endpoint(scope, receive, send):
+    scope['route'] = SimpleNamespace(path='/things/{thing_id}/')
+    await sync_to_async(lambda: (list(Tag.objects.all()), list(Category.objects.all())))()
+    record_cache(hit=True)
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'12345'})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PROFILE_SAMPLE_RATE=0, METRICS_TOKEN='')
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profiles.cleanup)
+
+    def call(self, query_string=b'', headers=()):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/things/7/', 'query_string': query_string, 'headers': list(headers)}
+        with self.settings(PROFILE_DIR=self.profiles.name):
+            async_to_sync(MetricsMiddleware(instrumented_endpoint))(scope, None, send)
+        return dict(sent[0]['headers'])
+
+    def test_requests_are_recorded_per_route(self):
+        self.call()
+        self.call()
+        text = async_to_sync(api.metrics)(make_request()).body.decode()
+        labels = 'method="GET",route="/things/{thing_id}/"'
+        self.assertIn(f'http_requests_total{{{labels},status="200"}} 2', text)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', text)
+        self.assertIn(f'http_request_db_queries_bucket{{{labels},le="1"}} 0', text)
+        self.assertIn(f'http_request_db_queries_bucket{{{labels},le="2"}} 2', text)
+        self.assertIn(f'http_response_cache_total{{{labels},result="hit"}} 2', text)
+        self.assertIn(f'http_response_bytes_total{{{labels}}} 10', text)
+
+    def test_metrics_token(self):
+        with self.settings(METRICS_TOKEN='scrape'):
+            with self.assertRaises(api.HTTPException):
+                async_to_sync(api.metrics)(make_request())
+            response = async_to_sync(api.metrics)(make_request({'Authorization': 'Bearer scrape'}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_staff_can_ask_for_a_profile(self):
+        staff = CustomUser.objects.create(username='staff', email='staff@example.com', is_staff=True)
+        token = Token.objects.create(user=staff)
+        self.assertNotIn(b'x-profile-id', self.call(b'profile=1'))
+        with self.assertLogs('service.middleware', 'INFO'):
+            headers = self.call(b'profile=1', [(b'authorization', f'Bearer {token.key}'.encode())])
+        profile_id = headers[b'x-profile-id'].decode()
+        with self.settings(PROFILE_DIR=self.profiles.name):
+            response = async_to_sync(api.get_profile)(profile_id, staff)
+        self.assertEqual(response.media_type, 'text/plain')
+
+    def test_sampler_collects_collapsed_stacks(self):
+        sampler = Sampler([threading.get_ident()])
+        sampler.start()
+        deadline = time.monotonic() + 0.05
+        while time.monotonic() < deadline:
+            pass
+        stacks = sampler.stop()
+        innermost = {stack.rsplit(';', 1)[-1] for stack in stacks}
+        self.assertTrue(any(frame.startswith('test_sampler_collects_collapsed_stacks (service/tests.py:') for frame in innermost))
+
+
+def respond(*chunks, content_type=b'application/json'):
+    async def endpoint(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', content_type), (b'content-length', str(sum(map(len, chunks))).encode()), (b'etag', b'"v1"'),
+        ]})
+        for i, chunk in enumerate(chunks):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': i < len(chunks) - 1})
+    return endpoint
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionTests(TestCase):
+    body = json.dumps([{'id': i, 'title': f'Article {i}'} for i in range(50)]).encode()
+
+    def call(self, endpoint, accept_encoding):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'headers': [(b'accept-encoding', accept_encoding)]}
+        async_to_sync(CompressionMiddleware(endpoint))(scope, None, send)
+        self.chunks = [message['body'] for message in sent[1:]]
+        return dict(sent[0]['headers']), b''.join(self.chunks)
+
+    def test_large_responses_are_gzipped_for_clients_that_accept_it(self):
+        headers, body = self.call(respond(self.body), b'gzip, deflate')
+        self.assertEqual(headers[b'content-encoding'], b'gzip')
+        self.assertEqual(headers[b'vary'], b'Accept-Encoding')
+        self.assertEqual(headers[b'etag'], b'W/"v1"')
+        self.assertEqual(int(headers[b'content-length']), len(body))
+        self.assertLess(len(body), len(self.body) / 2)
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), self.body)
+        for endpoint, accept in ((respond(b'{}'), b'gzip'), (respond(self.body, content_type=b'image/png'), b'gzip'),
+                                 (respond(self.body), b'identity'), (respond(self.body), b'gzip;q=0')):
+            headers, body = self.call(endpoint, accept)
+            self.assertNotIn(b'content-encoding', headers)
+
+    def test_streams_are_compressed_chunk_by_chunk(self):
+        chunks = [self.body[:10], self.body[10:500], self.body[500:]]
+        headers, body = self.call(respond(*chunks, content_type=b'application/x-ndjson'), b'gzip')
+        self.assertNotIn(b'content-length', headers)
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), self.body)
+        # Each chunk decodes as it arrives rather than when the stream ends.
+        self.assertEqual(zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(self.chunks[0]), chunks[0])
+
+    @unittest.skipUnless(middleware.brotli, 'brotli is not installed')
+    def test_brotli_is_preferred_when_installed(self):
+        headers, body = self.call(respond(self.body), b'gzip, br')
+        self.assertEqual(headers[b'content-encoding'], b'br')
+        self.assertEqual(middleware.brotli.decompress(body), self.body)
+        headers, _ = self.call(respond(self.body), b'br;q=0.5, gzip')
+        self.assertEqual(headers[b'content-encoding'], b'gzip')
+
+
+def image_bytes(size=(1200, 800), format='PNG'):
+    image = Image.effect_noise(size, 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+
+@override_settings(CACHES=NO_CACHES, SYNC_EXECUTOR_WORKERS=0)
+class MediaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='photographer', email='photographer@example.com')
+        cls.png = image_bytes()
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        media_root = self.settings(MEDIA_ROOT=self.root)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def upload(self, data, field='file', filename='photo.png'):
+        body = (
+            f'--xyz\r\nContent-Disposition: form-data; name="caption"\r\n\r\nA photo\r\n'
+            f'--xyz\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + data + b'\r\n--xyz--\r\n'
+        # Delivered in small chunks, as a slow client would send it.
+        chunks = [body[i:i + 1000] for i in range(0, len(body), 1000)]
+
+        async def receive():
+            chunk = chunks.pop(0)
+            return {'type': 'http.request', 'body': chunk, 'more_body': bool(chunks)}
+
+        request = Request({
+            'type': 'http', 'method': 'POST', 'path': '/uploads/', 'query_string': b'',
+            'headers': [(b'content-type', b'multipart/form-data; boundary=xyz'), (b'content-length', str(len(body)).encode())],
+        }, receive)
+        return async_to_sync(api.upload_media)(request, user=self.user).model_dump(mode='json')
+
+    def files(self):
+        return sorted(os.path.relpath(os.path.join(path, name), self.root) for path, _, names in os.walk(self.root) for name in names)
+
+    def test_uploads_are_stored_once_by_content_hash(self):
+        first = self.upload(self.png)
+        sha256 = hashlib.sha256(self.png).hexdigest()
+        self.assertEqual(first['sha256'], sha256)
+        self.assertEqual(first['url'], f'/media/{sha256[:2]}/{sha256}.png')
+        self.assertEqual((first['content_type'], first['size'], first['status']), ('image/png', len(self.png), 'pending'))
+        again = self.upload(self.png, filename='copy.png')
+        self.assertEqual(again['id'], first['id'])
+        self.assertEqual(self.files(), [f'{sha256[:2]}/{sha256}.png'])
+        with open(os.path.join(self.root, self.files()[0]), 'rb') as file:
+            self.assertEqual(file.read(), self.png)
+        self.assertEqual(MediaFile.objects.count(), 1)
+        self.assertEqual(OutboxEvent.objects.filter(topic='media.process').count(), 1)
+
+    def test_the_worker_writes_webp_variants(self):
+        uploaded = self.upload(self.png)
+        outbox.drain()
+        processed = async_to_sync(api.get_media)(uploaded['id']).model_dump(mode='json')
+        self.assertEqual((processed['status'], processed['width'], processed['height']), ('ready', 1200, 800))
+        variants = processed['variants']
+        self.assertEqual(sorted(variants), ['480w', '960w', 'thumbnail'])
+        self.assertEqual((variants['960w']['width'], variants['960w']['height']), (960, 640))
+        self.assertEqual((variants['thumbnail']['width'], variants['thumbnail']['height']), (200, 200))
+        for variant in variants.values():
+            self.assertEqual(variant['content_type'], 'image/webp')
+            self.assertTrue(variant['url'].endswith('.webp'))
+            with open(os.path.join(self.root, variant['url'][len('/media/'):]), 'rb') as file:
+                data = file.read()
+            self.assertEqual((media.sniff(data[:16]), len(data)), (media.WEBP, variant['size']))
+        self.assertEqual(len(self.files()), 4)
+
+    def test_rejected_uploads_leave_nothing_behind(self):
+        cases = [
+            (dict(data=b'just some text'), 415),
+            (dict(data=self.png, field='attachment'), 400),
+        ]
+        for kwargs, status_code in cases:
+            with self.assertRaises(media.UploadRejected) as raised:
+                self.upload(**kwargs)
+            self.assertEqual(raised.exception.status_code, status_code)
+        with self.settings(MEDIA_MAX_UPLOAD_BYTES=5000), self.assertRaises(media.UploadRejected) as raised:
+            self.upload(self.png)
+        self.assertEqual(raised.exception.status_code, 413)
+        self.assertEqual(self.files(), [])
+        self.assertFalse(MediaFile.objects.exists())
+
+    def test_undecodable_images_are_marked_failed(self):
+        uploaded = self.upload(b'\x89PNG\r\n\x1a\n' + b'not really' * 10)
+        outbox.drain()
+        self.assertEqual(MediaFile.objects.get(pk=uploaded['id']).status, MediaFile.FAILED)
+        self.assertFalse(OutboxEvent.objects.filter(status=OutboxEvent.DEAD).exists())
+
+    def test_media_is_served_as_immutable(self):
+        os.makedirs(os.path.join(self.root, 'ab'))
+        os.makedirs(os.path.join(self.root, '.uploads'))
+        for name in ('ab/abc.png', '.uploads/partial'):
+            with open(os.path.join(self.root, name), 'wb') as file:
+                file.write(self.png)
+        files = media.MediaFiles(directory=self.root)
+
+        def get(path):
+            sent = []
+
+            async def receive():
+                await asyncio.Event().wait()
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': path, 'root_path': '', 'query_string': b'', 'headers': []}
+            async_to_sync(files)(scope, receive, send)
+            return sent[0]['status'], dict(sent[0]['headers'])
+
+        status_code, headers = get('/ab/abc.png')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(headers[b'cache-control'], b'public, max-age=31536000, immutable')
+        self.assertEqual(headers[b'content-type'], b'image/png')
+        # Raised for the application's exception handling to answer.
+        with self.assertRaises(StarletteHTTPException) as raised:
+            get('/.uploads/partial')
+        self.assertEqual(raised.exception.status_code, 404)
+
+
+@override_settings(CACHES=NO_CACHES)
+class ApplicationTests(TestCase):
+    def test_one_application_serves_the_api_and_the_site(self):
+        import httpx
+        from bloggin_system.asgi import application
+
+        async def requests():
+            async with application.router.lifespan_context(application):
+                transport = httpx.ASGITransport(app=application)
+                async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+                    return [(await client.get(path)).status_code for path in ('/metrics', '/', '/docs')]
+
+        with self.assertLogs('service.lifespan', 'INFO'):
+            self.assertEqual(async_to_sync(requests)(), [200, 200, 200])
+
+
+@override_settings(DATABASE_REPLICAS=['replica0'], READ_YOUR_WRITES_SECONDS=5)
+class ReadRoutingTests(TestCase):
+    def route(self, method, cookie=None, write=False):
+        """(read alias before a write, read alias after it, response headers)."""
+        seen = []
+        sent = []
+
+        async def endpoint(scope, receive, send):
+            seen.append(router.db_for_read(Article))
+            if write:
+                await sync_to_async(router.db_for_write)(Article)
+                seen.append(router.db_for_read(Article))
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def send(message):
+            sent.append(message)
+
+        headers = [(b'cookie', cookie.encode())] if cookie else []
+        scope = {'type': 'http', 'method': method, 'path': '/', 'query_string': b'', 'headers': headers}
+        async_to_sync(ReadRoutingMiddleware(endpoint))(scope, None, send)
+        return seen, dict(sent[0]['headers'])
+
+    def test_safe_requests_read_from_replicas(self):
+        seen, headers = self.route('GET')
+        self.assertEqual(seen, ['replica0'])
+        self.assertNotIn(b'set-cookie', headers)
+
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        seen, _ = self.route('GET', write=True)
+        self.assertEqual(seen, ['replica0', 'default'])
+
+    def test_writers_read_their_writes(self):
+        seen, headers = self.route('POST')
+        self.assertEqual(seen, ['default'])
+        self.assertIn(b'read_primary=1; Max-Age=5', headers[b'set-cookie'])
+        seen, _ = self.route('GET', cookie='theme=dark; read_primary=1')
+        self.assertEqual(seen, ['default'])
+
+    def test_code_outside_requests_uses_the_primary(self):
+        self.assertEqual(router.db_for_read(Article), 'default')
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_cached_responses_are_built_from_the_primary(self):
+        seen = []
+
+        async def build():
+            seen.append(router.db_for_read(Article))
+            return {}
+
+        async def endpoint(scope, receive, send):
+            await cached_response(make_request(), 'routing', (), build)
+            seen.append(router.db_for_read(Article))
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def send(message):
+            pass
+
+        cache.clear()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'headers': []}
+        async_to_sync(ReadRoutingMiddleware(endpoint))(scope, None, send)
+        self.assertEqual(seen, ['default', 'replica0'])
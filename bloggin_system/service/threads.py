@@ -0,0 +1,78 @@
+"""Comment threads: a page of comments at one level, each with its replies
+nested a few levels deep, in two queries however large the thread.
+
+The page is a keyset range of the (article, parent, path) index. Because
+a comment's path extends its parent's, every reply below the page lies
+between the first and the last item's path, so the nested replies are
+one range of the (article, path) index, cut to the first few replies
+under each comment by a window function. Whatever is left out comes with
+a `replies_cursor` for GET /comments/{id}/replies/."""
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Comment
+from .pagination import apaginate, clamp_limit, encode_cursor
+from .queries import ashape_rows, values_queryset
+from .schemas import CommentSerializer
+
+ORDERING = ('path',)
+
+# Sorts after every digit, so `path + END` bounds a subtree from above.
+END = '~'
+
+
+def _replies_queryset(article_id, first_path, last_path, depths, per_comment):
+    rows = values_queryset(
+        Comment.objects.filter(
+            article_id=article_id, path__gt=first_path, path__lt=last_path + END, depth__range=depths,
+        ),
+        CommentSerializer, ORDERING,
+    )
+    # One row past the limit tells that a comment has more replies.
+    return rows.annotate(
+        sibling=Window(RowNumber(), partition_by=F('parent_id'), order_by=F('path').asc()),
+    ).filter(sibling__lte=per_comment + 1).order_by('path')
+
+
+def _start(item, path, max_depth):
+    item['replies'] = []
+    # Replies below the depth limit are left for the client to ask for.
+    item['replies_cursor'] = encode_cursor([path]) if item['depth'] == max_depth and item['reply_count'] else None
+
+
+async def thread_page(article_id, parent=None, cursor=None, limit=None, depth=None, replies=None):
+    """A page of the comments directly under `parent` (a Comment, or None
+    for the article's top-level comments) as {"items": [...],
+    "next_cursor": ...}, oldest first, with up to `replies` replies nested
+    under each comment for `depth` levels."""
+    depth = settings.COMMENT_REPLY_DEPTH if depth is None else depth
+    per_comment = clamp_limit(replies or settings.COMMENT_REPLIES_PER_COMMENT)
+    children = Comment.objects.filter(article_id=article_id, parent=parent)
+    rows, next_cursor = await apaginate(values_queryset(children, CommentSerializer, ORDERING), ORDERING, cursor, limit)
+    items = await ashape_rows(Comment, rows, CommentSerializer)
+    page_depth = parent.depth + 1 if parent is not None else 0
+    max_depth = page_depth + depth
+    nodes = {}
+    paths = {}
+    for row, item in zip(rows, items):
+        _start(item, row['path'], max_depth)
+        nodes[item['id']] = item
+    if items and depth:
+        queryset = _replies_queryset(
+            article_id, rows[0]['path'], rows[-1]['path'], (page_depth + 1, max_depth), per_comment,
+        )
+        reply_rows = [row async for row in queryset]
+        # Ordered by path, so every reply comes after its parent.
+        for row, item in zip(reply_rows, await ashape_rows(Comment, reply_rows, CommentSerializer)):
+            parent_item = nodes.get(item['parent_id'])
+            if parent_item is None:
+                continue  # under a reply that was itself left out
+            if len(parent_item['replies']) == per_comment:
+                parent_item['replies_cursor'] = encode_cursor([paths[parent_item['replies'][-1]['id']]])
+                continue
+            _start(item, row['path'], max_depth)
+            parent_item['replies'].append(item)
+            nodes[item['id']] = item
+            paths[item['id']] = row['path']
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,161 @@
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from redis.exceptions import RedisError, ResponseError
+
+from .executor import run_sync
+from .models import Article
+from .redis_client import get_redis
+
+PENDING_KEY = 'views:pending'
+FLUSHING_PREFIX = 'views:flushing:'
+TRENDING_KEY = 'views:trending'
+TRENDING_DECAYED_KEY = 'views:trending:decayed_at'
+
+logger = logging.getLogger(__name__)
+
+
+class ViewBuffer:
+    """Views counted in process memory and handed on in batches, once
+    VIEW_BUFFER_MAX_PENDING views have piled up or VIEW_BUFFER_FLUSH_SECONDS
+    have passed, so a page view costs a dict update rather than a write."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.pending = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, article_id):
+        """Count one view; returns the drained counts when a batch is due."""
+        with self.lock:
+            self.counts[article_id] += 1
+            self.pending += 1
+            due = (
+                self.pending >= settings.VIEW_BUFFER_MAX_PENDING
+                or time.monotonic() - self.started >= settings.VIEW_BUFFER_FLUSH_SECONDS
+            )
+            return self._drain() if due else None
+
+    def drain(self):
+        with self.lock:
+            return self._drain()
+
+    def _drain(self):
+        counts, self.counts = self.counts, Counter()
+        self.pending = 0
+        self.started = time.monotonic()
+        return counts
+
+
+view_buffer = ViewBuffer()
+
+
+async def record_view(article_id):
+    counts = view_buffer.add(article_id)
+    if counts:
+        await run_sync(push_views, counts)
+
+
+def push_views(counts):
+    """Hand a batch of {article_id: views} on: into Redis for the periodic
+    flush and the trending set, or straight to the database without Redis
+    or when it cannot be reached (the views then miss the trending set)."""
+    redis = get_redis()
+    if redis is None:
+        apply_view_counts(counts)
+        return
+    pipe = redis.pipeline(transaction=False)
+    for article_id, views in counts.items():
+        pipe.hincrby(PENDING_KEY, article_id, views)
+        pipe.zincrby(TRENDING_KEY, views, article_id)
+    try:
+        pipe.execute()
+    except RedisError:
+        logger.warning('Could not push %s article views to Redis; writing them directly', len(counts), exc_info=True)
+        apply_view_counts(counts)
+
+
+def apply_view_counts(counts):
+    """Add {article_id: views} to Article.view_count, one UPDATE per batch."""
+    items = sorted(counts.items())
+    for start in range(0, len(items), 500):
+        batch = items[start:start + 500]
+        Article.objects.filter(pk__in=[article_id for article_id, _ in batch]).update(
+            view_count=F('view_count') + Case(*(When(pk=article_id, then=Value(views)) for article_id, views in batch)),
+        )
+
+
+def _claim(redis, key):
+    # Read and delete in one MULTI, so of two flushes that find the same
+    # hash only one gets its counts.
+    pipe = redis.pipeline()
+    pipe.hgetall(key)
+    pipe.delete(key)
+    fields, _ = pipe.execute()
+    return {int(article_id): int(views) for article_id, views in fields.items()}
+
+
+def flush_view_counts():
+    """Move the views aggregated in Redis into the database, and decay the
+    trending scores. Returns the number of articles updated.
+
+    The pending hash is renamed before it is read, so views recorded during
+    the flush land in a fresh hash; a renamed hash left behind by a crashed
+    flush is picked up by the next one. Each is taken out of Redis before
+    its counts are written, so none is counted twice, and its counts are
+    put back if writing them fails."""
+    redis = get_redis()
+    if redis is None:
+        return 0
+    try:
+        redis.rename(PENDING_KEY, f'{FLUSHING_PREFIX}{uuid.uuid4().hex}')
+    except ResponseError:
+        pass  # nothing was recorded since the last flush
+    updated = 0
+    for key in redis.scan_iter(f'{FLUSHING_PREFIX}*'):
+        counts = _claim(redis, key)
+        try:
+            apply_view_counts(counts)
+        except Exception:
+            pipe = redis.pipeline(transaction=False)
+            for article_id, views in counts.items():
+                pipe.hincrby(PENDING_KEY, article_id, views)
+            pipe.execute()
+            raise
+        updated += len(counts)
+    decay_trending(redis)
+    return updated
+
+
+def decay_factor(elapsed, half_life):
+    return math.pow(0.5, elapsed / half_life)
+
+
+def decay_trending(redis, now=None):
+    """Scale every trending score by how much time passed since the last
+    decay, halving them every TRENDING_HALF_LIFE seconds, so recent views
+    outweigh old ones; then trim the set to TRENDING_MAX_SIZE members."""
+    now = now or time.time()
+    last = redis.set(TRENDING_DECAYED_KEY, now, get=True)
+    if last is not None:
+        factor = decay_factor(now - float(last), settings.TRENDING_HALF_LIFE)
+        redis.zunionstore(TRENDING_KEY, {TRENDING_KEY: factor})
+    redis.zremrangebyrank(TRENDING_KEY, 0, -settings.TRENDING_MAX_SIZE - 1)
+
+
+async def trending_ids(limit):
+    """Article ids by decayed view score, or by all-time views of the
+    published articles without Redis."""
+    redis = get_redis()
+    if redis is None:
+        articles = Article.objects.published().order_by('-view_count', '-id')
+        return [pk async for pk in articles.values_list('pk', flat=True)[:limit]]
+    members = await run_sync(redis.zrevrange, TRENDING_KEY, 0, limit - 1)
+    return [int(member) for member in members]